@@ -63,6 +63,12 @@ CREATE TABLE DeviceStateLog (
 	)
 );
 
+-- Indexes for keyset pagination and filtering of the activity log
+CREATE INDEX idx_devicestatelog_date ON DeviceStateLog (Date, Log_Id);
+CREATE INDEX idx_devicestatelog_device ON DeviceStateLog (Device_Id, Log_Id);
+CREATE INDEX idx_devicestatelog_user ON DeviceStateLog (User_Id, Log_Id);
+CREATE INDEX idx_devicestatelog_rule ON DeviceStateLog (Rule_Id, Log_Id);
+
 -- Insert Users
 INSERT INTO Users (Name,username, pass, Date_of_Birth, Social_Security_Number)
 VALUES 
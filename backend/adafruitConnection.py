@@ -1,7 +1,25 @@
-from Adafruit_IO import MQTTClient, Client
-import sys
 import random
 import threading
+import time
+from sensorCache import LatestValueCache, utc_timestamp
+from asyncClients import run_blocking
+from sensorHistory import SeriesStore
+from sensorArchive import SensorArchive
+from broadcaster import get_broadcaster
+from transport import create_rest_client, create_async_rest_client, create_mqtt_client
+from ingestSupervisor import IngestSupervisor, AIO_ACCOUNTS
+from commandDispatcher import CommandDispatcher
+from commandScheduler import CommandScheduler
+from ruleEngine import RuleEngine
+from deviceRegistry import DeviceRegistry
+from anomalyDetector import AnomalyDetector, FIRE_ALERT_LOCATION
+from deviceLogger import log_device_action
+from metrics import MQTT_MESSAGES, MQTT_PROCESSING, MQTT_LAST_MESSAGE, track_upstream
+from queueLogging import get_logger
+from responseCache import get_response_cache, feed_tag
+from sharedState import (INGEST_MODE, EventLogWriter, EventLogFollower, SharedCommandQueue, get_shared_store)
+
+log = get_logger("MQTT")
 
 # Adafruit IO Credentials
 AIO_FEED_IDS = ["color change", "fan", "humid", "light", "switch", "temp", "text"]
@@ -9,45 +27,235 @@ AIO_FEED_IDS = ["color change", "fan", "humid", "light", "switch", "temp", "text
 # AIO_KEY = "aio_WBHq87FviEQv7pz1g5RI0ylV4zox"
 AIO_USERNAME = "CheemsPoGgErs"
 AIO_KEY = "aio_yWPS23VqhFc5LmkAYpQW7ZrpaeMx"
+# Device role -> feed of this account, what users without registered devices are served from
+FEED_ROLES = {
+    "color": AIO_FEED_IDS[0],
+    "fan": AIO_FEED_IDS[1],
+    "humid": AIO_FEED_IDS[2],
+    "light": AIO_FEED_IDS[3],
+    "switch": AIO_FEED_IDS[4],
+    "temp": AIO_FEED_IDS[5],
+    "text": AIO_FEED_IDS[6],
+}
+
+# Adafruit IO REST API Client and the async REST client (shared keep-alive connection pool,
+# used by the API routes), built on first use by get_aio() / get_aio_async() unless one was
+# assigned here before. AIO_TRANSPORT picks Adafruit IO, a local broker or an in-process fake
+# (see transport.py). MQTT connections are owned by the ingest supervisor below
+aio = None
+aio_async = None
+clients_lock = threading.Lock()
+
+# Latest value of every feed, kept up to date by the MQTT subscriber
+latest_values = LatestValueCache(AIO_FEED_IDS)
 
-# Create Adafruit IO REST API Client
-aio = Client(AIO_USERNAME, AIO_KEY)
+# Bounded in-memory time series of every numeric feed, filled by the MQTT subscriber
+history_store = SeriesStore(AIO_FEED_IDS)
 
-# Create Adafruit IO MQTT Client
-mqtt_client = MQTTClient(AIO_USERNAME, AIO_KEY)
+# Every numeric value on disk, compacted into hourly / daily aggregates as it ages (see sensorArchive.py)
+history_archive = SensorArchive()
 
 def get_aio():
+    global aio
     if aio is None:
-        raise Exception("Adafruit IO client not initialized!")
+        with clients_lock:
+            if aio is None:
+                aio = create_rest_client(AIO_USERNAME, AIO_KEY)
     return aio
 
+def get_aio_async():
+    global aio_async
+    if aio_async is None:
+        with clients_lock:
+            if aio_async is None:
+                aio_async = create_async_rest_client(AIO_USERNAME, AIO_KEY)
+    return aio_async
+
+def prepare_clients():
+    # Start-up warm-up: both REST clients built and ready before the first request needs them
+    get_aio()
+    get_aio_async().prepare()
+
+async def close_clients():
+    # Only the async client holds connections, and only if it was ever used
+    if aio_async is not None:
+        await aio_async.aclose()
+
+# One supervised MQTT connection per account: this one (primary, plain feed keys) and every
+# account of AIO_ACCOUNTS (feeds named "account/key"). Messages are handled on a worker pool
+ingest_supervisor = IngestSupervisor(create_mqtt_client, lambda client, feed_id, payload: message(client, feed_id, payload))
+ingest_supervisor.add_shard(AIO_USERNAME, AIO_USERNAME, AIO_KEY, feeds=AIO_FEED_IDS, primary=True)
+for account, account_key in AIO_ACCOUNTS.items():
+    ingest_supervisor.add_shard(account, account, account_key)
+
+def get_ingest_supervisor():
+    return ingest_supervisor
+
 def get_mqtt():
+    mqtt_client = ingest_supervisor.client()
     if mqtt_client is None:
-        raise Exception("Adafruit MQTT client not initialized!")
+        raise Exception("Adafruit MQTT client not connected!")
     return mqtt_client
 
-#### API section
-latest_temp = None
+def publish_command(feed_id, value):
+    ingest_supervisor.publish(feed_id, value)
 
-#### Ada Fruit Connection Section
-def connected(client):
-    print("Connected to Adafruit IO!")
-    for feed in AIO_FEED_IDS:
-        client.subscribe(feed)  # Subscribe to all feeds
+# Coalescing, rate-limited queue in front of the MQTT publisher for device commands. An API worker
+# of a multi-worker deployment hands them to the ingest process instead (see sharedState.py)
+if INGEST_MODE == "worker":
+    command_dispatcher = SharedCommandQueue(get_shared_store())
+else:
+    command_dispatcher = CommandDispatcher(publish_command)
+
+def get_dispatcher():
+    return command_dispatcher
+
+async def run_command(func, *args):
+    """
+    Call a command submitting function (dispatcher submit, submit_actions) from the event loop.
+    The shared queue of an API worker writes to SQLite, so it is called on the I/O thread pool.
+    """
+    if INGEST_MODE == "worker":
+        return await run_blocking(func, *args)
+    return func(*args)
+
+def record_rule_action(rule, feed_id, activities):
+    log_device_action(activities, feed_id, rule_id=rule.rule_id, device_id=rule.device_id)
+
+def rule_feed(rule, feed):
+    # A rule's command goes to the feed of the rule's device for that role, when the device is registered
+    device = device_registry.device(rule.device_id) if rule.device_id is not None else None
+    role = feed_role(feed)
+    if device is None or role is None:
+        return feed
+    if device.role == role and device.feed is not None:
+        return device.feed
+    return device_registry.resolve(device.user_id, role)[0]
+
+# Automation rules, checked against every value received over MQTT. The feeds of registered
+# devices are added as the registry finds them
+rule_engine = RuleEngine(command_dispatcher.submit, record_rule_action, AIO_FEED_IDS, route=rule_feed)
+
+def get_rule_engine():
+    return rule_engine
+
+def subscribe_feeds(feeds):
+    # Feeds of newly registered devices, resubscribed by the supervisor on every reconnect
+    history_store.track(feeds)
+    rule_engine.add_feeds(feeds)
+    ingest_supervisor.subscribe(feeds)
+
+# User -> devices -> feeds, loaded from DeviceSensor
+device_registry = DeviceRegistry(FEED_ROLES, on_new_feeds=subscribe_feeds)
+
+def get_device_registry():
+    return device_registry
+
+def submit_actions(user_id, actions, activity_prefix=""):
+    """
+    Queue (role, value, activity) device actions of a user as one unit, in order, and log them.
+    Every device is resolved before anything is queued, so a failure queues none of them.
+    """
+    resolved = [(*device_registry.resolve(user_id, role), value, activity) for role, value, activity in actions]
+    queued = command_dispatcher.submit_many([(feed_id, value) for feed_id, _, value, _ in resolved])
+    for feed_id, device_id, _, activity in resolved:
+        log_device_action(activity_prefix + activity, feed_id, user_id=user_id, device_id=device_id)
+    return queued
+
+# Delayed and recurring device commands, held in memory by the process that accepted them
+command_scheduler = CommandScheduler(
+    lambda entry: submit_actions(entry["owner"], entry["actions"], "Scheduled: "))
+
+def get_scheduler():
+    return command_scheduler
+
+ROLES_BY_FEED = {feed: role for role, feed in FEED_ROLES.items()}
+
+def feed_role(feed_id):
+    device = device_registry.device_for_feed(feed_id)
+    return device.role if device is not None else ROLES_BY_FEED.get(feed_id)
 
-def disconnected(client):
-    print("Disconnected from Adafruit IO!")
-    sys.exit(1)
+def feed_location(feed_id):
+    device = device_registry.device_for_feed(feed_id)
+    return device.name if device is not None and device.name else FIRE_ALERT_LOCATION
+
+# Fire, out of range and anomaly alerts from the sensor values, pushed to WebSocket clients
+anomaly_detector = AnomalyDetector(lambda message: get_broadcaster().publish(message), feed_role, feed_location)
+
+def get_anomaly_detector():
+    return anomaly_detector
+
+def get_latest_cache():
+    return latest_values
+
+def get_history_store():
+    return history_store
+
+def get_history_archive():
+    return history_archive
+
+#### Multi-worker mode (see sharedState.py)
+# Ingest process: every value received is appended to the shared event log
+event_log = EventLogWriter(get_shared_store(), lambda: ingest_supervisor.health())
+
+def get_event_log():
+    return event_log
+
+def follow_value(feed_id, payload, timestamp_ms, live: bool = True):
+    # API worker: a value the ingest process received, applied as it would have been here.
+    # Values replayed at start-up (live=False) only fill the caches and history
+    apply_value(feed_id, payload, timestamp_ms, age=max(0.0, time.time() - timestamp_ms / 1000), live=live)
+
+# API worker: follows the event log into this process's caches
+event_follower = EventLogFollower(get_shared_store(), follow_value, lambda tag: get_response_cache().invalidate(tag))
+
+def get_event_follower():
+    return event_follower
+
+def share_invalidation(tag):
+    try:
+        get_shared_store().publish_tag(tag)
+    except Exception as e:
+        log.error("Could not share the invalidation of %s: %s", tag, e)
+
+def ingest_health():
+    # The MQTT connections of this process, or those of the ingest process for an API worker
+    if INGEST_MODE == "worker":
+        return get_shared_store().heartbeat("ingest")
+    return ingest_supervisor.health()
+
+def request_reload(target):
+    # Rules and devices changed in the database: the ingest process reloads them too ("rules" or "devices")
+    if INGEST_MODE == "worker":
+        get_shared_store().queue("reload", target)
+
+#### Ada Fruit Connection Section
+def apply_value(feed_id, payload, timestamp_ms, age: float = 0.0, live: bool = True):
+    # What the API serves from a value: latest cache, history, cached responses, WebSocket clients, alerts
+    latest = latest_values.update(feed_id, payload, utc_timestamp(timestamp_ms / 1000), age)
+    history_store.add(feed_id, payload, timestamp_ms)
+    get_response_cache().invalidate(feed_tag(feed_id))
+    if not live:
+        return  # Old value: not news for WebSocket clients, and a burst of them would look like anomalies
+    # Push to WebSocket clients, the broadcaster hands it over to the asyncio loop
+    get_broadcaster().publish({"type": "sensor", "feed": feed_id, **latest})
+    anomaly_detector.evaluate(feed_id, payload)
 
 def message(client, feed_id, payload):
-    global latest_temp
-    print(f"Received: {feed_id} = {payload}")
-    if feed_id == AIO_FEED_IDS[5]:
-        latest_temp = payload  # Store latest temperature
+    started = time.perf_counter()
+    log.debug("Received: %s = %s", feed_id, payload)
+    timestamp_ms = int(time.time() * 1000)
+    apply_value(feed_id, payload, timestamp_ms)
+    history_archive.add(feed_id, payload, timestamp_ms)
+    event_log.add(feed_id, payload, timestamp_ms)
+    rule_engine.evaluate(feed_id, payload)
+    MQTT_MESSAGES.inc(feed_id)
+    MQTT_LAST_MESSAGE.set(time.time(), feed_id)
+    MQTT_PROCESSING.observe(time.perf_counter() - started, feed_id)
 
 def publish_random_data(client, id):
     value = random.randint(0, 100)  # Generate a random value
-    print(f"Publishing {value:.2f} to {AIO_FEED_IDS[id]}")
+    log.info("Publishing %.2f to %s", value, AIO_FEED_IDS[id])
     client.publish( AIO_FEED_IDS[id] , value)
     
 # def random_loop(client):
@@ -57,21 +265,31 @@ def publish_random_data(client, id):
 #         time.sleep(5)
 #     print("Random loop stopped.")
 
-#  Start MQTT Client in a separate thread
+#  Start the MQTT connections, each one connects and reconnects on its own thread
 def start_mqtt():
-    try:
-        mqtt_client.on_message = message
-        mqtt_client.on_connect = connected
-        mqtt_client.on_disconnect = disconnected
-        mqtt_client.connect()
-        mqtt_client.loop_background()
-    except Exception as e:
-        print(f"[MQTT Error] {e}")
+    ingest_supervisor.subscribe(device_registry.feeds())
+    ingest_supervisor.start()
+
+def stop_mqtt():
+    ingest_supervisor.stop()
 
 def run_mqtt_thread():
     mqtt_thread = threading.Thread(target=start_mqtt, daemon=True)
     mqtt_thread.start()
 
+# Pull the recent history of the sensor feeds once, MQTT keeps it up to date afterwards
+def seed_history(feeds):
+    for feed in feeds:
+        try:
+            with track_upstream("adafruit", "data"):
+                history_store.ensure_seeded(feed, get_aio())
+        except Exception as e:
+            log.error("History seed failed for %s: %s", feed, e)
+
+def run_seed_thread(feeds):
+    seed_thread = threading.Thread(target=seed_history, args=(feeds,), daemon=True)
+    seed_thread.start()
+
 # if __name__ == "__main__":
 #     # Start MQTT listener thread
 #     # Thread này dùng đề listen feedback từ Adafruit
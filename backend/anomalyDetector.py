@@ -0,0 +1,191 @@
+"""
+Incremental anomaly and fire detection on the sensor streams.
+
+Every value updates O(1) rolling statistics of its feed: an exponentially weighted mean and
+variance (for a z-score) and the rate of change since the previous value. The value is judged
+against the statistics from *before* it, so a spike is flagged on the message that carries it
+instead of being averaged away first. Nothing is ever recomputed from the history.
+
+Alerts are deduplicated: an alert stays raised while its condition holds and is only sent
+again once it cleared and ALERT_COOLDOWN seconds passed.
+
+    fire_alert      temp above FIRE_TEMP, or rising faster than FIRE_TEMP_RISE while anomalous;
+                    clears once temp fell FIRE_CLEAR_DROP below the value that raised it
+    data_threshold  value outside the SENSOR_LIMITS range of its sensor type
+    anomaly         |z-score| above ANOMALY_Z once ANOMALY_WARMUP values were seen
+"""
+import json
+import math
+import os
+import threading
+import time
+
+from queueLogging import get_logger
+
+log = get_logger("Anomaly")
+
+# Weight of the newest value in the rolling mean / variance (0 < alpha <= 1)
+ANOMALY_ALPHA = float(os.getenv("ANOMALY_ALPHA", "0.1"))
+# z-score beyond which a value is anomalous, and values needed before z-scores are trusted
+ANOMALY_Z = float(os.getenv("ANOMALY_Z", "4"))
+ANOMALY_WARMUP = int(os.getenv("ANOMALY_WARMUP", "20"))
+# Temperature (°C) that is a fire on its own, and rise (°C per minute) that is one when anomalous
+FIRE_TEMP = float(os.getenv("FIRE_TEMP", "50"))
+FIRE_TEMP_RISE = float(os.getenv("FIRE_TEMP_RISE", "5"))
+# °C the temperature has to fall below the value that raised a fire alert before the alert clears
+FIRE_CLEAR_DROP = float(os.getenv("FIRE_CLEAR_DROP", "5"))
+# Where fire alerts are reported for feeds that do not belong to a registered device
+FIRE_ALERT_LOCATION = os.getenv("FIRE_ALERT_LOCATION", "Home")
+# Sensor type -> [min, max] outside which a data_threshold alert is raised
+SENSOR_LIMITS = json.loads(os.getenv("SENSOR_LIMITS", '{"temp": [0, 40], "humid": [20, 90]}'))
+# Seconds before an alert that cleared may be sent again
+ALERT_COOLDOWN = float(os.getenv("ALERT_COOLDOWN", "300"))
+
+
+class FeedStats:
+    """EWMA mean and variance plus the previous value of one feed."""
+
+    __slots__ = ("alpha", "count", "mean", "variance", "last_value", "last_time")
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        self.last_value = None
+        self.last_time = None
+
+    def zscore(self, value: float) -> float:
+        if self.variance <= 0.0:
+            return 0.0
+        return (value - self.mean) / math.sqrt(self.variance)
+
+    def rate(self, value: float, now: float) -> float:
+        """Change per minute since the previous value (0 for the first one)."""
+        if self.last_time is None:
+            return 0.0
+        # Values arriving back to back (replays, bursts) are treated as one second apart
+        elapsed = max(now - self.last_time, 1.0)
+        return (value - self.last_value) * 60.0 / elapsed
+
+    def update(self, value: float, now: float):
+        if self.count == 0:
+            self.mean = value
+        else:
+            diff = value - self.mean
+            increment = self.alpha * diff
+            self.mean += increment
+            self.variance = (1.0 - self.alpha) * (self.variance + diff * increment)
+        self.count += 1
+        self.last_value = value
+        self.last_time = now
+
+
+class AnomalyDetector:
+    """
+    `notify(message)` receives each new alert as a WebSocket notification message,
+    `role_of(feed_id)` tells the sensor type of a feed (None to ignore the feed) and
+    `location_of(feed_id)` where it is.
+    """
+
+    def __init__(self, notify, role_of, location_of=None, alpha: float = ANOMALY_ALPHA,
+                 z_limit: float = ANOMALY_Z, warmup: int = ANOMALY_WARMUP, limits: dict = None,
+                 cooldown: float = ALERT_COOLDOWN):
+        self._notify = notify
+        self._role_of = role_of
+        self._location_of = location_of or (lambda feed_id: FIRE_ALERT_LOCATION)
+        self.alpha = alpha
+        self.z_limit = z_limit
+        self.warmup = warmup
+        self.limits = SENSOR_LIMITS if limits is None else limits
+        self.cooldown = cooldown
+        self._stats = {}
+        # (alert type, feed) -> notification while raised; (alert type, feed) -> time it cleared
+        self._active = {}
+        self._cleared = {}
+        self._lock = threading.Lock()
+        self._counts = {"evaluated": 0, "raised": 0, "suppressed": 0}
+
+    def evaluate(self, feed_id, payload):
+        role = self._role_of(feed_id)
+        if role not in ("temp", "humid", "light"):
+            return
+        try:
+            value = float(payload)
+        except (TypeError, ValueError):
+            return
+        now = time.monotonic()
+        raised = []
+        with self._lock:
+            stats = self._stats.get(feed_id)
+            if stats is None:
+                stats = self._stats[feed_id] = FeedStats(self.alpha)
+            warm = stats.count >= self.warmup
+            z = stats.zscore(value) if warm else 0.0
+            rate = stats.rate(value, now)
+            stats.update(value, now)
+            self._counts["evaluated"] += 1
+
+            anomalous = abs(z) > self.z_limit
+            low, high = self.limits.get(role, (None, None))
+            out_of_range = (low is not None and value < low) or (high is not None and value > high)
+            fire = role == "temp" and (value >= FIRE_TEMP or (anomalous and rate >= FIRE_TEMP_RISE))
+            raised_fire = self._active.get(("fire_alert", feed_id))
+            if raised_fire is not None:
+                # A fire does not end because the rise flattened out, only once it cooled down
+                fire = fire or value > raised_fire["data"]["value"] - FIRE_CLEAR_DROP
+
+            if self._transition("fire_alert", feed_id, fire, now):
+                location = self._location_of(feed_id)
+                raised.append(self._raise("fire_alert", feed_id, f"Possible fire at {location}: temperature {value:g}°C", {
+                    "location": location, "feed": feed_id, "value": value, "rate_per_minute": round(rate, 2)}))
+            if self._transition("data_threshold", feed_id, out_of_range, now):
+                threshold = high if high is not None and value > high else low
+                raised.append(self._raise("data_threshold", feed_id, f"{role} is {value:g}, past the limit of {threshold}", {
+                    "sensor_type": role, "feed": feed_id, "value": value, "threshold": threshold}))
+            if self._transition("anomaly", feed_id, anomalous, now):
+                raised.append(self._raise("anomaly", feed_id, f"Unusual {role} reading {value:g} (z = {z:.1f})", {
+                    "sensor_type": role, "feed": feed_id, "value": value, "zscore": round(z, 2),
+                    "mean": round(stats.mean, 2)}))
+        # Outside the lock, the broadcaster only queues the message
+        for message in raised:
+            log.warning("%s", message["notification"]["message"])
+            self._notify(message)
+
+    def _transition(self, kind, feed_id, condition, now) -> bool:
+        """True when the alert has to be raised now, False while it is raised already, clear or cooling down."""
+        key = (kind, feed_id)
+        if not condition:
+            if self._active.pop(key, None) is not None:
+                self._cleared[key] = now
+            return False
+        if key in self._active:
+            return False
+        cleared = self._cleared.get(key)
+        if cleared is not None and now - cleared < self.cooldown:
+            self._counts["suppressed"] += 1
+            return False
+        return True
+
+    def _raise(self, kind, feed_id, text, data) -> dict:
+        notification = {"type": kind, "message": text, "data": data, "timestamp": time.time()}
+        self._active[(kind, feed_id)] = notification
+        self._counts["raised"] += 1
+        return {"type": "notification", "notification": notification}
+
+    def active(self) -> list:
+        """Alerts currently raised, oldest first (sent to WebSocket clients when they connect)."""
+        with self._lock:
+            return sorted(self._active.values(), key=lambda notification: notification["timestamp"])
+
+    def feed_stats(self) -> dict:
+        with self._lock:
+            return {
+                feed_id: {"count": stats.count, "mean": round(stats.mean, 3),
+                          "stddev": round(math.sqrt(stats.variance), 3), "last": stats.last_value}
+                for feed_id, stats in self._stats.items()
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counts, "active": len(self._active), "feeds": len(self._stats)}
@@ -0,0 +1,104 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import track_upstream
+
+# Max open connections to the Adafruit IO REST API, shared by all requests
+AIO_HTTP_POOL_SIZE = int(os.getenv("AIO_HTTP_POOL_SIZE", "20"))
+AIO_HTTP_TIMEOUT = float(os.getenv("AIO_HTTP_TIMEOUT", "10"))
+# Threads available for blocking client calls (Supabase), so they never run on the event loop
+IO_THREAD_POOL_SIZE = int(os.getenv("IO_THREAD_POOL_SIZE", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=IO_THREAD_POOL_SIZE, thread_name_prefix="blocking-io")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the bounded I/O thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def query_name(query) -> str:
+    # e.g. "GET /users", the metrics label of a Supabase call
+    return f"{getattr(query, 'http_method', 'QUERY')} {getattr(query, 'path', '')}".strip()
+
+
+async def execute(query):
+    """Await a Supabase query builder, e.g. `await execute(supabase.table("users").select("*"))`."""
+    with track_upstream("supabase", query_name(query)):
+        return await run_blocking(query.execute)
+
+
+class AsyncAdafruitClient:
+    """
+    Native async version of the Adafruit IO REST calls the routers use (receive, data).
+    Requests share one httpx.AsyncClient, so TLS connections are kept alive and reused
+    instead of being opened for every call like Adafruit_IO.Client does.
+    """
+
+    def __init__(self, username, key, base_url="https://io.adafruit.com", transport=None):
+        self.username = username
+        self.key = key
+        self.base_url = base_url
+        self.transport = transport
+        self._client = None
+
+    def _http(self):
+        if self._client is None:
+            # httpx is imported with the first request, not with the app (it pulls in its CLI dependencies)
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                base_url=f"{self.base_url}/api/v2/{self.username}/",
+                headers={"X-AIO-Key": self.key},
+                timeout=AIO_HTTP_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=AIO_HTTP_POOL_SIZE,
+                    max_keepalive_connections=AIO_HTTP_POOL_SIZE,
+                ),
+                transport=self.transport,
+            )
+        return self._client
+
+    def prepare(self):
+        """Import what the calls need and create the connection pool now, rather than on the first call."""
+        from Adafruit_IO import Data  # noqa: F401
+
+        self._http()
+
+    async def _get(self, operation, path, params=None):
+        with track_upstream("adafruit", operation):
+            response = await self._http().get(path, params=params)
+            response.raise_for_status()
+        return response
+
+    async def receive(self, feed):
+        # Imported here, Adafruit_IO is slow to import (paho, requests) and only its Data class is needed
+        from Adafruit_IO import Data
+
+        response = await self._get("receive", f"feeds/{feed}/data/last")
+        return Data.from_dict(response.json())
+
+    async def data(self, feed, max_results: int = 1000):
+        """Most recent `max_results` values of a feed, newest first, following the API pagination."""
+        import httpx
+        from Adafruit_IO import Data
+
+        data = []
+        path, params = f"feeds/{feed}/data", {"limit": max_results}
+        while len(data) < max_results:
+            response = await self._get("data", path, params=params)
+            data.extend(Data.from_dict(entry) for entry in response.json())
+            next_link = response.links.get("next", {}).get("url")
+            if not next_link:
+                break
+            path = httpx.URL(next_link).copy_merge_params({"limit": max_results - len(data)})
+            params = None
+        return data[:max_results]
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import jwt
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from asyncClients import execute, run_blocking
+from supabaseClient import get_db_async
+from queueLogging import get_logger
+
+# Key used to sign access tokens. Set it explicitly so tokens survive restarts and work across workers.
+AUTH_SECRET = os.getenv("AUTH_SECRET") or secrets.token_urlsafe(32)
+AUTH_TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", str(12 * 3600)))
+# scrypt cost parameter (CPU/memory cost, power of 2). Raise it as hardware gets faster.
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14)))
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
+# How long a user record is reused before it is read from the database again
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+
+if not os.getenv("AUTH_SECRET"):
+    get_logger("Auth").warning("AUTH_SECRET is not set, using a random key: tokens are invalidated on restart.")
+
+
+#### Passwords
+def hash_password(password: str, n: int = None) -> str:
+    n = n or PASSWORD_SCRYPT_N
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=PASSWORD_SCRYPT_R, p=PASSWORD_SCRYPT_P,
+                            maxmem=256 * n * PASSWORD_SCRYPT_R)
+    return "scrypt${}${}${}${}${}".format(
+        n, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P,
+        base64.b64encode(salt).decode(), base64.b64encode(digest).decode(),
+    )
+
+def is_password_hash(stored: str) -> bool:
+    return isinstance(stored, str) and stored.startswith("scrypt$")
+
+def verify_password(password: str, stored: str) -> bool:
+    if not is_password_hash(stored):
+        # Accounts created before hashing was introduced still hold the plain password
+        return stored is not None and hmac.compare_digest(password.encode(), str(stored).encode())
+    try:
+        _, n, r, p, salt, expected = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        digest = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt), n=n, r=r, p=p,
+                                maxmem=256 * n * r)
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+def needs_rehash(stored: str) -> bool:
+    """Plain passwords and hashes made with an older cost get upgraded at the next login."""
+    if not is_password_hash(stored):
+        return True
+    _, n, r, p, _, _ = stored.split("$")
+    return (int(n), int(r), int(p)) != (PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+
+
+#### Tokens
+def issue_token(user: dict) -> str:
+    now = int(time.time())
+    claims = {"sub": str(user["user_id"]), "username": user.get("username"), "iat": now, "exp": now + AUTH_TOKEN_TTL}
+    return jwt.encode(claims, AUTH_SECRET, algorithm="HS256")
+
+# Verified tokens -> claims, so a token is only checked cryptographically once
+_verified = OrderedDict()
+_verified_lock = threading.Lock()
+
+def verify_token(token: str) -> Optional[dict]:
+    """Claims of a valid token, or None. Purely local, no database access."""
+    now = time.time()
+    with _verified_lock:
+        claims = _verified.get(token)
+        if claims is not None:
+            _verified.move_to_end(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, AUTH_SECRET, algorithms=["HS256"])
+        except jwt.PyJWTError:
+            return None
+        with _verified_lock:
+            _verified[token] = claims
+            if len(_verified) > USER_CACHE_SIZE:
+                _verified.popitem(last=False)
+    if claims["exp"] <= now:
+        return None
+    return claims
+
+
+#### User records
+class UserCache:
+    """Small TTL + LRU cache of user rows keyed by user_id."""
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, size: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[0]
+
+    def put(self, user_id, user: dict):
+        with self._lock:
+            self._entries[user_id] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+user_cache = UserCache()
+
+def public_user(user: dict) -> dict:
+    # Never send the password (hash) back to the client
+    return {key: value for key, value in user.items() if key != "pass"}
+
+async def load_user(supabase, user_id):
+    user = user_cache.get(user_id)
+    if user is None:
+        result = await execute(supabase.table("users").select("*").eq("user_id", user_id))
+        if not result.data:
+            return None
+        user = public_user(result.data[0])
+        user_cache.put(user_id, user)
+    return user
+
+
+#### FastAPI dependencies
+bearer = HTTPBearer(auto_error=False)
+
+async def get_optional_user(request: Request,
+                            credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer)):
+    """The authenticated user, or None if the request has no valid token."""
+    if credentials is None:
+        return None
+    claims = verify_token(credentials.credentials)
+    if claims is None:
+        return None
+    return await load_user(await get_db_async(request.app), int(claims["sub"]))
+
+async def get_optional_user_id(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer)):
+    """Only the user id of a valid token, without loading the user record (for hot read routes)."""
+    if credentials is None:
+        return None
+    claims = verify_token(credentials.credentials)
+    return int(claims["sub"]) if claims is not None else None
+
+async def get_current_user(user: Optional[dict] = Depends(get_optional_user)):
+    if user is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return user
+
+async def hash_password_async(password: str) -> str:
+    # scrypt is deliberately slow, keep it off the event loop
+    return await run_blocking(hash_password, password)
+
+async def verify_password_async(password: str, stored: str) -> bool:
+    return await run_blocking(verify_password, password, stored)
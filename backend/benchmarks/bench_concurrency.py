@@ -0,0 +1,93 @@
+"""
+Concurrency benchmark: latency of N parallel requests when every request has to call upstream.
+
+Compares the old blocking calls (sync Adafruit / Supabase client inside an async route)
+with the async adapter layer (pooled httpx client, Supabase on the I/O thread pool).
+Upstream services are faked with a fixed latency, nothing goes over the network.
+
+    cd backend
+    python benchmarks/bench_concurrency.py --requests 100 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import adafruitConnection
+import auth
+from asyncClients import AsyncAdafruitClient
+from common import FakeSupabase, bench_client, prepare_app, summarize, timed_requests, users_table
+from routers import login, sensor
+
+ENTRY = {"value": "25.5", "created_at": "2025-05-01T00:00:00Z"}
+
+
+def setup_app(latency):
+    # Cheap password hashing, so login measures the database round trips and not scrypt
+    auth.PASSWORD_SCRYPT_N = 16
+    app = prepare_app(FakeSupabase({"users": users_table()}, latency))
+    # Every /latest call goes upstream
+    adafruitConnection.latest_values.max_age = 0
+
+    async def handler(request):
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json=ENTRY)
+
+    adafruitConnection.aio_async = AsyncAdafruitClient("bench", "key", transport=httpx.MockTransport(handler))
+    # Done by the start-up warm-up in the server, the first request would pay for it otherwise
+    adafruitConnection.aio_async.prepare()
+    return app
+
+
+def use_blocking_calls(latency):
+    """Put back the pre-adapter behaviour: sync client calls straight from the async routes."""
+
+    async def blocking_read_latest(feed_id):
+        time.sleep(latency)
+        return {"value": ENTRY["value"], "timestamp": ENTRY["created_at"]}
+
+    async def blocking_execute(query):
+        return query.execute()
+
+    sensor.read_latest = blocking_read_latest
+    login.execute = blocking_execute
+
+
+async def measure(app, path, method, body, requests):
+    # All requests are issued at the same instant, latency includes time spent waiting on the loop
+    async with bench_client(app) as client:
+        latencies, wall = await timed_requests(client, method, path, body, requests)
+    return {**summarize(latencies, wall), "wall_s": wall}
+
+
+def report(label, result):
+    print(f"{label:<40} p50 {result['p50_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  "
+          f"max {result['max_ms']:8.1f} ms  total {result['wall_s']:6.2f} s")
+
+
+async def main(requests, latency):
+    app = setup_app(latency)
+    routes = [
+        ("/sensor/temp/latest", "GET", None),
+        ("/login/authentication", "POST", {"username": "alice", "password": "1234"}),
+    ]
+    print(f"{requests} parallel requests, upstream latency {latency * 1000:.0f} ms\n")
+    for path, method, body in routes:
+        report(f"async   {method} {path}", await measure(app, path, method, body, requests))
+
+    use_blocking_calls(latency)
+    for path, method, body in routes:
+        report(f"blocking {method} {path}", await measure(app, path, method, body, requests))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake upstream latency in seconds")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.latency))
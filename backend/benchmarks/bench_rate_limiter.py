@@ -0,0 +1,87 @@
+"""
+Microbenchmark of the per-request cost of rate limiting.
+
+- RateLimiter.hit() alone, for one hot client and for many clients cycling through the LRU
+- Full ASGI round trip through RateLimitMiddleware versus no middleware, and versus a
+  BaseHTTPMiddleware taking a threading.Lock (the design of the old ThresholdMiddleware)
+
+    cd backend
+    python benchmarks/bench_rate_limiter.py
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import PlainTextResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rateLimiter import RateLimiter, RateLimitMiddleware
+
+NO_LIMIT = {"default": (1e9, 1e9), "read": (1e9, 1e9)}
+
+
+def bench_hit(iterations, clients):
+    limiter = RateLimiter(limits=NO_LIMIT, max_buckets=max(1, clients // 2))
+    keys = [f"10.0.{i // 256}.{i % 256}" for i in range(clients)]
+    start = time.perf_counter()
+    for i in range(iterations):
+        limiter.hit(keys[i % clients], "read")
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+async def endpoint(scope, receive, send):
+    await PlainTextResponse("ok")(scope, receive, send)
+
+
+class LockedCounterMiddleware(BaseHTTPMiddleware):
+    lock = threading.Lock()
+    counter = 0
+
+    async def dispatch(self, request, call_next):
+        with self.lock:
+            LockedCounterMiddleware.counter += 1
+        return await call_next(request)
+
+
+async def bench_asgi(app, iterations):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "path": "/sensor/temp/latest", "raw_path": b"/sensor/temp/latest",
+        "query_string": b"", "headers": [], "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+        "scheme": "http", "root_path": "",
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def main(iterations):
+    print(f"RateLimiter.hit, 1 client        {bench_hit(iterations * 10, 1):8.0f} ns/op")
+    print(f"RateLimiter.hit, 10k clients LRU {bench_hit(iterations * 10, 10_000):8.0f} ns/op")
+
+    bare = await bench_asgi(endpoint, iterations)
+    limited = await bench_asgi(RateLimitMiddleware(endpoint, RateLimiter(limits=NO_LIMIT)), iterations)
+    locked = await bench_asgi(LockedCounterMiddleware(endpoint), iterations)
+    print(f"ASGI request, no middleware      {bare:8.2f} us")
+    print(f"ASGI request, RateLimitMiddleware{limited:8.2f} us  (+{limited - bare:.2f} us)")
+    print(f"ASGI request, locked BaseHTTP    {locked:8.2f} us  (+{locked - bare:.2f} us)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations))
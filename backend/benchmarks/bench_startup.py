@@ -0,0 +1,162 @@
+"""
+Cold start benchmark: how long a fresh process takes to import the app and to serve requests.
+
+- startup.import         `import main` in a new interpreter
+- startup.first_request  spawning uvicorn until GET /health/live answers 200
+- startup.ready          spawning uvicorn until GET /health/ready reports the warm-up over
+
+Every run is a new process, against the in-memory Adafruit transport and an unreachable
+Supabase URL, so nothing depends on the network. The database step of the warm-up fails then and
+/health/ready stays 503, the warm-up is over once its report has the warmup phase. The phases the server timed itself
+(imports, serving, first_request, warmup) are reported for the last run.
+
+    cd backend
+    python benchmarks/bench_startup.py --out startup.json
+    python benchmarks/bench_startup.py --baseline startup.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+import numpy as np
+
+from common import BACKEND_DIR, compare
+
+IMPORT_SCRIPT = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+
+def backend_env(supabase_url):
+    return {**os.environ, "AIO_TRANSPORT": "memory", "SENSOR_ARCHIVE_PATH": "", "SUPABASE_URL": supabase_url}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(url):
+    """(status, body) of a GET, (None, None) while nothing listens."""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except (urllib.error.URLError, ConnectionError):
+        return None, None
+
+
+def time_import(env) -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def time_server(env, timeout: float):
+    """Seconds from spawning the server to live, and to ready, plus the phases it reported."""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}/health"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    live = ready = None
+    try:
+        while ready is None:
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f"Server not ready after {timeout}s")
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            if live is None:
+                if get(base + "/live")[0] == 200:
+                    live = time.perf_counter() - started
+            else:
+                status, body = get(base + "/ready")
+                if status in (200, 503):
+                    report = json.loads(body)
+                    if "warmup" in report["phases"]:
+                        ready = time.perf_counter() - started
+            time.sleep(0.005)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return live, ready, report
+
+
+def describe(seconds) -> dict:
+    samples = np.asarray(seconds, dtype=np.float64) * 1000
+    return {
+        "runs": int(len(samples)),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "min_ms": float(samples.min()),
+        "max_ms": float(samples.max()),
+    }
+
+
+def main(args):
+    env = backend_env(args.supabase_url)
+    imports = [time_import(env) for _ in range(args.runs)]
+    lives, readies = [], []
+    for _ in range(args.runs):
+        live, ready, report = time_server(env, args.timeout)
+        lives.append(live)
+        readies.append(ready)
+    results = {
+        "startup.import": describe(imports),
+        "startup.first_request": describe(lives),
+        "startup.ready": describe(readies),
+    }
+
+    print(f"{'scenario':<28}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}{'min ms':>10}{'max ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<28}{r['runs']:>6}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['min_ms']:>10.1f}{r['max_ms']:>10.1f}")
+    print("Phases of the last run (s since startupState was imported): "
+          + ", ".join(f"{phase} {seconds:.3f}" for phase, seconds in report["phases"].items()))
+    for name, step in report["steps"].items():
+        print(f"  warm-up {name:<16}{step['status']:<8}{step['seconds']:.3f}s")
+
+    output = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "runs": args.runs,
+        },
+        "results": results,
+        "phases": report["phases"],
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        for name, metric, before, after in regressions:
+            print(f"[Regression] {name} {metric}: {before:.2f} -> {after:.2f}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds a server gets to become ready")
+    parser.add_argument("--supabase-url", default="http://127.0.0.1:9",
+                        help="Supabase URL of the server (unreachable by default: the database step fails fast and offline)")
+    parser.add_argument("--out", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative regression, e.g. 0.2 = 20%%")
+    parser.add_argument("--min-delta", type=float, default=20.0, help="Ignore changes below this many ms")
+    main(parser.parse_args())
@@ -0,0 +1,80 @@
+"""
+Size and cost of a sensor history payload in each encoding the history routes negotiate.
+
+- json            list of {"value", "timestamp"} entries, as served by default
+- json+gzip       the same, Content-Encoding: gzip (json+br too when brotli is installed)
+- columns         delta-encoded timestamps and float32 values (see wireFormat.py)
+- columns+gzip    the same, compressed
+
+Encode is what the server pays once per cached entry, decode what a client pays per response
+(json.loads / gunzip + json.loads, or decode_columns), both for `--points` samples.
+
+    cd backend
+    python benchmarks/bench_wire_format.py --points 1000
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from responseCache import dumps, compress, brotli
+from sensorHistory import format_entries
+from wireFormat import encode_columns, decode_columns
+
+
+def sample_series(points: int, seed: int = 0):
+    # A sensor reporting every ~10s with some jitter, values with one decimal like the real feeds
+    rng = np.random.default_rng(seed)
+    timestamps = 1_700_000_000_000 + np.cumsum(rng.integers(9_000, 11_000, points))
+    values = np.round(25 + np.cumsum(rng.normal(0, 0.1, points)), 1)
+    return timestamps, values
+
+
+def best_of(func, repeat: int) -> float:
+    """Fastest of `repeat` calls, in ms."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main(args):
+    timestamps, values = sample_series(args.points)
+    encodings = ["gzip"] + (["br"] if brotli is not None else [])
+    scenarios = {}
+
+    json_body = dumps(format_entries(timestamps[::-1], values[::-1]))
+    scenarios["json"] = (lambda: dumps(format_entries(timestamps[::-1], values[::-1])), json_body,
+                         lambda body: json.loads(body))
+    columns_body = encode_columns(timestamps, values)
+    scenarios["columns"] = (lambda: encode_columns(timestamps, values), columns_body, decode_columns)
+
+    for name, body in (("json", json_body), ("columns", columns_body)):
+        encode, _, decode = scenarios[name]
+        for encoding in encodings:
+            compressed = compress(body, encoding)
+            decompress = brotli.decompress if encoding == "br" else gzip.decompress
+            scenarios[f"{name}+{encoding}"] = (
+                lambda encode=encode, encoding=encoding: compress(encode(), encoding), compressed,
+                lambda data, decode=decode, decompress=decompress: decode(decompress(data)))
+
+    print(f"{args.points} points")
+    print(f"{'encoding':<16}{'bytes':>10}{'vs json':>10}{'encode ms':>12}{'decode ms':>12}")
+    for name, (encode, body, decode) in scenarios.items():
+        print(f"{name:<16}{len(body):>10}{len(body) / len(json_body):>10.1%}"
+              f"{best_of(encode, args.repeat):>12.3f}{best_of(lambda: decode(body), args.repeat):>12.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=1000, help="Samples in the history payload")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per measurement, the fastest is reported")
+    main(parser.parse_args())
@@ -0,0 +1,192 @@
+"""Helpers shared by the benchmark scripts: fake Supabase backend, in-process client and latency summaries."""
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+# Lower-is-better and higher-is-better metrics compared against the baseline
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+THROUGHPUT_METRICS = ("throughput_rps",)
+
+
+def summarize(latencies, wall: float) -> dict:
+    """Throughput and latency percentiles (ms) from per-request latencies in seconds."""
+    samples = np.asarray(latencies, dtype=np.float64) * 1000
+    return {
+        "requests": int(len(samples)),
+        "throughput_rps": len(samples) / wall if wall > 0 else 0.0,
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "max_ms": float(samples.max()),
+    }
+
+
+async def timed_requests(client: httpx.AsyncClient, method, path, body=None, requests=100, concurrency=None):
+    """
+    Issue `requests` calls with at most `concurrency` in flight (all at once if None).
+    Returns (latencies in seconds, wall time). Latency counts from when the call was issued
+    (or for a burst, from the common start), so time queued behind a blocked loop is included.
+    """
+    burst = concurrency is None or concurrency >= requests
+    semaphore = asyncio.Semaphore(concurrency or requests)
+    started = time.perf_counter()
+
+    async def one():
+        async with semaphore:
+            issued = started if burst else time.perf_counter()
+            response = await client.request(method, path, json=body)
+            response.raise_for_status()
+            return time.perf_counter() - issued
+
+    latencies = await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, time.perf_counter() - started
+
+
+def compare(results, baseline, threshold, min_delta_ms=1.0):
+    """
+    Scenarios whose latency rose or throughput fell by more than `threshold` (a fraction).
+    Latency changes smaller than `min_delta_ms` are ignored, sub-millisecond timings are mostly noise.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in LATENCY_METRICS:
+            if previous.get(metric) and current.get(metric) is not None \
+                    and current[metric] > previous[metric] * (1 + threshold) \
+                    and current[metric] - previous[metric] >= min_delta_ms:
+                regressions.append((name, metric, previous[metric], current[metric]))
+        for metric in THROUGHPUT_METRICS:
+            if previous.get(metric) and current[metric] < previous[metric] * (1 - threshold):
+                regressions.append((name, metric, previous[metric], current[metric]))
+    return regressions
+
+
+def bench_client(app) -> httpx.AsyncClient:
+    """httpx client calling the ASGI app in-process (no lifespan, no network)."""
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+
+def prepare_app(db):
+    """The FastAPI app with `db` as Supabase client and rate limiting off."""
+    from main import app
+
+    app.state.rate_limiter.enabled = False
+    app.state.db = db
+    return app
+
+
+def users_table(password: str = "1234") -> list:
+    from auth import hash_password
+
+    return [{
+        "user_id": 1, "username": "alice", "pass": hash_password(password), "email": "alice@example.com",
+        "date_of_birth": "2000-01-01", "social_security_number": "000000000",
+    }]
+
+
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    """
+    The subset of the Supabase / PostgREST query builder the routers use, over in-memory rows.
+    execute() sleeps `latency` seconds to stand in for the network round trip.
+    """
+
+    def __init__(self, rows: list, latency: float):
+        self._rows = rows
+        self._latency = latency
+        self._filters = []
+        self._order = []
+        self._limit = None
+        self._columns = "*"
+        self._insert = None
+        self._update = None
+
+    def select(self, columns="*", **kwargs):
+        self._columns = columns
+        return self
+
+    def _filter(self, column, test):
+        self._filters.append(lambda row: row.get(column) is not None and test(row.get(column)))
+        return self
+
+    def eq(self, column, value):
+        self._filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def lt(self, column, value):
+        return self._filter(column, lambda v: v < value)
+
+    def lte(self, column, value):
+        return self._filter(column, lambda v: v <= value)
+
+    def gt(self, column, value):
+        return self._filter(column, lambda v: v > value)
+
+    def gte(self, column, value):
+        return self._filter(column, lambda v: v >= value)
+
+    def in_(self, column, values):
+        values = set(values)
+        self._filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column, desc=False, **kwargs):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, count, **kwargs):
+        self._limit = count
+        return self
+
+    def insert(self, rows, **kwargs):
+        self._insert = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def update(self, values, **kwargs):
+        self._update = values
+        return self
+
+    def execute(self):
+        if self._latency:
+            time.sleep(self._latency)
+        if self._insert is not None:
+            self._rows.extend(dict(row) for row in self._insert)
+            return FakeResult(self._insert)
+        rows = [row for row in self._rows if all(test(row) for test in self._filters)]
+        if self._update is not None:
+            for row in rows:
+                row.update(self._update)
+        for column, desc in reversed(self._order):
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        if self._columns != "*":
+            columns = self._columns.split(",")
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        return FakeResult([dict(row) for row in rows])
+
+
+class FakeSupabase:
+    """In-memory stand-in for the Supabase client: `tables` maps table name -> list of row dicts."""
+
+    def __init__(self, tables: dict = None, latency: float = 0.0):
+        self.tables = tables if tables is not None else {}
+        self.latency = latency
+
+    def table(self, name):
+        return FakeQuery(self.tables.setdefault(name, []), self.latency)
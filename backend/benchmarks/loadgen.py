@@ -0,0 +1,181 @@
+"""
+Deterministic MQTT load generator for the ingest pipeline.
+
+Replays synthetic (or recorded) sensor streams across every feed in AIO_FEED_IDS at a fixed
+rate, through the backend's own MQTT subscriber (adafruitConnection.start_mqtt), and reports
+ingest throughput and publish -> processed latency. With the in-memory transport no network
+is needed, so it runs in CI.
+
+    cd backend
+    python benchmarks/loadgen.py --rate 5000 --duration 5
+    python benchmarks/loadgen.py --transport local --rate 2000     # against mosquitto on MQTT_HOST
+    python benchmarks/loadgen.py --replay recorded.csv             # rows of feed,value
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COLORS = ["#FF0000", "#2E2E2E", "#F2F2F2", "#7E3F98", "#FF00FF", "#00CFFF", "#00B050", "#FFFF00", "#F79646"]
+
+
+def synthetic_stream(feed, pattern, rng):
+    """Endless, seeded value generator for one feed."""
+    if feed == "color change":
+        return (COLORS[i] for i in itertools.cycle(rng.integers(0, len(COLORS), 1000)))
+    if feed == "text":
+        return (f"message {i}" for i in itertools.count())
+    if feed == "switch":
+        return (int(v) for v in itertools.cycle(rng.integers(0, 2, 1000)))
+    if feed == "fan":
+        return (int(v) for v in itertools.cycle(rng.integers(0, 101, 1000)))
+
+    base = {"temp": 28.0, "humid": 60.0, "light": 400.0}.get(feed, 50.0)
+    scale = {"temp": 4.0, "humid": 15.0, "light": 300.0}.get(feed, 10.0)
+    if pattern == "sine":
+        noise = rng.normal(0, scale * 0.05, 1000)
+        return (round(base + scale * np.sin(i / 200) + noise[i % 1000], 2) for i in itertools.count())
+    if pattern == "step":
+        return (base + scale * ((i // 500) % 2) for i in itertools.count())
+
+    def random_walk():
+        value = base
+        steps = rng.normal(0, scale * 0.02, 1000)
+        for i in itertools.count():
+            value = min(base + 3 * scale, max(base - 3 * scale, value + steps[i % 1000]))
+            yield round(value, 2)
+    return random_walk()
+
+
+def replay_stream(path):
+    with open(path, newline="") as f:
+        rows = [(row[0], row[1]) for row in csv.reader(f) if row]
+    return itertools.cycle(rows)
+
+
+def run(transport="memory", rate=5000, duration=5, feeds=None, pattern="sine", replay=None,
+        seed=1, drain=10, verbose=False):
+    """Run the load and return the result dict (throughput, latency percentiles)."""
+    os.environ["AIO_TRANSPORT"] = transport  # only takes effect if the backend is not imported yet
+    import adafruitConnection
+    from queueLogging import set_log_level
+    from transport import InMemoryMQTTClient, get_memory_broker
+
+    feeds = feeds.split(",") if isinstance(feeds, str) else feeds or adafruitConnection.AIO_FEED_IDS
+    rng = np.random.default_rng(seed)
+    if replay:
+        source = replay_stream(replay)
+    else:
+        streams = {feed: synthetic_stream(feed, pattern, rng) for feed in feeds}
+        source = ((feed, next(streams[feed])) for feed in itertools.cycle(feeds))
+
+    # Publish time of every in-flight message, per feed (delivery is FIFO per feed)
+    in_flight = defaultdict(deque)
+    latencies = []
+    received = [0]
+    last_received = [0.0]
+    lock = threading.Lock()
+    handle_message = adafruitConnection.message
+
+    def timed_message(client, feed_id, payload):
+        handle_message(client, feed_id, payload)
+        now = time.perf_counter()
+        with lock:
+            queue = in_flight.get(feed_id)
+            if queue:
+                latencies.append(now - queue.popleft())
+            received[0] += 1
+            last_received[0] = now
+
+    adafruitConnection.message = timed_message
+
+    if transport == "memory":
+        publisher = InMemoryMQTTClient(get_memory_broker(), "loadgen")
+    else:
+        from transport import create_mqtt_client
+        publisher = create_mqtt_client(adafruitConnection.AIO_USERNAME, adafruitConnection.AIO_KEY, transport)
+        publisher.connect()
+        publisher.loop_background()
+
+    # DEBUG logs every message received
+    set_log_level("DEBUG" if verbose else "WARNING")
+    adafruitConnection.start_mqtt()
+    if not adafruitConnection.get_ingest_supervisor().wait_connected(10.0):
+        raise SystemExit("MQTT ingest did not connect")
+
+    total = int(rate * duration)
+    interval = 1.0 / rate
+    started = time.perf_counter()
+    for sent, (feed, value) in enumerate(itertools.islice(source, total)):
+        # Pace against the schedule, not the previous message, so the average rate holds
+        target = started + sent * interval
+        delay = target - time.perf_counter()
+        if delay > 0.001:
+            time.sleep(delay)
+        with lock:
+            in_flight[feed].append(time.perf_counter())
+        publisher.publish(feed, value)
+    publish_done = time.perf_counter()
+
+    deadline = publish_done + drain
+    while time.perf_counter() < deadline:
+        with lock:
+            if received[0] >= total:
+                break
+        time.sleep(0.01)
+
+    with lock:
+        samples = np.array(latencies) * 1000
+        got = received[0]
+        elapsed = (last_received[0] or publish_done) - started
+    result = {
+        "transport": transport,
+        "feeds": len(feeds),
+        "target_rate": rate,
+        "published": total,
+        "received": got,
+        "lost": total - got,
+        "publish_rate": total / (publish_done - started),
+        "ingest_rate": got / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": float(np.percentile(samples, 50)) if len(samples) else None,
+            "p95": float(np.percentile(samples, 95)) if len(samples) else None,
+            "p99": float(np.percentile(samples, 99)) if len(samples) else None,
+            "max": float(samples.max()) if len(samples) else None,
+        },
+    }
+    adafruitConnection.message = handle_message
+    return result
+
+
+def main(args):
+    result = run(args.transport, args.rate, args.duration, args.feeds, args.pattern, args.replay,
+                 args.seed, args.drain, args.verbose)
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transport", choices=["memory", "local", "adafruit"], default="memory")
+    parser.add_argument("--rate", type=float, default=5000, help="Messages per second, over all feeds")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds of load")
+    parser.add_argument("--feeds", help="Comma separated feeds (default: all AIO_FEED_IDS)")
+    parser.add_argument("--pattern", choices=["sine", "random-walk", "step"], default="sine")
+    parser.add_argument("--replay", help="CSV file of feed,value rows to replay instead of synthetic data")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--drain", type=float, default=10, help="Max seconds to wait for in-flight messages")
+    parser.add_argument("--json", help="Also write the result to this file")
+    parser.add_argument("--verbose", action="store_true", help="Log every message the backend receives")
+    main(parser.parse_args())
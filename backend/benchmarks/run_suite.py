@@ -0,0 +1,155 @@
+"""
+Benchmark suite for the request path and the ingest pipeline.
+
+Drives the app in-process over httpx's ASGI transport with fake upstream services: the
+in-memory Adafruit transport (seeded with sensor data) and an in-memory Supabase with a fixed
+latency. Reports throughput and latency percentiles per scenario, writes them to a JSON file
+and, given a baseline from an earlier run, fails if a scenario regressed past the threshold.
+
+    cd backend
+    python benchmarks/run_suite.py --out bench.json
+    python benchmarks/run_suite.py --baseline bench.json --threshold 0.2
+    python benchmarks/run_suite.py --only sensor.temp.latest,ingest
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+from datetime import datetime, timezone
+
+# Everything runs against the in-memory broker, set before the backend is imported
+os.environ["AIO_TRANSPORT"] = "memory"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import adafruitConnection
+from common import FakeSupabase, bench_client, compare, prepare_app, summarize, timed_requests, users_table
+from queueLogging import set_log_level
+from transport import get_memory_broker
+
+# name -> (method, path, body)
+SCENARIOS = {
+    "sensor.temp.latest": ("GET", "/sensor/temp/latest", None),
+    "sensor.light.latest": ("GET", "/sensor/light/latest", None),
+    "sensor.humid.latest": ("GET", "/sensor/humid/latest", None),
+    "sensor.temp.history1000": ("GET", "/sensor/temp/history1000", None),
+    "sensor.light.history1000": ("GET", "/sensor/light/history1000", None),
+    "sensor.humid.history1000": ("GET", "/sensor/humid/history1000", None),
+    "sensor.snapshot": ("GET", "/sensor/snapshot?limit=1000", None),
+    "fan.on": ("POST", "/fan/fan/on", {"speed": 50}),
+    "fan.off": ("POST", "/fan/fan/off", None),
+    "light.on": ("POST", "/light/switch/on", None),
+    "light.color": ("POST", "/light/switch/colorchange", {"code": "#FF0000"}),
+    "login": ("POST", "/login/authentication", {"username": "alice", "password": "1234"}),
+}
+
+
+def seed_feeds(points):
+    """Fill the in-memory broker with `points` values per sensor feed, as if Adafruit IO had them."""
+    broker = get_memory_broker()
+    rng = np.random.default_rng(1)
+    for feed in (adafruitConnection.AIO_FEED_IDS[5], adafruitConnection.AIO_FEED_IDS[3], adafruitConnection.AIO_FEED_IDS[2]):
+        for value in np.round(rng.normal(30, 5, points), 2):
+            broker.publish(feed, value)
+    broker.join(timeout=10)
+
+
+async def run_http(names, requests, concurrency, login_requests, warmup):
+    results = {}
+    app = prepare_app(FakeSupabase({"users": users_table()}, latency=0.002))
+    async with bench_client(app) as client:
+        for name in names:
+            method, path, body = SCENARIOS[name]
+            count = login_requests if name == "login" else requests
+            # Warm up: fills caches and seeds the history store, like a server that has been running
+            await timed_requests(client, method, path, body, warmup, concurrency)
+            latencies, wall = await timed_requests(client, method, path, body, count, concurrency)
+            results[name] = summarize(latencies, wall)
+    return results
+
+
+def run_ingest(rate, duration, verbose=False):
+    from loadgen import run
+
+    result = run(transport="memory", rate=rate, duration=duration, verbose=verbose)
+    latency = result["latency_ms"]
+    return {
+        "requests": result["received"],
+        "throughput_rps": result["ingest_rate"],
+        "p50_ms": latency["p50"],
+        "p95_ms": latency["p95"],
+        "p99_ms": latency["p99"],
+        "max_ms": latency["max"],
+        "lost": result["lost"],
+    }
+
+
+def report(results):
+    print(f"{'scenario':<28}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<28}{r['throughput_rps']:>10.0f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+              f"{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}")
+
+
+def main(args):
+    names = args.only.split(",") if args.only else list(SCENARIOS) + ["ingest"]
+    unknown = [name for name in names if name != "ingest" and name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}. Available: {', '.join(list(SCENARIOS) + ['ingest'])}")
+
+    set_log_level("DEBUG" if args.verbose else "WARNING")
+    seed_feeds(args.seed_points)
+    # Device commands are published over MQTT, as in the running server
+    adafruitConnection.start_mqtt()
+    adafruitConnection.get_ingest_supervisor().wait_connected(10.0)
+    results = asyncio.run(run_http([name for name in names if name != "ingest"], args.requests,
+                                   args.concurrency, args.login_requests, args.warmup))
+    # Ingest last: its burst of sensor values would otherwise change what the HTTP scenarios measure
+    if "ingest" in names:
+        results["ingest"] = run_ingest(args.ingest_rate, args.ingest_duration, args.verbose)
+
+    report(results)
+    output = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        for name, metric, before, after in regressions:
+            print(f"[Regression] {name} {metric}: {before:.2f} -> {after:.2f}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per HTTP scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="Requests in flight at once")
+    parser.add_argument("--login-requests", type=int, default=50, help="Requests for login (scrypt is slow on purpose)")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed-points", type=int, default=1000, help="Values preloaded per sensor feed")
+    parser.add_argument("--ingest-rate", type=float, default=5000, help="MQTT messages per second")
+    parser.add_argument("--ingest-duration", type=float, default=3)
+    parser.add_argument("--only", help="Comma separated scenarios to run (default: all)")
+    parser.add_argument("--out", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative regression, e.g. 0.2 = 20%%")
+    parser.add_argument("--min-delta", type=float, default=1.0, help="Ignore latency changes below this many ms")
+    parser.add_argument("--verbose", action="store_true", help="Log at DEBUG level, every MQTT message included")
+    main(parser.parse_args())
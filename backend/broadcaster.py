@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+# Messages buffered per WebSocket client before the oldest ones are dropped
+WS_CLIENT_QUEUE_SIZE = int(os.getenv("WS_CLIENT_QUEUE_SIZE", "100"))
+
+
+class Subscriber:
+    """One connected client: a bounded queue plus the feeds it wants (None = everything)."""
+
+    def __init__(self, queue_size: int):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.feeds = None
+        self.dropped = 0
+
+    def wants(self, message) -> bool:
+        feed = message.get("feed")
+        return self.feeds is None or feed is None or feed in self.feeds
+
+    def offer(self, message):
+        # Slow consumer: make room by dropping the oldest message instead of blocking the others
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+class Broadcaster:
+    """
+    Fans messages out to every WebSocket subscriber.
+    publish() can be called from any thread (e.g. the MQTT callback), the actual
+    fan-out always runs on the asyncio loop the broadcaster is attached to.
+    """
+
+    def __init__(self, queue_size: int = WS_CLIENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._loop = None
+        self._subscribers = set()
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def detach(self):
+        self._loop = None
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def stats(self) -> dict:
+        subscribers = tuple(self._subscribers)
+        depths = [subscriber.queue.qsize() for subscriber in subscribers]
+        return {
+            "clients": len(subscribers),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "dropped": sum(subscriber.dropped for subscriber in subscribers),
+        }
+
+    def publish(self, message: dict):
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self._subscribers:
+            return
+        loop.call_soon_threadsafe(self._fan_out, message)
+
+    def _fan_out(self, message: dict):
+        for subscriber in tuple(self._subscribers):
+            if subscriber.wants(message):
+                subscriber.offer(message)
+
+
+broadcaster = Broadcaster()
+
+def get_broadcaster():
+    return broadcaster
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import track_upstream
+from queueLogging import get_logger
+
+log = get_logger("Command")
+
+# Updates to the same feed within this window (seconds) are merged, the last value wins
+COMMAND_COALESCE_WINDOW = float(os.getenv("COMMAND_COALESCE_WINDOW", "0.3"))
+# Adafruit IO publish budget (free plan: 30 data points per minute) and allowed burst
+COMMAND_RATE_PER_MINUTE = float(os.getenv("COMMAND_RATE_PER_MINUTE", "30"))
+COMMAND_BURST = int(os.getenv("COMMAND_BURST", "5"))
+
+
+class CommandDispatcher:
+    """
+    Queue in front of the MQTT publisher for device commands.
+    - At most one pending command per feed: a newer value replaces the queued one (last write wins).
+    - A command is held for `window` seconds so a burst (slider drag, color clicking) becomes one publish.
+    - Publishes are paced by a token bucket matching the Adafruit IO rate budget.
+    Handlers call submit() and return right away, a background thread does the publishing.
+    """
+
+    def __init__(self, publish, window: float = COMMAND_COALESCE_WINDOW,
+                 rate_per_minute: float = COMMAND_RATE_PER_MINUTE, burst: int = COMMAND_BURST):
+        self._publish = publish
+        self.window = window
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+
+        # feed -> [value, time first queued]
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._stats = {"submitted": 0, "coalesced": 0, "published": 0, "failed": 0}
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="command-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, flush: bool = True):
+        """Stop the publisher thread, publishing whatever is still queued if `flush`."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+            pending = list(self._pending.items()) if flush else []
+            self._pending.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        for feed, (value, _) in pending:
+            self._send(feed, value)
+
+    def submit(self, feed, value) -> dict:
+        self.start()
+        with self._cond:
+            self._stats["submitted"] += 1
+            entry = self._pending.get(feed)
+            if entry is not None:
+                # Keep the original queue time so a continuous stream of updates cannot postpone the publish forever
+                entry[0] = value
+                self._stats["coalesced"] += 1
+                coalesced = True
+            else:
+                self._pending[feed] = [value, time.monotonic()]
+                coalesced = False
+            self._cond.notify()
+            depth = len(self._pending)
+        return {"status": "queued", "coalesced": coalesced, "queue_depth": depth}
+
+    def submit_many(self, commands) -> dict:
+        """
+        Queue (feed, value) commands as one unit: the publisher sees all of them or none, and
+        publishes them in the order given (a feed already queued moves behind the ones before it).
+        """
+        self.start()
+        with self._cond:
+            now = time.monotonic()
+            coalesced = 0
+            for feed, value in commands:
+                self._stats["submitted"] += 1
+                entry = self._pending.get(feed)
+                if entry is not None:
+                    entry[0] = value
+                    self._pending.move_to_end(feed)
+                    self._stats["coalesced"] += 1
+                    coalesced += 1
+                else:
+                    self._pending[feed] = [value, now]
+            self._cond.notify()
+            depth = len(self._pending)
+        return {"status": "queued", "coalesced": coalesced, "queue_depth": depth}
+
+    @property
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "queue_depth": len(self._pending), "tokens": round(self._tokens, 2)}
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _next_command(self):
+        # Block until a command is due and there is publish budget for it. Returns None on stop.
+        with self._cond:
+            while self._running:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                feed, (value, queued_at) = next(iter(self._pending.items()))
+                due_in = queued_at + self.window - now
+                if due_in > 0:
+                    self._cond.wait(due_in)
+                    continue
+                self._refill(now)
+                if self._tokens < 1:
+                    self._cond.wait((1 - self._tokens) / self.rate)
+                    continue
+                self._tokens -= 1
+                del self._pending[feed]
+                return feed, value
+            return None
+
+    def _send(self, feed, value):
+        try:
+            log.info("Publishing %s to %s", value, feed)
+            with track_upstream("mqtt", "publish"):
+                self._publish(feed, value)
+            with self._cond:
+                self._stats["published"] += 1
+        except Exception as e:
+            with self._cond:
+                self._stats["failed"] += 1
+            log.error("%s = %s: %s", feed, value, e)
+
+    def _run(self):
+        while True:
+            command = self._next_command()
+            if command is None:
+                return
+            self._send(*command)
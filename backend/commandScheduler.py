@@ -0,0 +1,210 @@
+"""
+Delayed and recurring device commands ("fan off in 30 minutes", "light on every day at 7").
+
+Pending commands sit in a hashed timing wheel: a ring of `slots` buckets of `tick` seconds each.
+A timer goes into the bucket of its due tick and also records how many more turns of the ring it
+must wait, so scheduling and cancelling are O(1) and each tick only looks at one bucket, however
+many timers are pending (a heap would pay O(log n) per operation, a sorted list O(n) to insert).
+Timers fire on a background thread with up to `tick` seconds of delay.
+"""
+import itertools
+import math
+import os
+import threading
+import time
+
+from queueLogging import get_logger
+
+log = get_logger("Scheduler")
+
+# Scheduled commands held at most, over all users
+COMMAND_SCHEDULE_MAX = int(os.getenv("COMMAND_SCHEDULE_MAX", "10000"))
+# Shortest interval of a recurring command, in seconds (the publish budget is 30 per minute)
+COMMAND_SCHEDULE_MIN_INTERVAL = float(os.getenv("COMMAND_SCHEDULE_MIN_INTERVAL", "10"))
+
+# Resolution of the wheel and ticks per turn: one turn is a minute, later timers wait for their turn
+WHEEL_TICK = 0.1
+WHEEL_SLOTS = 600
+
+
+class Timer:
+    __slots__ = ("timer_id", "due", "rounds", "slot", "payload")
+
+    def __init__(self, timer_id, due: float, payload):
+        self.timer_id = timer_id
+        self.due = due
+        self.rounds = 0
+        self.slot = 0
+        self.payload = payload
+
+
+class TimingWheel:
+    """Hashed timing wheel over monotonic time. Not thread-safe, the scheduler holds the lock."""
+
+    def __init__(self, tick: float = WHEEL_TICK, slots: int = WHEEL_SLOTS, now: float = None):
+        self.tick = tick
+        self.slots = [dict() for _ in range(slots)]
+        self._timers = {}
+        self._tick_count = int((time.monotonic() if now is None else now) // tick)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def add(self, timer_id, due: float, payload):
+        timer = Timer(timer_id, due, payload)
+        # Never in a tick already processed: a timer due in the past fires on the next advance()
+        ticks = max(math.ceil(due / self.tick), self._tick_count + 1) - self._tick_count
+        timer.rounds = (ticks - 1) // len(self.slots)
+        timer.slot = (self._tick_count + ticks) % len(self.slots)
+        self.slots[timer.slot][timer_id] = timer
+        self._timers[timer_id] = timer
+
+    def cancel(self, timer_id):
+        timer = self._timers.pop(timer_id, None)
+        if timer is not None:
+            del self.slots[timer.slot][timer_id]
+        return timer
+
+    def get(self, timer_id):
+        return self._timers.get(timer_id)
+
+    def timers(self):
+        return list(self._timers.values())
+
+    def advance(self, now: float) -> list:
+        """Process the ticks up to `now`, returns the timers that fell due, in due order."""
+        target = int(now // self.tick)
+        due = []
+        if target - self._tick_count > len(self.slots):
+            # Behind by more than a turn (e.g. the machine was suspended): re-file every timer instead
+            timers = list(self._timers.values())
+            for slot in self.slots:
+                slot.clear()
+            self._timers.clear()
+            self._tick_count = target
+            for timer in timers:
+                if timer.due <= now:
+                    due.append(timer)
+                else:
+                    self.add(timer.timer_id, timer.due, timer.payload)
+        while self._tick_count < target:
+            self._tick_count += 1
+            slot = self.slots[self._tick_count % len(self.slots)]
+            for timer in list(slot.values()):
+                if timer.rounds > 0:
+                    timer.rounds -= 1
+                    continue
+                del slot[timer.timer_id]
+                del self._timers[timer.timer_id]
+                due.append(timer)
+        due.sort(key=lambda timer: timer.due)
+        return due
+
+
+class CommandScheduler:
+    """
+    Holds scheduled commands in a TimingWheel and calls `fire(entry)` on its thread when one is
+    due; a recurring entry (`every` seconds) is put back for its next run right away.
+    Entries are plain dicts: id, owner, actions, run_at (epoch s), every, runs.
+    """
+
+    def __init__(self, fire, max_pending: int = COMMAND_SCHEDULE_MAX, tick: float = WHEEL_TICK,
+                 slots: int = WHEEL_SLOTS):
+        self._fire = fire
+        self.max_pending = max_pending
+        self._wheel = TimingWheel(tick, slots)
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._stats = {"scheduled": 0, "fired": 0, "cancelled": 0, "failed": 0}
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="command-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the thread. Pending commands are dropped, they are only held in memory."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def schedule(self, owner, actions, delay: float, every: float = None) -> dict:
+        if every is not None and every < COMMAND_SCHEDULE_MIN_INTERVAL:
+            raise ValueError(f"Recurring commands run at most every {COMMAND_SCHEDULE_MIN_INTERVAL:g} seconds")
+        self.start()
+        with self._cond:
+            if len(self._wheel) >= self.max_pending:
+                raise OverflowError(f"Too many scheduled commands ({self.max_pending})")
+            entry = {"id": next(self._ids), "owner": owner, "actions": actions,
+                     "run_at": time.time() + delay, "every": every, "runs": 0}
+            self._wheel.add(entry["id"], time.monotonic() + delay, entry)
+            self._stats["scheduled"] += 1
+            self._cond.notify()
+        return entry
+
+    def cancel(self, entry_id, owner) -> bool:
+        """Cancel a pending entry of this owner, False if there is none (anymore)."""
+        with self._cond:
+            timer = self._wheel.get(entry_id)
+            if timer is None or timer.payload["owner"] != owner:
+                return False
+            self._wheel.cancel(entry_id)
+            self._stats["cancelled"] += 1
+        return True
+
+    def pending(self, owner) -> list:
+        with self._cond:
+            entries = [timer.payload for timer in self._wheel.timers() if timer.payload["owner"] == owner]
+        return sorted(entries, key=lambda entry: entry["run_at"])
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "pending": len(self._wheel)}
+
+    def _next_due(self):
+        # Block until timers fall due, returns them (None on stop)
+        with self._cond:
+            while self._running:
+                if not len(self._wheel):
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                due = self._wheel.advance(now)
+                for timer in due:
+                    entry = timer.payload
+                    if entry["every"] is not None:
+                        # Next run from the planned time, so a recurring command does not drift.
+                        # Runs missed while the process was stalled are skipped, not caught up on
+                        next_due = timer.due + entry["every"]
+                        while next_due <= now:
+                            next_due += entry["every"]
+                        entry["run_at"] += next_due - timer.due
+                        self._wheel.add(entry["id"], next_due, entry)
+                if due:
+                    return [timer.payload for timer in due]
+                self._cond.wait(self._wheel.tick)
+            return None
+
+    def _run(self):
+        while True:
+            entries = self._next_due()
+            if entries is None:
+                return
+            for entry in entries:
+                entry["runs"] += 1
+                try:
+                    self._fire(entry)
+                    with self._cond:
+                        self._stats["fired"] += 1
+                except Exception as e:
+                    with self._cond:
+                        self._stats["failed"] += 1
+                    log.error("Scheduled command %s failed: %s", entry["id"], e)
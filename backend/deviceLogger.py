@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from metrics import track_upstream
+from responseCache import get_response_cache, ACTIVITY_LOG_TAG
+from queueLogging import get_logger
+
+log = get_logger("Device Log")
+
+# Flush when this many events are buffered, or after this many seconds, whichever comes first
+DEVICE_LOG_BATCH_SIZE = int(os.getenv("DEVICE_LOG_BATCH_SIZE", "100"))
+DEVICE_LOG_FLUSH_INTERVAL = float(os.getenv("DEVICE_LOG_FLUSH_INTERVAL", "2"))
+# Max events held in memory, the oldest are dropped past this (only if even the spill file cannot keep up)
+DEVICE_LOG_MAX_BUFFER = int(os.getenv("DEVICE_LOG_MAX_BUFFER", "10000"))
+# Events that could not be written to the database are appended here and replayed later
+DEVICE_LOG_SPILL_PATH = os.getenv("DEVICE_LOG_SPILL_PATH", "devicestatelog.spill.jsonl")
+# Adafruit feed -> DeviceSensor.Device_Id, e.g. {"fan": 3, "switch": 4, "color change": 4}
+FEED_DEVICE_IDS = json.loads(os.getenv("FEED_DEVICE_IDS", "{}"))
+
+
+class DeviceStateLogger:
+    """
+    Write-behind logger for DeviceStateLog.
+    log() only appends to an in-memory buffer, a background thread inserts the events in bulk.
+    If the database cannot be reached, the batch is appended to a local spill file (JSON lines)
+    which is replayed at start-up and after the next successful flush.
+    """
+
+    def __init__(self, batch_size: int = DEVICE_LOG_BATCH_SIZE, flush_interval: float = DEVICE_LOG_FLUSH_INTERVAL,
+                 max_buffer: int = DEVICE_LOG_MAX_BUFFER, spill_path: str = DEVICE_LOG_SPILL_PATH):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self._insert = None
+        self._buffer = deque(maxlen=max_buffer)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._stats = {"logged": 0, "written": 0, "spilled": 0, "replayed": 0, "rejected": 0, "dropped": 0}
+
+    def start(self, insert):
+        """`insert(rows)` writes a list of row dicts to DeviceStateLog in one call."""
+        with self._cond:
+            self._insert = insert
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="device-state-logger", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Flush what is buffered (or spill it) and stop the writer thread."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def log(self, activities: str, device_id=None, user_id=None, rule_id=None):
+        event = {
+            "activities": activities,
+            "device_id": device_id,
+            "user_id": user_id,
+            "rule_id": rule_id,
+            "date": datetime.now(timezone.utc).isoformat(),
+        }
+        with self._cond:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._stats["dropped"] += 1
+            self._buffer.append(event)
+            self._stats["logged"] += 1
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "buffered": len(self._buffer)}
+
+    def _take_batch(self):
+        # Wait until a batch is full, the flush interval passed, or we are stopping
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while self._running and len(self._buffer) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._buffer), self.batch_size)
+            return [self._buffer.popleft() for _ in range(count)]
+
+    def _write(self, rows) -> bool:
+        """
+        Insert rows, returns False if the database is unreachable. `rows` is then left holding
+        only the rows that were not written, for the caller to spill.
+        """
+        # Imported on the writer thread, postgrest comes with the (slow to import) Supabase client
+        from postgrest.exceptions import APIError
+
+        try:
+            with track_upstream("supabase", "POST /devicestatelog"):
+                self._insert(rows)
+            self._count("written", len(rows))
+            return True
+        except APIError:
+            # The database answered but refused the batch: insert one by one so a bad row
+            # does not block the others, and drop the rows it rejects
+            for i, row in enumerate(rows):
+                try:
+                    with track_upstream("supabase", "POST /devicestatelog"):
+                        self._insert([row])
+                    self._count("written", 1)
+                except APIError as e:
+                    self._count("rejected", 1)
+                    log.warning("Rejected %s: %s", row, e)
+                except Exception as e:
+                    # Lost the database halfway: the rows not tried yet are spilled, not dropped
+                    log.error("Database unreachable, spilling %d events: %s", len(rows) - i, e)
+                    del rows[:i]
+                    return False
+            return True
+        except Exception as e:
+            log.error("Database unreachable, spilling %d events: %s", len(rows), e)
+            return False
+
+    def _spill(self, rows):
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as spill:
+                for row in rows:
+                    spill.write(json.dumps(row) + "\n")
+        except OSError as e:
+            self._count("dropped", len(rows))
+            log.error("Could not spill %d events to %s: %s", len(rows), self.spill_path, e)
+            return
+        self._count("spilled", len(rows))
+
+    def _replay(self):
+        """Write back events spilled earlier. Whatever fails again stays in the spill file."""
+        try:
+            if not os.path.exists(self.spill_path):
+                return
+            with open(self.spill_path, encoding="utf-8") as spill:
+                rows = [json.loads(line) for line in spill if line.strip()]
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                size = len(batch)
+                if not self._write(batch):
+                    remaining = batch + rows[start + size:]
+                    with open(self.spill_path + ".tmp", "w", encoding="utf-8") as spill:
+                        for row in remaining:
+                            spill.write(json.dumps(row) + "\n")
+                    os.replace(self.spill_path + ".tmp", self.spill_path)
+                    return
+                self._count("replayed", size)
+            os.remove(self.spill_path)
+        except (OSError, ValueError) as e:
+            # Left as it is, tried again after the next successful flush
+            log.error("Could not replay %s: %s", self.spill_path, e)
+
+    def _count(self, key, n):
+        with self._cond:
+            self._stats[key] += n
+        if key == "written":
+            get_response_cache().invalidate_shared(ACTIVITY_LOG_TAG)  # /activitylog/get1000 has new rows
+
+    def _run(self):
+        self._replay()
+        while True:
+            batch = self._take_batch()
+            if batch:
+                if self._write(batch):
+                    self._replay()
+                else:
+                    self._spill(batch)
+            with self._cond:
+                if not self._running and not self._buffer:
+                    return
+
+
+device_logger = DeviceStateLogger()
+
+def get_device_logger():
+    return device_logger
+
+def log_device_action(activities: str, feed_id: str, user_id=None, rule_id=None, device_id=None):
+    # DeviceStateLog rows belong to exactly one user or rule (CHECK constraint): actions of
+    # anonymous requests are not logged, the database would reject them
+    if user_id is None and rule_id is None:
+        return
+    device_logger.log(activities, device_id=device_id or FEED_DEVICE_IDS.get(feed_id), user_id=user_id, rule_id=rule_id)
@@ -0,0 +1,196 @@
+"""
+In-memory index of the DeviceSensor table: user -> role -> device -> Adafruit feed.
+
+A device is routed to a feed through its Properties JSON, e.g.
+    {"feed": "home-2.temp", "role": "temp", "minRange": "-10", "maxRange": "100"}
+"role" defaults to the feed name when it is one of the standard feeds. Users without a device
+for some role fall back to the feeds of the single-account setup (AIO_FEED_IDS).
+"""
+import json
+import os
+import threading
+
+from queueLogging import get_logger
+
+log = get_logger("Devices")
+
+# Seconds between two refreshes of the registry from the database
+DEVICE_REGISTRY_REFRESH = float(os.getenv("DEVICE_REGISTRY_REFRESH", "60"))
+
+
+class Device:
+    __slots__ = ("device_id", "user_id", "name", "serial_number", "type_name", "role", "feed", "properties")
+
+    def __init__(self, device_id, user_id, name, serial_number, type_name, role, feed, properties):
+        self.device_id = device_id
+        self.user_id = user_id
+        self.name = name
+        self.serial_number = serial_number
+        self.type_name = type_name
+        self.role = role
+        self.feed = feed
+        self.properties = properties
+
+    def as_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+def parse_properties(properties) -> dict:
+    if isinstance(properties, dict):
+        return properties
+    try:
+        parsed = json.loads(properties or "{}")
+    except (TypeError, json.JSONDecodeError):
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+class DeviceRegistry:
+    """
+    Devices indexed by id, by owner, by (user, role) and by feed, so routes resolve a feed
+    with two dict lookups. refresh() applies only the rows that changed since the previous load.
+    """
+
+    def __init__(self, default_feeds: dict, refresh_interval: float = DEVICE_REGISTRY_REFRESH,
+                 on_new_feeds=None):
+        # Role -> feed used when a user has no device for that role
+        self.default_feeds = dict(default_feeds)
+        self.refresh_interval = refresh_interval
+        self._on_new_feeds = on_new_feeds
+        self._roles_by_feed = {feed: role for role, feed in self.default_feeds.items()}
+        self._devices = {}
+        self._rows = {}
+        self._by_owner = {}
+        self._by_user = {}
+        self._by_feed = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"refreshes": 0, "changed": 0}
+
+    #### Lookups
+    def resolve(self, user_id, role):
+        """(feed, device_id) serving `role` for this user, device_id is None for the default feeds."""
+        if user_id is None:
+            return self.default_feeds[role], None  # Anonymous requests never reach a registered device
+        with self._lock:
+            device = self._by_user.get(user_id, {}).get(role)
+        if device is not None:
+            return device.feed, device.device_id
+        return self.default_feeds[role], None
+
+    def device(self, device_id):
+        with self._lock:
+            return self._devices.get(device_id)
+
+    def device_for_feed(self, feed):
+        with self._lock:
+            return self._by_feed.get(feed)
+
+    def devices_of(self, user_id) -> list:
+        with self._lock:
+            devices = self._by_owner.get(user_id, {})
+            return [device.as_dict() for _, device in sorted(devices.items())]
+
+    def feeds(self) -> set:
+        with self._lock:
+            return set(self._by_feed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "devices": len(self._devices), "users": len(self._by_owner),
+                    "feeds": len(self._by_feed)}
+
+    #### Updates
+    def refresh(self, devices, types=()):
+        """
+        Apply the current DeviceSensor rows (and DeviceSensorType rows for the type names).
+        Unchanged rows are left alone, new and modified ones re-indexed, missing ones removed.
+        """
+        type_names = {row["serial_number"]: row.get("name") for row in types}
+        rows = {row["device_id"]: row for row in devices}
+        with self._lock:
+            known_feeds = set(self._by_feed)
+            changed = [row for device_id, row in rows.items() if self._rows.get(device_id) != row]
+            removed = [device_id for device_id in self._rows if device_id not in rows]
+            for device_id in removed:
+                self._remove(device_id)
+            for row in changed:
+                self._remove(row["device_id"])
+                self._add(row, type_names.get(row.get("serial_number")))
+            self._stats["refreshes"] += 1
+            self._stats["changed"] += len(changed) + len(removed)
+            new_feeds = set(self._by_feed) - known_feeds
+        if changed or removed:
+            log.info("%d devices changed, %d removed", len(changed), len(removed))
+        if new_feeds and self._on_new_feeds is not None:
+            self._on_new_feeds(sorted(new_feeds))
+
+    def _add(self, row, type_name):
+        properties = parse_properties(row.get("properties"))
+        feed = properties.get("feed")
+        role = properties.get("role") or self._roles_by_feed.get(feed)
+        device = Device(row["device_id"], row.get("user_id"), row.get("name"), row.get("serial_number"),
+                        type_name, role, feed, properties)
+        self._rows[device.device_id] = row
+        self._devices[device.device_id] = device
+        self._by_owner.setdefault(device.user_id, {})[device.device_id] = device
+        if feed is None:
+            return  # Registered but not connected to a feed: listed, never routed to
+        self._by_feed.setdefault(feed, device)
+        if role is not None and device.user_id is not None:
+            # Ownerless devices are listed and subscribed to, but nobody is routed to them
+            roles = self._by_user.setdefault(device.user_id, {})
+            # Several devices with the same role: the oldest one is the one routed to
+            current = roles.get(role)
+            if current is None or device.device_id < current.device_id:
+                roles[role] = device
+
+    def _remove(self, device_id):
+        self._rows.pop(device_id, None)
+        device = self._devices.pop(device_id, None)
+        if device is None:
+            return
+        owned = self._by_owner[device.user_id]
+        del owned[device_id]
+        if not owned:
+            del self._by_owner[device.user_id]
+        if self._by_feed.get(device.feed) is device:
+            del self._by_feed[device.feed]
+            replacement = next((d for d in self._devices.values() if d.feed == device.feed), None)
+            if replacement is not None:
+                self._by_feed[device.feed] = replacement
+        roles = self._by_user.get(device.user_id)
+        if roles is not None and roles.get(device.role) is device:
+            del roles[device.role]
+            candidates = [d for d in owned.values() if d.role == device.role and d.feed is not None]
+            if candidates:
+                roles[device.role] = min(candidates, key=lambda d: d.device_id)
+            if not roles:
+                del self._by_user[device.user_id]
+
+    #### Background refresh
+    def start(self, fetch):
+        """`fetch()` returns (DeviceSensor rows, DeviceSensorType rows). Loads now, then every refresh_interval."""
+        try:
+            self.refresh(*fetch())
+        except Exception as e:
+            log.error("Initial load failed, retrying in %ss: %s", self.refresh_interval, e)
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(fetch,), name="device-registry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self, fetch):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh(*fetch())
+            except Exception as e:
+                log.error("Refresh failed: %s", e)
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+def bucket_aggregate(timestamps, values, start: int, end: int, buckets: int):
+    """
+    Split [start, end) (epoch ms) into `buckets` fixed-width buckets and aggregate the samples of each one.
+    `timestamps` must be sorted ascending. Returns the bucket width and a dict of columns
+    (bucket start, min, max, mean, last, count) containing only the non-empty buckets.
+    """
+    width = max(1, -(-(end - start) // buckets))  # ceil division, at least 1 ms
+    mask = (timestamps >= start) & (timestamps < end)
+    timestamps, values = timestamps[mask], values[mask]
+
+    if len(values) == 0:
+        empty = np.array([], dtype=np.float64)
+        return width, {
+            "timestamp": np.array([], dtype=np.int64),
+            "min": empty, "max": empty, "mean": empty, "last": empty,
+            "count": np.array([], dtype=np.int64),
+        }
+
+    # Samples are sorted, so bucket indices are non-decreasing and each bucket is a contiguous run
+    index = (timestamps - start) // width
+    counts = np.bincount(index, minlength=buckets)
+    sums = np.bincount(index, weights=values, minlength=buckets)
+
+    occupied = np.flatnonzero(counts)
+    firsts = np.searchsorted(index, occupied, side="left")
+    lasts = firsts + counts[occupied] - 1
+
+    return width, {
+        "timestamp": start + occupied * width,
+        "min": np.minimum.reduceat(values, firsts),
+        "max": np.maximum.reduceat(values, firsts),
+        "mean": sums[occupied] / counts[occupied],
+        "last": values[lasts],
+        "count": counts[occupied],
+    }
+
+
+def lttb(timestamps, values, threshold: int):
+    """
+    Largest-Triangle-Three-Buckets downsampling to at most `threshold` points.
+    Keeps the first and last sample and, in each bucket in between, the sample forming the
+    largest triangle with the previously kept point and the average of the next bucket.
+    """
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return timestamps, values
+
+    x = timestamps.astype(np.float64)
+    y = values
+    # Bucket boundaries for the n - 2 inner points
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    # Average point of every bucket, computed in one pass
+    sums_x = np.add.reduceat(x[:n - 1], edges[:-1])
+    sums_y = np.add.reduceat(y[:n - 1], edges[:-1])
+    sizes = np.diff(edges)
+    avg_x = np.append(sums_x / sizes, x[-1])
+    avg_y = np.append(sums_y / sizes, y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Twice the triangle area for every candidate in the bucket, vectorized
+        area = np.abs(
+            (x[a] - avg_x[i + 1]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (avg_y[i + 1] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return timestamps[selected], values[selected]
@@ -0,0 +1,209 @@
+"""
+Idempotency-Key support for the device command routes, so a client can retry a POST whose
+response it never got without the command being published twice.
+
+The first request with a key runs and its response is remembered for IDEMPOTENCY_TTL seconds.
+A retry with the same key and the same request gets that response again, marked with
+`Idempotent-Replayed: true`, without reaching the route. The same key with another method, path,
+query or body is refused with 422, and a retry arriving while the first request still runs gets
+409. Failed requests (5xx, or a JSON body with an "error") are forgotten, so they can be retried.
+Keys are scoped to the client (user or address, as for the rate limit).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from starlette.responses import JSONResponse
+
+from asyncClients import run_blocking
+from rateLimiter import client_key
+
+# Seconds a response is replayed for its Idempotency-Key
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# Keys remembered in memory, the least recently used ones are forgotten first
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+# A request still running after this many seconds no longer blocks retries with its key
+IDEMPOTENCY_PENDING_TTL = 60.0
+
+# Route prefixes whose POST requests honor the header
+IDEMPOTENT_PREFIXES = ("/fan/", "/light/", "/commands/")
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyStore:
+    """
+    Keys and remembered responses, in a bounded LRU. With a `store` (sharedState.SharedStore),
+    they are shared by every worker process instead, so a retry can land on any of them.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS, store=None):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.store = store
+        # key -> [fingerprint, response JSON or None while running, expiry time]
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"stored": 0, "replayed": 0, "conflicts": 0, "mismatches": 0}
+
+    def claim(self, key, fingerprint):
+        """Returns None if the key is now claimed by this request, else (fingerprint, response) of its owner."""
+        if self.store is not None:
+            return self.store.claim_key(key, fingerprint, IDEMPOTENCY_PENDING_TTL)
+        now = time.time()
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is not None and entry[2] >= now:
+                self._keys.move_to_end(key)
+                return entry[0], entry[1]
+            self._keys[key] = [fingerprint, None, now + IDEMPOTENCY_PENDING_TTL]
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+        return None
+
+    def complete(self, key, response: str):
+        self.count("stored")
+        if self.store is not None:
+            self.store.complete_key(key, response, self.ttl)
+            return
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is not None:
+                entry[1] = response
+                entry[2] = time.time() + self.ttl
+
+    def release(self, key):
+        if self.store is not None:
+            self.store.release_key(key)
+            return
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def count(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            held = len(self._keys)
+        return {**stats, "keys": self.store.key_count() if self.store is not None else held}
+
+
+def succeeded(status: int, body: bytes) -> bool:
+    # The command routes answer 202 with {"error": ...} when the command could not be queued
+    if status >= 500:
+        return False
+    try:
+        content = json.loads(body)
+    except ValueError:
+        return True
+    return not (isinstance(content, dict) and "error" in content)
+
+
+class IdempotencyMiddleware:
+    """Plain ASGI middleware applying an IdempotencyStore to the POST command routes."""
+
+    def __init__(self, app, store: IdempotencyStore, prefixes=IDEMPOTENT_PREFIXES):
+        self.app = app
+        self.store = store
+        self.prefixes = prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+        key = None
+        for name, value in scope["headers"]:
+            if name == b"idempotency-key":
+                key = value.decode("latin-1").strip()
+                break
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await JSONResponse({"error": f"Idempotency-Key longer than {MAX_KEY_LENGTH} characters"},
+                               status_code=400)(scope, receive, send)
+            return
+
+        # The body is read here to fingerprint the request, then handed to the route unchanged
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        fingerprint = hashlib.blake2b(
+            b"\n".join((scope["path"].encode(), scope["query_string"], body)), digest_size=16).hexdigest()
+        scoped_key = client_key(scope) + " " + key
+
+        owner = await self.call(self.store.claim, scoped_key, fingerprint)
+        if owner is not None:
+            await self.answer_retry(owner, fingerprint, scope, receive, send)
+            return
+
+        replayed = False
+
+        async def replay_body():
+            nonlocal replayed
+            if replayed:
+                return await receive()  # Only a disconnect is left to wait for
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        start = None
+        sent = []
+
+        async def capture(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                sent.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_body, capture)
+        except BaseException:
+            # Shielded: a request cancelled again meanwhile still frees its key
+            await asyncio.shield(self.call(self.store.release, scoped_key))
+            raise
+        response_body = b"".join(sent)
+        if start is None or not succeeded(start["status"], response_body):
+            await self.call(self.store.release, scoped_key)
+            return
+        headers = [[name.decode("latin-1"), value.decode("latin-1")] for name, value in start.get("headers", [])
+                   if name.lower() != b"content-length"]
+        await self.call(self.store.complete, scoped_key, json.dumps(
+            {"status": start["status"], "headers": headers, "body": response_body.decode("latin-1")}))
+
+    async def call(self, func, *args):
+        # Keys in the shared SQLite file are written on the I/O thread pool, not on the event loop
+        if self.store.store is not None:
+            return await run_blocking(func, *args)
+        return func(*args)
+
+    async def answer_retry(self, owner, fingerprint, scope, receive, send):
+        owner_fingerprint, response = owner
+        if owner_fingerprint != fingerprint:
+            self.store.count("mismatches")
+            await JSONResponse({"error": "Idempotency-Key was already used for a different request"},
+                               status_code=422)(scope, receive, send)
+            return
+        if response is None:
+            self.store.count("conflicts")
+            await JSONResponse({"error": "A request with this Idempotency-Key is still in progress"},
+                               status_code=409, headers={"Retry-After": "1"})(scope, receive, send)
+            return
+        self.store.count("replayed")
+        response = json.loads(response)
+        body = response["body"].encode("latin-1")
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in response["headers"]]
+        headers += [(b"content-length", str(len(body)).encode()), (b"idempotent-replayed", b"true")]
+        await send({"type": "http.response.start", "status": response["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,78 @@
+"""
+Ingest process of a multi-worker deployment, the only process connected to MQTT.
+
+    python ingestProcess.py
+    INGEST_MODE=worker uvicorn main:app --workers 4
+
+Handles every value like the single-process server does (archive, automation rules, alerts),
+appends it to the shared event log the API workers follow, and publishes the device commands
+they queue, so N workers still mean one MQTT connection per account and one publish budget
+(see sharedState.py). Stops on SIGINT / SIGTERM.
+"""
+import asyncio
+import json
+import os
+import signal
+import threading
+
+# Set before the backend modules read it: this process owns MQTT and the command dispatcher
+os.environ["INGEST_MODE"] = "ingest"
+
+from adafruitConnection import (start_mqtt, stop_mqtt, get_dispatcher, get_device_registry, get_history_archive,
+                                get_event_log, share_invalidation)
+from deviceLogger import get_device_logger
+from queueLogging import get_logger
+from responseCache import get_response_cache
+from routers import devices, rules
+from supabaseClient import create_supabase
+
+log = get_logger("Ingest")
+
+
+def handle_command(db, kind, feed, value):
+    # Queued by an API worker: a device command, or a reload after rules / devices changed in the database
+    if kind == "publish":
+        get_dispatcher().submit(feed, value)
+    elif kind == "publish_many":
+        get_dispatcher().submit_many(json.loads(value))
+    elif kind == "reload" and feed == "rules":
+        asyncio.run(rules.load_rules(db))
+    elif kind == "reload" and feed == "devices":
+        get_device_registry().refresh(*devices.fetch_devices(db))
+    else:
+        log.warning("Unknown command %s %s", kind, feed)
+
+
+def main():
+    db = create_supabase()
+    # Device actions of the automation rules are logged here, the workers' cached activity logs are invalidated
+    get_response_cache().share = share_invalidation
+    get_device_logger().start(lambda rows: db.table("devicestatelog").insert(rows).execute())
+    get_history_archive().start()
+
+    get_device_registry().start(lambda: devices.fetch_devices(db))
+    try:
+        asyncio.run(rules.load_rules(db))
+    except Exception as e:
+        log.error("Could not load automation rules: %s", e)
+
+    get_event_log().start(lambda kind, feed, value: handle_command(db, kind, feed, value))
+    start_mqtt()
+    log.info("Ingest process started")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    stop.wait()
+
+    get_event_log().stop()  # No new commands from here on, values still buffered are written
+    get_dispatcher().stop()  # Publish device commands still waiting in the queue
+    get_device_logger().stop()
+    get_device_registry().stop()
+    stop_mqtt()
+    get_history_archive().stop()
+    log.info("Ingest process stopped")
+
+
+if __name__ == "__main__":
+    main()
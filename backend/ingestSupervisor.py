@@ -0,0 +1,308 @@
+"""
+Supervised MQTT ingest over one connection per Adafruit IO account (shard).
+
+Each shard has a watchdog thread that (re)connects with jittered exponential backoff and
+resubscribes on every connect, so a dropped connection is retried instead of ending the
+process. Messages are handed from the MQTT network loop to a pool of worker threads; the
+worker is picked by feed, so values of one feed are still processed in order.
+
+Feeds of the primary account keep their plain key ("temp"), feeds of other accounts are
+qualified with the account name ("alice/temp").
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+import zlib
+
+from queueLogging import get_logger
+
+log = get_logger("Ingest")
+
+# Extra Adafruit IO accounts to ingest from, JSON object of username -> AIO key
+AIO_ACCOUNTS = json.loads(os.getenv("AIO_ACCOUNTS", "{}"))
+# Reconnect backoff bounds in seconds, the actual delay is randomised (full jitter)
+MQTT_RECONNECT_MIN = float(os.getenv("MQTT_RECONNECT_MIN", "1"))
+MQTT_RECONNECT_MAX = float(os.getenv("MQTT_RECONNECT_MAX", "60"))
+# Seconds a connect may take before it is abandoned and retried
+MQTT_CONNECT_TIMEOUT = float(os.getenv("MQTT_CONNECT_TIMEOUT", "15"))
+# Threads handling received messages, and messages each one may have waiting
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+# Seconds between two connection checks of a shard
+INGEST_WATCHDOG_INTERVAL = 1.0
+
+_STOP = object()
+
+
+def split_feed(feed: str):
+    """"alice/temp" -> ("alice", "temp"), "temp" -> (None, "temp")."""
+    account, _, key = feed.rpartition("/")
+    return account or None, key
+
+
+class Shard:
+    """One MQTT connection: its client, its feeds and its health."""
+
+    def __init__(self, name, username, key, primary=False):
+        self.name = name
+        self.username = username
+        self.key = key
+        self.primary = primary
+        self.feeds = set()
+        self.client = None
+        self.ever_connected = False
+        self.state = "stopped"
+        self.connected_since = None
+        self.connecting_since = None
+        self.next_attempt = 0.0
+        self.failures = 0
+        self.reconnects = 0
+        self.last_error = None
+        self.last_message = None
+        self.received = 0
+        self.dropped = 0
+        self.thread = None
+
+    def feed_id(self, key):
+        return key if self.primary else f"{self.name}/{key}"
+
+    def health(self, now: float) -> dict:
+        return {
+            "shard": self.name,
+            "state": self.state,
+            "feeds": len(self.feeds),
+            "connected_for": round(now - self.connected_since, 1) if self.connected_since else None,
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_message_age": round(now - self.last_message, 1) if self.last_message else None,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+class IngestSupervisor:
+    """
+    `client_factory(username, key)` builds a new MQTT client (Adafruit_IO.MQTTClient interface),
+    `handle(client, feed_id, payload)` processes one message on a worker thread.
+    """
+
+    def __init__(self, client_factory, handle, workers: int = INGEST_WORKERS, queue_size: int = INGEST_QUEUE_SIZE,
+                 backoff_min: float = MQTT_RECONNECT_MIN, backoff_max: float = MQTT_RECONNECT_MAX,
+                 connect_timeout: float = MQTT_CONNECT_TIMEOUT):
+        self._client_factory = client_factory
+        self._handle = handle
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+        self._shards = {}
+        self._primary = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(max(1, workers))]
+        self._workers = []
+        self._running = False
+
+    #### Shards
+    def add_shard(self, name, username, key, feeds=(), primary=False) -> Shard:
+        shard = Shard(name, username, key, primary)
+        shard.feeds.update(feeds)
+        with self._lock:
+            self._shards[name] = shard
+            if primary:
+                self._primary = shard
+            running = self._running
+        if running:
+            self._start_shard(shard)
+        return shard
+
+    def shard_for(self, feed_id):
+        """(shard, feed key on that account) for a feed id, shard is None for an unknown account."""
+        account, key = split_feed(feed_id)
+        with self._lock:
+            shard = self._primary if account is None else self._shards.get(account)
+        return shard, key
+
+    def subscribe(self, feed_ids):
+        """Add feeds to their shards, and subscribe them right away where connected."""
+        for feed_id in feed_ids:
+            shard, key = self.shard_for(feed_id)
+            if shard is None:
+                log.warning("No account configured for feed %s", feed_id)
+                continue
+            with self._lock:
+                if key in shard.feeds:
+                    continue
+                shard.feeds.add(key)
+                client = shard.client if shard.state == "connected" else None
+            if client is not None:
+                client.subscribe(key)
+
+    def publish(self, feed_id, value):
+        shard, key = self.shard_for(feed_id)
+        if shard is None:
+            raise ValueError(f"No account configured for feed {feed_id}")
+        client = shard.client
+        if client is None or shard.state != "connected":
+            raise ConnectionError(f"MQTT shard {shard.name} is {shard.state}")
+        client.publish(key, value)
+
+    def client(self, name=None):
+        with self._lock:
+            shard = self._primary if name is None else self._shards.get(name)
+        return shard.client if shard is not None else None
+
+    #### Lifecycle
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            shards = list(self._shards.values())
+        self._stop.clear()
+        for index, inbox in enumerate(self._queues):
+            worker = threading.Thread(target=self._work, args=(inbox,), name=f"ingest-worker-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        for shard in shards:
+            self._start_shard(shard)
+
+    def stop(self):
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            shards = list(self._shards.values())
+        self._stop.set()
+        for shard in shards:
+            if shard.thread is not None:
+                shard.thread.join(timeout=5)
+            self._teardown(shard)
+            shard.state = "stopped"
+        for inbox in self._queues:
+            inbox.put(_STOP)
+        for worker in self._workers:
+            worker.join(timeout=5)
+        self._workers = []
+
+    def wait_connected(self, timeout: float) -> bool:
+        """Block until every shard is connected (and subscribed), False on timeout."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if all(shard.state == "connected" for shard in self._shards.values()):
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def health(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            shards = [shard.health(now) for shard in self._shards.values()]
+        return {
+            "healthy": bool(shards) and all(shard["state"] == "connected" for shard in shards),
+            "shards": shards,
+            "queued": sum(inbox.qsize() for inbox in self._queues),
+            "workers": len(self._workers),
+        }
+
+    #### Connection watchdog
+    def _start_shard(self, shard):
+        shard.state = "disconnected"
+        shard.next_attempt = 0.0
+        shard.thread = threading.Thread(target=self._watch, args=(shard,), name=f"mqtt-{shard.name}", daemon=True)
+        shard.thread.start()
+
+    def _backoff(self, failures) -> float:
+        cap = min(self.backoff_max, self.backoff_min * 2 ** min(failures, 16))
+        return random.uniform(self.backoff_min, max(self.backoff_min, cap))
+
+    def _watch(self, shard):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            client = shard.client
+            connected = client is not None and client.is_connected()
+            if shard.state == "connected" and not connected:
+                self._lost(shard, "connection lost")
+            elif shard.state == "connecting" and not connected and now - shard.connecting_since > self.connect_timeout:
+                self._lost(shard, "connect timed out")
+            elif shard.state == "disconnected" and now >= shard.next_attempt:
+                self._connect(shard)
+            self._stop.wait(INGEST_WATCHDOG_INTERVAL)
+
+    def _connect(self, shard):
+        shard.state = "connecting"
+        shard.connecting_since = time.monotonic()
+        try:
+            client = self._client_factory(shard.username, shard.key)
+            client.on_connect = lambda c: self._on_connect(shard, c)
+            client.on_disconnect = lambda c: log.warning("Shard %s disconnected", shard.name)
+            client.on_message = lambda c, key, payload: self._on_message(shard, c, key, payload)
+            shard.client = client
+            client.connect()
+            client.loop_background()
+        except Exception as e:
+            self._lost(shard, str(e))
+
+    def _on_connect(self, shard, client):
+        # Runs on the client's network thread: resubscribe everything this shard ingests.
+        # Feeds added from now on are subscribed by subscribe() directly.
+        with self._lock:
+            shard.state = "connected"
+            feeds = sorted(shard.feeds)
+        for key in feeds:
+            client.subscribe(key)
+        if shard.ever_connected:
+            shard.reconnects += 1
+        shard.ever_connected = True
+        shard.connected_since = time.monotonic()
+        shard.failures = 0
+        log.info("Shard %s connected, %d feeds", shard.name, len(feeds))
+
+    def _lost(self, shard, reason):
+        shard.failures += 1
+        shard.last_error = reason
+        shard.connected_since = None
+        delay = self._backoff(shard.failures)
+        shard.next_attempt = time.monotonic() + delay
+        shard.state = "disconnected"
+        log.warning("Shard %s: %s, retrying in %.1fs", shard.name, reason, delay)
+        self._teardown(shard)
+
+    def _teardown(self, shard):
+        client, shard.client = shard.client, None
+        if client is None:
+            return
+        client.on_connect = client.on_disconnect = client.on_message = None
+        try:
+            paho = getattr(client, "_client", None)
+            if paho is not None:
+                paho.loop_stop()
+            client.disconnect()
+        except Exception:
+            pass
+
+    #### Worker pool
+    def _on_message(self, shard, client, key, payload):
+        # Network thread: never block here, hand the message to the feed's worker
+        feed_id = shard.feed_id(key)
+        shard.received += 1
+        shard.last_message = time.monotonic()
+        inbox = self._queues[zlib.crc32(feed_id.encode()) % len(self._queues)]
+        try:
+            inbox.put_nowait((client, feed_id, payload))
+        except queue.Full:
+            shard.dropped += 1
+
+    def _work(self, inbox):
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                return
+            try:
+                self._handle(*item)
+            except Exception as e:
+                log.error("Handling %s failed: %s", item[1], e)
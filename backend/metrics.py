@@ -0,0 +1,230 @@
+"""
+In-process metrics in the Prometheus text exposition format, served by GET /metrics.
+
+Counters and histograms are updated where things happen (request middleware, MQTT callback,
+upstream calls); gauges describing current state (queue depths, feed lag) are refreshed
+when /metrics is scraped, so nothing runs on the hot path for them. Totals the components
+already count themselves (stats()) are copied into counters at scrape time the same way.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from a cached read (well under 1 ms) to a slow upstream call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, description: str, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {labels}")
+        return tuple(labels)
+
+    def samples(self) -> dict:
+        """Label values -> current value."""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield from self._render_sample(labels, value)
+
+    def _render_sample(self, labels, value):
+        yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, *labels):
+        """Copy a total counted elsewhere since start (a component's stats()), read at scrape time."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per bucket counts (last one is +Inf), sum, count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = sorted((labels, ([*entry[0]], entry[1], entry[2])) for labels, entry in self._values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labels=()) -> Counter:
+        return self._add(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()) -> Gauge:
+        return self._add(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, description, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+def get_registry():
+    return registry
+
+
+#### Metrics updated on the hot paths
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests by route template, method and status code", ("route", "method", "status"))
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("route", "method"))
+RATE_LIMITED = registry.counter(
+    "rate_limit_rejected_total", "Requests rejected by the rate limiter, by route class", ("route_class",))
+MQTT_MESSAGES = registry.counter(
+    "mqtt_messages_total", "MQTT messages received, by feed", ("feed",))
+MQTT_PROCESSING = registry.histogram(
+    "mqtt_message_processing_seconds", "Time spent handling one MQTT message, by feed", ("feed",))
+MQTT_LAST_MESSAGE = registry.gauge(
+    "mqtt_last_message_timestamp_seconds", "Unix time of the last MQTT message, by feed", ("feed",))
+RESPONSE_CACHE = registry.counter(
+    "response_cache_total", "Cached read route responses by outcome (hit, miss, not_modified)", ("route", "outcome"))
+RESPONSE_BYTES = registry.counter(
+    "response_bytes_total", "Body bytes of cached read route responses sent, by content coding", ("route", "encoding"))
+UPSTREAM_LATENCY = registry.histogram(
+    "upstream_request_duration_seconds", "Latency of upstream calls (Adafruit IO REST and MQTT, Supabase)", ("service", "operation"))
+UPSTREAM_ERRORS = registry.counter(
+    "upstream_errors_total", "Failed upstream calls (Adafruit IO REST and MQTT, Supabase)", ("service", "operation"))
+STARTUP_SECONDS = registry.gauge(
+    "startup_seconds", "Seconds from the first import to each start-up phase (imports, serving, first_request, warmup)", ("phase",))
+
+
+@contextmanager
+def track_upstream(service: str, operation: str):
+    """Time an upstream call and count it as an error if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.inc(service, operation)
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, service, operation)
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware timing every HTTP request. Requests are labelled with the route
+    template (/sensor/{feed}/series) rather than the raw path, so label sets stay bounded.
+    `on_first_request()` is called once, after the first request was answered.
+    """
+
+    def __init__(self, app, on_first_request=None):
+        self.app = app
+        self.on_first_request = on_first_request
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_LATENCY.observe(time.perf_counter() - started, template, method)
+            HTTP_REQUESTS.inc(template, method, str(status[0]))
+            if self.on_first_request is not None:
+                callback, self.on_first_request = self.on_first_request, None
+                callback()
@@ -2,7 +2,7 @@ from pydantic import BaseModel, Field
 from enum import Enum
 from decimal import Decimal
 from datetime import datetime
-from typing import List, Optional
+from typing import Annotated, List, Literal, Optional, Union
 
 class Config:
         # Allow None for any fields that are optional
@@ -37,4 +37,27 @@ class ColorCode(str, Enum):
     ORANGE = "#F79646"
 
 class Color(BaseModel):
-     code : ColorCode
\ No newline at end of file
+     code : ColorCode
+
+# Device actions of the bulk and scheduled command routes, told apart by "device"
+class FanAction(BaseModel):
+    device: Literal["fan"]
+    speed: int = Field(..., ge=0, le=100, description="Fan speed from 0 (off) to 100 (max)")
+
+class SwitchAction(BaseModel):
+    device: Literal["switch"]
+    on: bool
+
+class ColorAction(BaseModel):
+    device: Literal["color"]
+    code: ColorCode
+
+DeviceAction = Annotated[Union[FanAction, SwitchAction, ColorAction], Field(discriminator="device")]
+
+class BulkCommand(BaseModel):
+    actions: List[DeviceAction] = Field(..., min_length=1, max_length=20)
+
+class ScheduledCommand(BulkCommand):
+    delay: Optional[float] = Field(None, ge=0, description="Seconds from now, or give `at`")
+    at: Optional[datetime] = Field(None, description="When to run, naive times are UTC")
+    every: Optional[float] = Field(None, gt=0, description="Repeat every so many seconds")
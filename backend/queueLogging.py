@@ -0,0 +1,52 @@
+import atexit
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# DEBUG also logs every MQTT message received, which is a lot at high message rates
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+# Callers only put records on this queue, a listener thread does the formatting and the stdout writes
+_queue = queue.SimpleQueue()
+_listener = None
+_root = logging.getLogger("backend")
+_root.setLevel(LOG_LEVEL)
+_root.propagate = False
+
+
+def start_logging():
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = QueueListener(_queue, output, respect_handler_level=True)
+    _listener.start()
+    _root.addHandler(QueueHandler(_queue))
+
+
+def stop_logging():
+    """Write out whatever is still queued and stop the listener thread."""
+    global _listener
+    if _listener is None:
+        return
+    for handler in list(_root.handlers):
+        _root.removeHandler(handler)
+    _listener.stop()
+    _listener = None
+
+
+def set_log_level(level: str):
+    _root.setLevel(level.upper())
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger whose records go through the background queue, e.g. get_logger("MQTT")."""
+    start_logging()
+    return _root.getChild(name)
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,135 @@
+import math
+import os
+import time
+from collections import OrderedDict
+
+from starlette.responses import JSONResponse
+
+from asyncClients import run_blocking
+from auth import verify_token
+from metrics import RATE_LIMITED
+
+# Route class -> (tokens refilled per second, bucket size)
+RATE_LIMITS = {
+    "read": (2.0, 60),      # sensor data, logs: dashboard polling
+    "control": (1.0, 10),   # fan / light commands
+    "auth": (0.2, 5),       # login / register, slows down password guessing
+    "default": (5.0, 50),
+}
+# First path segment -> route class
+ROUTE_CLASSES = {
+    "sensor": "read",
+    "activitylog": "read",
+    "notifications": "read",
+    "fan": "control",
+    "light": "control",
+    "commands": "control",
+    "login": "auth",
+}
+# Buckets kept in memory, the least recently used ones are evicted first
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "10000"))
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+
+
+def route_class(path: str) -> str:
+    segment = path.split("/", 2)[1] if path.startswith("/") else ""
+    return ROUTE_CLASSES.get(segment, "default")
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by (client, route class), held in a bounded LRU.
+    The in-memory buckets are only used from the event loop and never await, so they need no lock.
+    A bucket refills continuously, there is no reset thread or global cooldown.
+    With a `store` (sharedState.SharedStore), buckets are shared by every worker process instead,
+    and hit() is called on the I/O thread pool (see RateLimitMiddleware).
+    """
+
+    def __init__(self, limits: dict = None, max_buckets: int = RATE_LIMIT_MAX_BUCKETS,
+                 enabled: bool = RATE_LIMIT_ENABLED, store=None):
+        self.limits = limits or RATE_LIMITS
+        self.max_buckets = max_buckets
+        self.enabled = enabled
+        self.store = store
+        # (client, route class) -> [tokens, last refill time]
+        self._buckets = OrderedDict()
+        self.rejected = 0
+
+    def __len__(self):
+        if self.store is not None:
+            return self.store.bucket_count()
+        return len(self._buckets)
+
+    def hit(self, client: str, klass: str, now: float = None):
+        """Take one token. Returns (allowed, seconds until a token is available)."""
+        if not self.enabled:
+            return True, 0.0
+        if now is None:
+            now = time.monotonic()
+        rate, burst = self.limits.get(klass) or self.limits["default"]
+        if self.store is not None:
+            try:
+                allowed, retry_after = self.store.take_token(client + " " + klass, rate, burst)
+            except Exception:
+                return True, 0.0  # Fail open, the API stays up if the shared file is unavailable
+            if not allowed:
+                self.rejected += 1
+            return allowed, retry_after
+        key = (client, klass)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(burst), now]
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True, 0.0
+        self.rejected += 1
+        return False, (1 - bucket[0]) / rate
+
+
+def client_key(scope) -> str:
+    # Authenticated users get their own buckets wherever they connect from, others are keyed by address
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            claims = verify_token(value[7:].decode("latin-1"))
+            if claims is not None:
+                return "user:" + claims["sub"]
+            break
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class RateLimitMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware overhead) applying a RateLimiter to HTTP requests."""
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        klass = route_class(scope["path"])
+        if self.limiter.store is not None:
+            # Shared buckets are a write to the SQLite file, which must not hold up the event loop
+            allowed, retry_after = await run_blocking(self.limiter.hit, client_key(scope), klass)
+        else:
+            allowed, retry_after = self.limiter.hit(client_key(scope), klass)
+        if not allowed:
+            RATE_LIMITED.inc(klass)
+            response = JSONResponse(
+                {"error": "Too many requests. Try again later."},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,205 @@
+"""
+Cache of serialized JSON responses for the polled read routes, with strong ETags.
+
+An entry is the encoded body of one route + parameters, stored with the generation of every
+tag it depends on (e.g. "feed:temp", "activitylog"). invalidate(tag) only bumps a counter, so
+it is cheap enough for the MQTT thread to call on every message; entries whose tags moved on
+are recomputed on their next request. A request whose If-None-Match matches a current entry
+gets 304 without the route running at all.
+
+Bodies are compressed for clients that accept it (brotli if installed, else gzip), once per
+entry and encoding, so a dashboard polling a 1000-point history over a slow link gets ~10x fewer
+bytes without the server compressing it again on every poll.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from starlette.responses import Response
+
+from metrics import RESPONSE_CACHE, RESPONSE_BYTES
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard library encoder is used without it
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Optional: responses are only gzipped without it
+    brotli = None
+
+# Responses kept in memory, the least recently used ones are evicted first
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+# Seconds an entry is served at most, even if none of its tags changed
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+# Bodies smaller than this many bytes are sent uncompressed, whatever the client accepts
+RESPONSE_COMPRESS_MIN_SIZE = int(os.getenv("RESPONSE_COMPRESS_MIN_SIZE", "1024"))
+
+# Tag of the activity log responses, invalidated when a batch of device state logs is written
+ACTIVITY_LOG_TAG = "activitylog"
+
+
+def feed_tag(feed_id) -> str:
+    # Tag of the responses built from a feed, invalidated by every value received on it
+    return "feed:" + feed_id
+
+
+def dumps(content) -> bytes:
+    """Compact JSON bytes, with orjson when it is installed (several times faster on large lists)."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS, default=str)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False, default=str).encode()
+
+
+def accepted_encoding(header):
+    """Best content coding the client accepts ("br", "gzip"), None for identity."""
+    if not header:
+        return None
+    weights = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        if params.strip().startswith("q="):
+            try:
+                weight = float(params.strip()[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if weights.get(encoding, weights.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    # Middle levels: most of the size gain of the highest ones at a fraction of the CPU
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def etag_matches(header, etag) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (candidate.strip() for candidate in header.split(","))
+
+
+class CachedBody:
+    __slots__ = ("body", "etag", "media_type", "generations", "expires", "_encoded")
+
+    def __init__(self, body: bytes, media_type: str, generations: tuple, expires: float):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.media_type = media_type
+        self.generations = generations
+        self.expires = expires
+        # Content coding -> compressed body, filled on the first request accepting it
+        self._encoded = {}
+
+    def encoded(self, encoding):
+        """(body, etag) sent for a content coding, each coding gets its own strong ETag."""
+        if encoding is None or len(self.body) < RESPONSE_COMPRESS_MIN_SIZE:
+            return self.body, self.etag
+        body = self._encoded.get(encoding)
+        if body is None:
+            body = self._encoded[encoding] = compress(self.body, encoding)
+        return body, self.etag[:-1] + "-" + encoding + '"'
+
+
+class ResponseCache:
+    def __init__(self, size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        # Called by invalidate_shared(tag) to reach the other worker processes (multi-worker mode)
+        self.share = None
+
+    def invalidate(self, tag: str):
+        with self._lock:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def invalidate_shared(self, tag: str):
+        """Invalidate here and in every other worker, for changes only this process sees (database writes)."""
+        self.invalidate(tag)
+        if self.share is not None:
+            self.share(tag)
+
+    def _current(self, tags) -> tuple:
+        with self._lock:
+            return tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def lookup(self, key, tags):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic() or entry.generations != self._current(tags):
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def store(self, key, generations: tuple, content, media_type: str = "application/json",
+              keep: bool = True) -> CachedBody:
+        # Routes with another encoding than JSON (see wireFormat.py) hand over the body already encoded
+        body = content if isinstance(content, bytes) else dumps(content)
+        entry = CachedBody(body, media_type, generations, time.monotonic() + self.ttl)
+        if not keep:
+            return entry  # Encoded for this response only, the next request computes it again
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return entry
+
+    async def respond(self, request, tags, compute, vary=(), media_type="application/json", cacheable=None):
+        """
+        Cached response of `compute()` (a coroutine function returning JSON-able content, or the
+        encoded body for another `media_type`), keyed by route, query parameters and `vary`
+        (e.g. the feed the user is served from). Content for which `cacheable(content)` is false
+        is sent but not kept. Only called from the event loop, the entries need no lock.
+        """
+        route = request.scope["route"].path
+        key = (route, tuple(sorted(request.query_params.multi_items())), *vary)
+        tags = tuple(tags)
+        entry = self.lookup(key, tags)
+        outcome = "hit"
+        if entry is None:
+            # Generations read before computing: data arriving meanwhile makes the entry stale right away
+            generations = self._current(tags)
+            content = await compute()
+            entry = self.store(key, generations, content, media_type,
+                               keep=cacheable is None or cacheable(content))
+            outcome = "miss"
+        encoding = accepted_encoding(request.headers.get("accept-encoding"))
+        body, etag = entry.encoded(encoding)
+        # no-cache: browsers keep the body but revalidate with If-None-Match on every poll. The body
+        # depends on the user behind the token, so a shared cache must not hand it to someone else
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding, Authorization"}
+        if request.method == "GET" and etag_matches(request.headers.get("if-none-match"), etag):
+            RESPONSE_CACHE.inc(route, "not_modified")
+            return Response(status_code=304, headers=headers)
+        if body is not entry.body:
+            headers["Content-Encoding"] = encoding
+        RESPONSE_CACHE.inc(route, outcome)
+        RESPONSE_BYTES.inc(route, headers.get("Content-Encoding", "identity"), amount=len(body))
+        return Response(body, media_type=entry.media_type, headers=headers)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+response_cache = ResponseCache()
+
+def get_response_cache():
+    return response_cache
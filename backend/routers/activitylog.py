@@ -1,17 +1,153 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, Query, HTTPException
+from fastapi.responses import StreamingResponse
+from asyncClients import execute
+from supabaseClient import get_db_async
+from deviceLogger import get_device_logger
+from responseCache import get_response_cache, ACTIVITY_LOG_TAG
+from queueLogging import get_logger
+from datetime import datetime
+from typing import Literal, Optional
+import base64
+import json
 
 router = APIRouter(prefix="/activitylog", tags=["Activity Log"])
+log = get_logger("Activity Log")
+
+LOG_TABLE = "devicestatelog"
+LOG_COLUMNS = ["log_id", "activities", "device_id", "user_id", "rule_id", "date"]
+# Rows fetched per query when streaming an export
+EXPORT_PAGE_SIZE = 1000
 
 @router.get("/")
 def get_activitylog_status():
-    return {"status": "activities log is working"}
+    return {"status": "activities log is working", "writer": get_device_logger().stats()}
 
+# Last 1000 log rows, cached until the device logger writes new ones. GET also answers If-None-Match with 304
+@router.get("/get1000")
 @router.post("/get1000")
 async def get_activities_log(request : Request ):
 
-    try:
-        supabase = request.app.state.db
-        result = supabase.table("devicestatelog").select("*").execute()
+    async def read_log():
+        result = await execute(supabase.table(LOG_TABLE).select("*")
+                               .order("log_id", desc=True)
+                               .limit(1000))
         return {"data": result.data}
+
+    try:
+        supabase = await get_db_async(request.app)
+        return await get_response_cache().respond(request, (ACTIVITY_LOG_TAG,), read_log)
+    except Exception as e:
+        return {"error": str(e)}
+
+# Sort key of a row: (date, log_id), date is only part of it when ordering by date
+def row_key(row, order):
+    return (None if order == "log_id" else row["date"]), row["log_id"]
+
+# Keyset cursor: the sort key of the last row returned, opaque to the client
+def encode_cursor(row, order):
+    date, log_id = row_key(row, order)
+    key = [log_id] if order == "log_id" else [date, log_id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor, order):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if order == "log_id":
+            (log_id,) = key
+            return None, int(log_id)
+        date, log_id = key
+        # Re-serialized, never passed on as sent: it is spliced into the or_ filter below
+        return datetime.fromisoformat(date).isoformat(), int(log_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_columns(columns, order):
+    if not columns:
+        return "*"
+    selected = [column.strip().lower() for column in columns.split(",") if column.strip()]
+    unknown = [column for column in selected if column not in LOG_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
+    # The sort key is always needed to build the next cursor
+    for column in (["log_id"] if order == "log_id" else ["date", "log_id"]):
+        if column not in selected:
+            selected.append(column)
+    return ",".join(selected)
+
+def build_query(supabase, columns, order, after, limit, device_id, user_id, rule_id, since, until):
+    query = supabase.table(LOG_TABLE).select(columns)
+    if device_id is not None:
+        query = query.eq("device_id", device_id)
+    if user_id is not None:
+        query = query.eq("user_id", user_id)
+    if rule_id is not None:
+        query = query.eq("rule_id", rule_id)
+    if since is not None:
+        query = query.gte("date", since.isoformat())
+    if until is not None:
+        query = query.lte("date", until.isoformat())
+
+    if after is not None:
+        date, log_id = after
+        if order == "log_id":
+            query = query.lt("log_id", log_id)
+        else:
+            query = query.or_(f'date.lt."{date}",and(date.eq."{date}",log_id.lt.{log_id})')
+
+    if order == "date":
+        query = query.order("date", desc=True)
+    return query.order("log_id", desc=True).limit(limit)
+
+# Route to page through the activity log, newest first, with keyset (cursor) pagination
+@router.get("/logs")
+async def query_activities_log(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    device_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    rule_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    columns: Optional[str] = Query(None, description="Comma separated columns, e.g. log_id,activities,date"),
+    order: Literal["log_id", "date"] = "log_id",
+    format: Literal["json", "ndjson"] = "json",
+):
+    select = parse_columns(columns, order)
+    after = decode_cursor(cursor, order) if cursor else None
+    filters = dict(device_id=device_id, user_id=user_id, rule_id=rule_id, since=since, until=until)
+    supabase = await get_db_async(request.app)
+
+    if format == "ndjson":
+        # Export: stream every matching row, one JSON object per line, fetched page by page.
+        # The first page is read before answering, so a failing query still gets a 502
+        try:
+            first = (await execute(build_query(supabase, select, order, after, EXPORT_PAGE_SIZE, **filters))).data
+        except Exception as e:
+            log.error("Activity log export failed: %s", e)
+            raise HTTPException(status_code=502, detail=str(e))
+
+        async def stream_rows(rows):
+            while True:
+                for row in rows:
+                    yield json.dumps(row, default=str) + "\n"
+                if len(rows) < EXPORT_PAGE_SIZE:
+                    return
+                try:
+                    rows = (await execute(build_query(supabase, select, order, row_key(rows[-1], order),
+                                                      EXPORT_PAGE_SIZE, **filters))).data
+                except Exception as e:
+                    # The status line is sent already: a last line tells the client the export is incomplete
+                    log.error("Activity log export cut short: %s", e)
+                    yield json.dumps({"error": str(e)}) + "\n"
+                    return
+
+        return StreamingResponse(stream_rows(first), media_type="application/x-ndjson")
+
+    try:
+        result = await execute(build_query(supabase, select, order, after, limit, **filters))
+        rows = result.data
+        next_cursor = encode_cursor(rows[-1], order) if len(rows) == limit else None
+        return {"data": rows, "next_cursor": next_cursor}
     except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
@@ -0,0 +1,85 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from adafruitConnection import get_dispatcher, get_scheduler, submit_actions, run_command
+from model import BulkCommand, ScheduledCommand
+from sensorCache import utc_timestamp
+from datetime import datetime, timezone
+from typing import Optional
+from auth import get_optional_user, get_current_user
+from sharedState import INGEST_MODE
+
+router = APIRouter(prefix="/commands", tags=["Commands"])
+
+# (device role, value published, activity logged) of an action, worded like the single-command routes
+def action_command(action):
+    if action.device == "fan":
+        return "fan", action.speed, f"User set fan speed to {action.speed}"
+    if action.device == "switch":
+        return "switch", int(action.on), "User turned on the light" if action.on else "User turned off the light"
+    return "color", action.code.value, f"User changed light color to {action.code.name}"
+
+# Scheduled commands are held in memory by the process that accepted them: with several API
+# workers, a schedule could neither be listed nor cancelled from another worker, so none are taken
+def require_local_scheduler():
+    if INGEST_MODE == "worker":
+        raise HTTPException(status_code=501, detail="Scheduled commands are not available with INGEST_MODE=worker")
+
+def describe_entry(entry):
+    return {
+        "id": entry["id"],
+        "actions": [{"device": role, "value": value} for role, value, _ in entry["actions"]],
+        "run_at": utc_timestamp(entry["run_at"]),
+        "every": entry["every"],
+        "runs": entry["runs"],
+    }
+
+@router.get("/")
+def get_commands_status(request: Request):
+    return {
+        "status": "commands are working",
+        "commands": get_dispatcher().stats(),
+        "scheduled": get_scheduler().stats(),
+        "idempotency": request.app.state.idempotency.stats(),
+    }
+
+# Route to apply several device actions in one request, e.g. a scene: they are queued together
+# in the order given, or none of them if one cannot be
+@router.post("/bulk", status_code=202)
+async def run_bulk(data: BulkCommand, user: Optional[dict] = Depends(get_optional_user)):
+    try:
+        user_id = user["user_id"] if user else None
+        queued = await run_command(submit_actions, user_id, [action_command(action) for action in data.actions])
+        return {"message": "Success", "actions": len(data.actions), **queued}
+    except Exception as e:
+        return {"error": str(e)}
+
+# Route to run device actions later (`delay` seconds or `at` a time), and again `every` seconds if given
+@router.post("/schedule", status_code=202, dependencies=[Depends(require_local_scheduler)])
+async def schedule_commands(data: ScheduledCommand, user: dict = Depends(get_current_user)):
+    if (data.delay is None) == (data.at is None):
+        raise HTTPException(status_code=422, detail="Give either delay or at")
+    delay = data.delay
+    if data.at is not None:
+        at = data.at if data.at.tzinfo is not None else data.at.replace(tzinfo=timezone.utc)
+        delay = (at - datetime.now(timezone.utc)).total_seconds()
+        if delay < 0:
+            raise HTTPException(status_code=422, detail="at is in the past")
+    try:
+        entry = get_scheduler().schedule(user["user_id"], [action_command(action) for action in data.actions],
+                                         delay, data.every)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"message": "Scheduled", **describe_entry(entry)}
+
+# Route to list the user's pending scheduled commands, soonest first
+@router.get("/scheduled", dependencies=[Depends(require_local_scheduler)])
+def get_scheduled(user: dict = Depends(get_current_user)):
+    return {"scheduled": [describe_entry(entry) for entry in get_scheduler().pending(user["user_id"])]}
+
+# Route to cancel a scheduled command (a recurring one stops for good)
+@router.delete("/scheduled/{entry_id}", dependencies=[Depends(require_local_scheduler)])
+def cancel_scheduled(entry_id: int, user: dict = Depends(get_current_user)):
+    if not get_scheduler().cancel(entry_id, user["user_id"]):
+        raise HTTPException(status_code=404, detail=f"No scheduled command {entry_id}")
+    return {"message": "Cancelled", "id": entry_id}
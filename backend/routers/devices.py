@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Request, Depends
+from adafruitConnection import get_device_registry, request_reload
+from asyncClients import execute
+from supabaseClient import get_db_async
+from auth import get_current_user
+
+router = APIRouter(prefix="/devices", tags=["Devices"])
+
+DEVICE_COLUMNS = "device_id,name,properties,user_id,serial_number"
+
+# Blocking read of the device tables, used by the registry's refresh thread
+def fetch_devices(supabase):
+    devices = supabase.table("devicesensor").select(DEVICE_COLUMNS).execute()
+    types = supabase.table("devicesensortype").select("serial_number,name").execute()
+    return devices.data, types.data
+
+@router.get("/")
+def get_devices_status():
+    return {"status": "devices are working", **get_device_registry().stats()}
+
+# Route to list the devices of the logged in user and the feed each one is routed to
+@router.get("/me")
+async def get_my_devices(user: dict = Depends(get_current_user)):
+    return {"devices": get_device_registry().devices_of(user["user_id"])}
+
+# Route to pick up device changes now instead of at the next periodic refresh, for logged in users only:
+# it reads both device tables
+@router.post("/reload", dependencies=[Depends(get_current_user)])
+async def reload_devices(request: Request):
+    try:
+        supabase = await get_db_async(request.app)
+        devices = await execute(supabase.table("devicesensor").select(DEVICE_COLUMNS))
+        types = await execute(supabase.table("devicesensortype").select("serial_number,name"))
+        registry = get_device_registry()
+        registry.refresh(devices.data, types.data)
+        request_reload("devices")
+        return registry.stats()
+    except Exception as e:
+        return {"error": str(e)}
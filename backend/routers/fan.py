@@ -1,31 +1,36 @@
-from fastapi import APIRouter
-from adafruitConnection import get_aio, get_mqtt, AIO_FEED_IDS
+from fastapi import APIRouter, Depends
+from adafruitConnection import get_dispatcher, get_device_registry, run_command
+from deviceLogger import log_device_action
 from model import FanSpeed
+from typing import Optional
+from auth import get_optional_user
 
 router = APIRouter(prefix="/fan", tags=["Fan"])
 
 @router.get("/")
 def get_fan_status():
-    return {"status": "Fan is working"}
+    return {"status": "Fan is working", "commands": get_dispatcher().stats()}
 
-@router.post("/fan/off")
-async def turn_off_fan():
+@router.post("/fan/off", status_code=202)
+async def turn_off_fan(user: Optional[dict] = Depends(get_optional_user)):
     try:
-        mqtt_client = get_mqtt()
-        print(f"Publishing 0 to {AIO_FEED_IDS[1]}")
-        mqtt_client.publish( AIO_FEED_IDS[1] , 0)
-        return { "message": "Success" }
+        user_id = user["user_id"] if user else None
+        feed_id, device_id = get_device_registry().resolve(user_id, "fan")
+        queued = await run_command(get_dispatcher().submit, feed_id, 0)
+        log_device_action("User turned off the fan", feed_id, user_id=user_id, device_id=device_id)
+        return {"message": "Success", **queued}
     except Exception as e:
         return {"error": str(e)}
 
 
 
-@router.post("/fan/on")
-async def turn_on_fan(data: FanSpeed):
+@router.post("/fan/on", status_code=202)
+async def turn_on_fan(data: FanSpeed, user: Optional[dict] = Depends(get_optional_user)):
     try:
-        mqtt_client = get_mqtt()
-        print(f"Publishing {data.speed} to {AIO_FEED_IDS[1]}")
-        mqtt_client.publish(AIO_FEED_IDS[1], data.speed)
-        return {"message": f"Fan turned on at speed {data.speed}"}
+        user_id = user["user_id"] if user else None
+        feed_id, device_id = get_device_registry().resolve(user_id, "fan")
+        queued = await run_command(get_dispatcher().submit, feed_id, data.speed)
+        log_device_action(f"User set fan speed to {data.speed}", feed_id, user_id=user_id, device_id=device_id)
+        return {"message": f"Fan turned on at speed {data.speed}", **queued}
     except Exception as e:
         return {"error": str(e)}
\ No newline at end of file
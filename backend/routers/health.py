@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from startupState import get_startup_state
+
+router = APIRouter(prefix="/health", tags=["Health"])
+
+# Liveness: the process answers, whatever state the warm-up is in (restart it if this fails)
+@router.get("/live")
+def get_liveness():
+    return {"status": "alive"}
+
+# Readiness: the warm-up finished and its required steps succeeded (send it traffic once this is 200)
+@router.get("/ready")
+def get_readiness():
+    report = get_startup_state().report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from adafruitConnection import ingest_health
+
+router = APIRouter(prefix="/ingest", tags=["Ingest"])
+
+# Route to check the MQTT connections: state, reconnects and backlog of every shard
+# (of the ingest process, as of its last heartbeat, on an API worker of a multi-worker deployment)
+@router.get("/")
+def get_ingest_health():
+    health = ingest_health()
+    return JSONResponse(health, status_code=200 if health["healthy"] else 503)
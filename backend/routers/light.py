@@ -1,39 +1,45 @@
-from fastapi import APIRouter
-from adafruitConnection import get_aio, get_mqtt, AIO_FEED_IDS
+from fastapi import APIRouter, Depends
+from adafruitConnection import get_dispatcher, get_device_registry, run_command
+from deviceLogger import log_device_action
 from model import Color
+from typing import Optional
+from auth import get_optional_user
 
 router = APIRouter( prefix="/light", tags=["Light"])
 
 @router.get("/")
 def get_light_status():
-    return {"status": "light is working"}
+    return {"status": "light is working", "commands": get_dispatcher().stats()}
 
-@router.post("/switch/on")
-async def turn_on_light():
+@router.post("/switch/on", status_code=202)
+async def turn_on_light(user: Optional[dict] = Depends(get_optional_user)):
     try:
-        mqtt_client = get_mqtt()
-        print(f"Publishing 1 to {AIO_FEED_IDS[4]}")
-        mqtt_client.publish( AIO_FEED_IDS[4] , 1)
-        return { "message": "Success" }
+        user_id = user["user_id"] if user else None
+        feed_id, device_id = get_device_registry().resolve(user_id, "switch")
+        queued = await run_command(get_dispatcher().submit, feed_id, 1)
+        log_device_action("User turned on the light", feed_id, user_id=user_id, device_id=device_id)
+        return {"message": "Success", **queued}
     except Exception as e:
         return {"error": str(e)}
     
-@router.post("/switch/off")
-async def turn_off_light():
+@router.post("/switch/off", status_code=202)
+async def turn_off_light(user: Optional[dict] = Depends(get_optional_user)):
     try:
-        mqtt_client = get_mqtt()
-        print(f"Publishing 0 to {AIO_FEED_IDS[4]}")
-        mqtt_client.publish( AIO_FEED_IDS[4] , 0)
-        return { "message": "Success" }
+        user_id = user["user_id"] if user else None
+        feed_id, device_id = get_device_registry().resolve(user_id, "switch")
+        queued = await run_command(get_dispatcher().submit, feed_id, 0)
+        log_device_action("User turned off the light", feed_id, user_id=user_id, device_id=device_id)
+        return {"message": "Success", **queued}
     except Exception as e:
         return {"error": str(e)}
     
-@router.post("/switch/colorchange")
-async def change_color(data : Color):
+@router.post("/switch/colorchange", status_code=202)
+async def change_color(data : Color, user: Optional[dict] = Depends(get_optional_user)):
     try:
-        mqtt_client = get_mqtt()
-        print(f"Publishing {data.code.value} to {AIO_FEED_IDS[0]}")
-        mqtt_client.publish( AIO_FEED_IDS[0] , data.code.value)
-        return { "message": "Success" }
+        user_id = user["user_id"] if user else None
+        feed_id, device_id = get_device_registry().resolve(user_id, "color")
+        queued = await run_command(get_dispatcher().submit, feed_id, data.code.value)
+        log_device_action(f"User changed light color to {data.code.name}", feed_id, user_id=user_id, device_id=device_id)
+        return {"message": "Success", **queued}
     except Exception as e:
         return {"error": str(e)}
@@ -1,9 +1,22 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, Depends
 from model import login_info, register_info
 from datetime import datetime
+from asyncClients import execute
+from supabaseClient import get_db_async
+from auth import (get_current_user, hash_password_async, verify_password_async,
+                  needs_rehash, issue_token, public_user, user_cache)
 
 router = APIRouter(prefix="/login", tags=["Login"])
 
+# Hash unknown usernames are checked against, made on first use: scrypt takes as long as a login
+dummy_hash = None
+
+async def get_dummy_hash():
+    global dummy_hash
+    if dummy_hash is None:
+        dummy_hash = await hash_password_async("dummy-password")
+    return dummy_hash
+
 @router.get("/")
 def get_login_status():
     return {"status": "login is working"}
@@ -13,16 +26,30 @@ async def check_authentication(request : Request, data: login_info ):
     try:
         username = data.username
         password = data.password
-        supabase = request.app.state.db
-        result = supabase.table("users").select("*")\
-                .eq("username", username)\
-                .eq("pass", password)\
-                .execute()
-
-        if result.data != []:
-            return {"message": "Login successful", "user": result.data[0]}
-        else:
+        supabase = await get_db_async(request.app)
+        result = await execute(supabase.table("users").select("*")\
+                .eq("username", username))
+
+        # Unknown usernames are checked against a dummy hash so both cases take the same time
+        user = result.data[0] if result.data != [] else None
+        stored = user["pass"] if user is not None else await get_dummy_hash()
+        if not await verify_password_async(password, stored) or user is None:
             return {"message": "Invalid username or password"}
+
+        if needs_rehash(stored):
+            # Upgrade plain text / older-cost passwords now that we know the password
+            await execute(supabase.table("users")\
+                    .update({"pass": await hash_password_async(password)})\
+                    .eq("user_id", user["user_id"]))
+
+        user = public_user(user)
+        user_cache.put(user["user_id"], user)
+        return {
+            "message": "Login successful",
+            "user": user,
+            "access_token": issue_token(user),
+            "token_type": "bearer",
+        }
     except Exception as e:
         return {"error": str(e)}
     
@@ -34,19 +61,23 @@ async def register_new_account(request : Request, data: register_info ):
         email = data.email
         dob = data.date_of_birth.isoformat()
         ssn = data.SSN
-        supabase = request.app.state.db
-        supabase.table("users").insert({"username" : username, 
-                                        "pass" : password, 
-                                        "email" : email, 
-                                        "date_of_birth" : dob, 
-                                        "social_security_number" : ssn})\
-                                .execute()
+        supabase = await get_db_async(request.app)
+        await execute(supabase.table("users").insert({"username" : username, 
+                                                      "pass" : await hash_password_async(password), 
+                                                      "email" : email, 
+                                                      "date_of_birth" : dob, 
+                                                      "social_security_number" : ssn}))
         return {"message" : "success"}
     except Exception as e:
         if "23505" in str(e):
             return {"error": "Username already exists"}
         return {"error": str(e)}
 
+# Route to get the user behind an access token, verified locally without a database query
+@router.get("/me")
+async def get_me(user: dict = Depends(get_current_user)):
+    return {"user": user}
+
 # @router.get("/items/")
 # def read_items(request: Request):
 #     cursor = request.app.state.db.cursor()
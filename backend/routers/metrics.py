@@ -0,0 +1,106 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+from adafruitConnection import (get_dispatcher, get_history_store, get_rule_engine, ingest_health, get_scheduler,
+                                get_anomaly_detector, get_history_archive, get_event_follower, AIO_FEED_IDS)
+from broadcaster import get_broadcaster
+from deviceLogger import get_device_logger
+from metrics import get_registry, MQTT_LAST_MESSAGE
+import time
+
+router = APIRouter(tags=["Metrics"])
+
+registry = get_registry()
+# Current state, read when /metrics is scraped
+WS_CLIENTS = registry.gauge("ws_clients", "Connected WebSocket clients")
+WS_QUEUED = registry.gauge("ws_queued_messages", "Messages waiting in WebSocket client queues")
+WS_MAX_QUEUE_DEPTH = registry.gauge("ws_max_queue_depth", "Longest WebSocket client queue")
+WS_DROPPED = registry.gauge("ws_dropped_messages", "Messages dropped for slow WebSocket clients still connected")
+MQTT_FEED_LAG = registry.gauge("mqtt_feed_lag_seconds", "Seconds since the last MQTT message, by feed", ("feed",))
+HISTORY_POINTS = registry.gauge("sensor_history_points", "Values held in the in-memory history, by feed", ("feed",))
+COMMAND_QUEUE = registry.gauge("command_queue_depth", "Device commands waiting to be published")
+SCHEDULED_PENDING = registry.gauge("scheduled_commands_pending", "Scheduled device commands waiting for their time")
+DEVICE_LOG_BUFFERED = registry.gauge("device_log_buffered", "Device state log events waiting to be written")
+RULES = registry.gauge("rules", "Automation rules, loaded or skipped", ("state",))
+RATE_LIMIT_BUCKETS = registry.gauge("rate_limit_buckets", "Token buckets held by the rate limiter")
+MQTT_CONNECTED = registry.gauge("mqtt_connected", "1 if the MQTT connection of the shard is up", ("shard",))
+INGEST_QUEUED = registry.gauge("ingest_queued_messages", "MQTT messages waiting for an ingest worker")
+ARCHIVE_BUFFERED = registry.gauge("sensor_archive_buffered", "Sensor samples waiting to be written to the on-disk archive")
+ALERTS_ACTIVE = registry.gauge("alerts_active", "Sensor alerts raised and not cleared yet")
+# Totals since start, copied from the components' own counters
+COMMANDS = registry.counter("commands_total", "Device commands handled, by outcome", ("outcome",))
+SCHEDULED_COMMANDS = registry.counter("scheduled_commands_total", "Scheduled device commands, by outcome", ("outcome",))
+IDEMPOTENCY = registry.counter("idempotency_requests_total", "Command requests with an Idempotency-Key, by outcome", ("outcome",))
+DEVICE_LOG = registry.counter("device_log_events_total", "Device state log events, by outcome", ("outcome",))
+RULE_ACTIVITY = registry.counter("rule_activity_total", "Values evaluated by the automation rules and commands they fired", ("event",))
+MQTT_RECONNECTS = registry.counter("mqtt_reconnects_total", "MQTT reconnects, by shard", ("shard",))
+INGEST_DROPPED = registry.counter("ingest_dropped_messages_total", "MQTT messages dropped because the worker queue was full", ("shard",))
+ARCHIVE = registry.counter("sensor_archive_samples_total", "Sensor samples of the on-disk archive, by outcome", ("outcome",))
+SHARED_EVENTS_APPLIED = registry.counter("shared_events_applied_total", "Events of the ingest process applied by this API worker (multi-worker mode)")
+ALERTS = registry.counter("alerts_total", "Sensor values evaluated, alerts raised and alerts suppressed by the cooldown", ("outcome",))
+
+
+def collect_state(app):
+    ws = get_broadcaster().stats()
+    WS_CLIENTS.set(ws["clients"])
+    WS_QUEUED.set(ws["queued"])
+    WS_MAX_QUEUE_DEPTH.set(ws["max_queue_depth"])
+    WS_DROPPED.set(ws["dropped"])
+
+    now = time.time()
+    for (feed,), last in MQTT_LAST_MESSAGE.samples().items():
+        MQTT_FEED_LAG.set(round(now - last, 3), feed)
+
+    history = get_history_store()
+    for feed in AIO_FEED_IDS:
+        HISTORY_POINTS.set(len(history.series(feed)), feed)
+
+    commands = get_dispatcher().stats()
+    COMMAND_QUEUE.set(commands["queue_depth"])
+    for outcome in ("submitted", "coalesced", "published", "failed"):
+        COMMANDS.set_total(commands[outcome], outcome)
+
+    device_log = get_device_logger().stats()
+    DEVICE_LOG_BUFFERED.set(device_log["buffered"])
+    for outcome in ("logged", "written", "spilled", "replayed", "rejected", "dropped"):
+        DEVICE_LOG.set_total(device_log[outcome], outcome)
+
+    rules = get_rule_engine().stats()
+    for state in ("loaded", "skipped"):
+        RULES.set(rules[state], state)
+    for event in ("evaluated", "fired"):
+        RULE_ACTIVITY.set_total(rules[event], event)
+
+    RATE_LIMIT_BUCKETS.set(len(app.state.rate_limiter))
+
+    scheduled = get_scheduler().stats()
+    SCHEDULED_PENDING.set(scheduled["pending"])
+    for outcome in ("scheduled", "fired", "failed", "cancelled"):
+        SCHEDULED_COMMANDS.set_total(scheduled[outcome], outcome)
+    idempotency = app.state.idempotency.stats()
+    for outcome in ("stored", "replayed", "conflicts", "mismatches"):
+        IDEMPOTENCY.set_total(idempotency[outcome], outcome)
+
+    archive = get_history_archive().stats()
+    ARCHIVE_BUFFERED.set(archive["buffered"])
+    for outcome in ("added", "written", "dropped", "failed", "rolled_up"):
+        ARCHIVE.set_total(archive[outcome], outcome)
+
+    alerts = get_anomaly_detector().stats()
+    ALERTS_ACTIVE.set(alerts["active"])
+    for outcome in ("evaluated", "raised", "suppressed"):
+        ALERTS.set_total(alerts[outcome], outcome)
+
+    ingest = ingest_health()
+    INGEST_QUEUED.set(ingest.get("queued", 0))
+    for shard in ingest.get("shards", ()):
+        MQTT_CONNECTED.set(1 if shard["state"] == "connected" else 0, shard["shard"])
+        MQTT_RECONNECTS.set_total(shard["reconnects"], shard["shard"])
+        INGEST_DROPPED.set_total(shard["dropped"], shard["shard"])
+    SHARED_EVENTS_APPLIED.set_total(get_event_follower().stats()["applied"])
+
+
+# Prometheus scrape endpoint (text exposition format)
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(request: Request):
+    collect_state(request.app)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
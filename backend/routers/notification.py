@@ -0,0 +1,117 @@
+import asyncio
+import json
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from adafruitConnection import get_latest_cache, get_anomaly_detector
+from broadcaster import get_broadcaster
+from queueLogging import get_logger
+from sensorHistory import to_epoch_ms
+from wireFormat import wants_columns, encode_columns
+
+router = APIRouter(prefix="/notifications", tags=["Notification"])
+log = get_logger("WebSocket")
+
+@router.get("/")
+def get_notification_status():
+    return {"status": "notification is working", "clients": get_broadcaster().subscriber_count}
+
+# Route to list the alerts currently raised and the rolling statistics they are judged against
+@router.get("/alerts")
+def get_alerts():
+    detector = get_anomaly_detector()
+    return {"alerts": detector.active(), "feeds": detector.feed_stats(), **detector.stats()}
+
+# Push every message queued for this client
+async def send_loop(websocket: WebSocket, subscriber):
+    while True:
+        message = await subscriber.queue.get()
+        await websocket.send_json(message)
+
+# Sensor values of a columnar frame, at most one byte of feed index each
+MAX_FRAME_SAMPLES = 255
+
+def numeric_sample(message):
+    # (feed, epoch ms, value) of a numeric sensor message, None for anything else (alerts, colors, text)
+    if message.get("type") != "sensor":
+        return None
+    try:
+        return message["feed"], to_epoch_ms(message["timestamp"]), float(message["value"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def sensor_frame(samples):
+    names = list(dict.fromkeys(feed for feed, _, _ in samples))
+    index = {feed: i for i, feed in enumerate(names)}
+    return encode_columns([ts for _, ts, _ in samples], [value for _, _, value in samples],
+                          [index[feed] for feed, _, _ in samples], names)
+
+def columnar_frames(messages):
+    """Runs of numeric sensor values as one binary frame each, the other messages as they are, in order."""
+    samples = []
+    for message in messages:
+        sample = numeric_sample(message)
+        if sample is None:
+            if samples:
+                yield sensor_frame(samples)
+                samples = []
+            yield message
+            continue
+        samples.append(sample)
+        if len(samples) == MAX_FRAME_SAMPLES:
+            yield sensor_frame(samples)
+            samples = []
+    if samples:
+        yield sensor_frame(samples)
+
+# Columnar clients: the values queued meanwhile leave together in a binary frame, other messages as JSON
+async def send_columns_loop(websocket: WebSocket, subscriber):
+    while True:
+        messages = [await subscriber.queue.get()]
+        while not subscriber.queue.empty():
+            messages.append(subscriber.queue.get_nowait())
+        for frame in columnar_frames(messages):
+            if isinstance(frame, bytes):
+                await websocket.send_bytes(frame)
+            else:
+                await websocket.send_json(frame)
+
+# Clients can narrow what they receive with {"type": "subscribe", "feeds": [...]}, an empty list means all feeds
+async def receive_loop(websocket: WebSocket, subscriber):
+    while True:
+        try:
+            data = json.loads(await websocket.receive_text())
+        except ValueError:
+            continue
+        if isinstance(data, dict) and data.get("type") == "subscribe":
+            feeds = data.get("feeds") or None
+            subscriber.feeds = set(feeds) if feeds else None
+
+@router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    # ws://.../notifications/ws?format=columns: sensor values as binary frames (see wireFormat.py)
+    columns = wants_columns(websocket)
+    broadcaster = get_broadcaster()
+    subscriber = broadcaster.subscribe()
+    tasks = []
+    try:
+        # Current state of every feed and the alerts still raised, so the client does not need to poll on connect
+        await websocket.send_json({
+            "type": "init",
+            "notifications": get_anomaly_detector().active(),
+            "sensors": get_latest_cache().snapshot(),
+        })
+        tasks = [
+            asyncio.create_task((send_columns_loop if columns else send_loop)(websocket, subscriber)),
+            asyncio.create_task(receive_loop(websocket, subscriber)),
+        ]
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                log.error("%s", error)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        broadcaster.unsubscribe(subscriber)
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Request, Depends
+from adafruitConnection import get_rule_engine, request_reload
+from asyncClients import execute
+from supabaseClient import get_db_async
+from queueLogging import get_logger
+from auth import get_current_user
+
+router = APIRouter(prefix="/rules", tags=["Automation Rules"])
+log = get_logger("Rules")
+
+RULE_TABLE = "automationrule"
+
+# Compile the AutomationRule table into the rule engine, returns the engine counters
+async def load_rules(supabase):
+    result = await execute(supabase.table(RULE_TABLE).select("rule_id,rule_description,device_id"))
+    engine = get_rule_engine()
+    engine.load(result.data)
+    return engine.stats()
+
+@router.get("/")
+def get_rules_status():
+    return {"status": "rules are working", **get_rule_engine().stats()}
+
+# Route to list the compiled rules and whether each one is currently active
+@router.get("/active")
+def get_compiled_rules():
+    return {"rules": get_rule_engine().rules()}
+
+# Route to pick up rules added or changed in the database, for logged in users only: it reads the whole table
+@router.post("/reload", dependencies=[Depends(get_current_user)])
+async def reload_rules(request: Request):
+    try:
+        stats = await load_rules(await get_db_async(request.app))
+        request_reload("rules")
+        return stats
+    except Exception as e:
+        log.error("Reload failed: %s", e)
+        return {"error": str(e)}
@@ -1,86 +1,279 @@
 
-from fastapi import APIRouter, Request
-from adafruitConnection import get_aio, get_mqtt, AIO_FEED_IDS
+from fastapi import APIRouter, Request, Query, HTTPException, Depends
+from adafruitConnection import (get_aio_async, get_latest_cache, get_history_store, get_history_archive,
+                                get_device_registry)
+from asyncClients import run_blocking
+from responseCache import get_response_cache, feed_tag
+from auth import get_optional_user_id
+from sensorHistory import (SENSOR_HISTORY_CAPACITY, SENSOR_HISTORY_SEED_SIZE, to_epoch_ms, format_timestamps,
+                           format_entries)
+from downsample import bucket_aggregate, lttb
+from wireFormat import COLUMNS_MEDIA_TYPE, wants_columns, encode_columns
 from datetime import datetime
+from typing import Literal, Optional
+import asyncio
+import time
+import numpy as np
 
 router = APIRouter(prefix="/sensor", tags=["Sensor"])
 
+# Sensor names used in the routes, the device role each one is served from
+SENSOR_ROLES = ("temp", "light", "humid")
+
+# Feed of the user's own sensor for this role, or the default one (see deviceRegistry.py)
+def user_feed(user_id, role):
+    return get_device_registry().resolve(user_id, role)[0]
+
+# Serve the latest value from the MQTT-fed cache, only go to the REST API when it is cold or stale
+async def read_latest(feed_id):
+    cache = get_latest_cache()
+    cached = cache.get(feed_id)
+    if cached is not None:
+        return cached
+
+    requested_at = time.monotonic()
+    aio = get_aio_async()
+    latest_value = await aio.receive(feed_id)  # Fetch latest value
+    return cache.refresh(feed_id, latest_value.value, latest_value.created_at, requested_at)
+
+# The feed is seeded from the REST API only once, by the startup thread or the first request
+async def ensure_seeded(feed_id):
+    store = get_history_store()
+    if not store.is_seeded(feed_id):
+        history = await get_aio_async().data(feed_id, max_results=SENSOR_HISTORY_SEED_SIZE)
+        store.seed_entries(feed_id, history)
+    return store
+
+# Ranges starting before the oldest sample held in memory: (since, until) of that older part, which
+# is read from the on-disk archive, or None when the ring buffer covers the whole range
+def archive_range(series, since_ms, until_ms):
+    if since_ms is None or not get_history_archive().active:
+        return None
+    oldest = series.oldest()
+    if oldest is None:
+        return since_ms, until_ms
+    if since_ms >= oldest:
+        return None
+    return since_ms, oldest - 1 if until_ms is None else min(until_ms, oldest - 1)
+
+# Archive samples in front of the in-memory ones, without the ones both hold (seeded over REST)
+def join_older(older, newer):
+    (old_ts, old_values), (timestamps, values) = older, newer
+    if len(timestamps):
+        keep = old_ts < timestamps[0]
+        old_ts, old_values = old_ts[keep], old_values[keep]
+    return np.concatenate([old_ts, timestamps]), np.concatenate([old_values, values])
+
+# (timestamps, values) arrays, oldest first, from the in-memory time series, preceded by the
+# archive for the part of the range that is older than it: raw samples, or the hourly / daily
+# means of the spans compacted already
+async def read_series(feed_id, since, until, limit):
+    store = await ensure_seeded(feed_id)
+    since_ms = None if since is None else to_epoch_ms(since)
+    until_ms = None if until is None else to_epoch_ms(until)
+    series = store.series(feed_id)
+    older = archive_range(series, since_ms, until_ms)
+    newer = series.query(since_ms, until_ms, limit)
+    if older is None or (limit is not None and len(newer[0]) >= limit):
+        return newer
+    rest = None if limit is None else limit - len(newer[0])
+    return join_older(await run_blocking(get_history_archive().points, feed_id, *older, rest), newer)
+
+# History as {"value", "timestamp"} entries, newest first like the Adafruit REST API
+async def read_history(feed_id, since, until, limit):
+    timestamps, values = await read_series(feed_id, since, until, limit)
+    return format_entries(timestamps[::-1], values[::-1])
+
+# History as delta-encoded timestamp and float32 value columns, oldest first (see wireFormat.py)
+async def read_history_columns(feed_id, since, until, limit):
+    timestamps, values = await read_series(feed_id, since, until, limit)
+    return encode_columns(timestamps, values)
+
+# Polled routes: the serialized response is reused until a new value arrives on the feed.
+# Entries are per user, as the feed a user is served from depends on their devices
+async def cached(request, user_id, feed_id, compute):
+    return await get_response_cache().respond(request, (feed_tag(feed_id),), compute, vary=(user_id, feed_id))
+
+# History in the encoding the client negotiated, JSON unless it asked for columns
+async def history_response(request, user_id, feed_id, since, until, limit):
+    if wants_columns(request):
+        return await get_response_cache().respond(
+            request, (feed_tag(feed_id),), lambda: read_history_columns(feed_id, since, until, limit),
+            vary=(user_id, feed_id, COLUMNS_MEDIA_TYPE), media_type=COLUMNS_MEDIA_TYPE)
+    return await cached(request, user_id, feed_id, lambda: read_history(feed_id, since, until, limit))
+
 @router.get("/")
 def get_sensor_status():
     return {"status": "sensor is working"}
 
 # Route to get the latest temperature data
 @router.get("/temp/latest")
-async def get_latest_temp():
+async def get_latest_temp(request: Request, user_id: Optional[int] = Depends(get_optional_user_id)):
     try:
-        aio = get_aio()
-        latest_value = aio.receive(AIO_FEED_IDS[5])  # Fetch latest value
-        return {
-            "value": latest_value.value,
-            "timestamp": latest_value.created_at
-        }
+        feed_id = user_feed(user_id, "temp")
+        return await cached(request, user_id, feed_id, lambda: read_latest(feed_id))
     except Exception as e:
         return {"error": str(e)}
 
-# Route to get historical temperature data - limit 1000 records
+# Route to get historical temperature data - last 1000 records by default
 @router.get("/temp/history1000")
-async def get_temp_history():
+async def get_temp_history(
+    request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=SENSOR_HISTORY_CAPACITY),
+    user_id: Optional[int] = Depends(get_optional_user_id),
+):
     try:
-        aio = get_aio()
-        history = aio.data(AIO_FEED_IDS[5], max_results=1000) 
-        return [
-            {"value": entry.value, "timestamp": entry.created_at} for entry in history
-        ]
+        feed_id = user_feed(user_id, "temp")
+        return await history_response(request, user_id, feed_id, since, until, limit)
     except Exception as e:
         return {"error": str(e)}
     
 # Route to get the latest light data
 @router.get("/light/latest")
-async def get_latest_light():
+async def get_latest_light(request: Request, user_id: Optional[int] = Depends(get_optional_user_id)):
     try:
-        aio = get_aio()
-        latest_value = aio.receive(AIO_FEED_IDS[3])  # Fetch latest value
-        return {
-            "value": latest_value.value,
-            "timestamp": latest_value.created_at
-        }
+        feed_id = user_feed(user_id, "light")
+        return await cached(request, user_id, feed_id, lambda: read_latest(feed_id))
     except Exception as e:
         return {"error": str(e)}
 
-# Route to get historical light data - limit 1000 records  
+# Route to get historical light data - last 1000 records by default
 @router.get("/light/history1000")
-async def get_light_history():
+async def get_light_history(
+    request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=SENSOR_HISTORY_CAPACITY),
+    user_id: Optional[int] = Depends(get_optional_user_id),
+):
     try:
-        aio = get_aio()
-        history = aio.data(AIO_FEED_IDS[3], max_results=1000)  # Get last 5 entries
-        return [
-            {"value": entry.value, "timestamp": entry.created_at} for entry in history
-        ]
+        feed_id = user_feed(user_id, "light")
+        return await history_response(request, user_id, feed_id, since, until, limit)
     except Exception as e:
         return {"error": str(e)}
     
 # Route to get the latest humid data
 @router.get("/humid/latest")
-async def get_latest_humid():
+async def get_latest_humid(request: Request, user_id: Optional[int] = Depends(get_optional_user_id)):
     try:
-        aio = get_aio()
-        latest_value = aio.receive(AIO_FEED_IDS[2])  # Fetch latest value
+        feed_id = user_feed(user_id, "humid")
+        return await cached(request, user_id, feed_id, lambda: read_latest(feed_id))
+    except Exception as e:
+        return {"error": str(e)}
+
+# Route to get historical humid data - last 1000 records by default
+@router.get("/humid/history1000")
+async def get_humid_history(
+    request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=SENSOR_HISTORY_CAPACITY),
+    user_id: Optional[int] = Depends(get_optional_user_id),
+):
+    try:
+        feed_id = user_feed(user_id, "humid")
+        return await history_response(request, user_id, feed_id, since, until, limit)
+    except Exception as e:
+        return {"error": str(e)}
+
+# Latest value and history window of one sensor, in columns
+async def read_snapshot(feed_id, since, until, limit):
+    if limit == 0:
+        return {"latest": await read_latest(feed_id)}
+    latest, (timestamps, values) = await asyncio.gather(
+        read_latest(feed_id), read_series(feed_id, since, until, limit))
+    return {
+        "latest": latest,
+        "history": {"timestamp": format_timestamps(timestamps), "value": values.tolist()},
+    }
+
+# Route to load several sensors in one request: the latest value and recent history of each,
+# fetched concurrently and served from the response cache until one of the feeds changes
+@router.get("/snapshot")
+async def get_sensor_snapshot(
+    request: Request,
+    feeds: str = Query(",".join(SENSOR_ROLES), description="Comma separated sensors, e.g. temp,humid,light"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(100, ge=0, le=SENSOR_HISTORY_CAPACITY, description="History points per sensor, 0 for none"),
+    user_id: Optional[int] = Depends(get_optional_user_id),
+):
+    roles = list(dict.fromkeys(role.strip() for role in feeds.split(",") if role.strip()))
+    unknown = [role for role in roles if role not in SENSOR_ROLES]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown sensor feeds: {', '.join(unknown)}")
+    feed_ids = [user_feed(user_id, role) for role in roles]
+
+    async def read_all():
+        # One failing sensor does not fail the others, it gets an error entry instead
+        results = await asyncio.gather(
+            *(read_snapshot(feed_id, since, until, limit) for feed_id in feed_ids), return_exceptions=True)
         return {
-            "value": latest_value.value,
-            "timestamp": latest_value.created_at
+            role: {"error": str(result)} if isinstance(result, Exception) else result
+            for role, result in zip(roles, results)
         }
+
+    try:
+        return await get_response_cache().respond(
+            request, [feed_tag(feed_id) for feed_id in feed_ids], read_all, vary=(user_id, *feed_ids),
+            # A sensor that failed is read again by the next request, not until its feed changes
+            cacheable=lambda content: not any("error" in entry for entry in content.values()))
     except Exception as e:
         return {"error": str(e)}
 
-# Route to get historical humid data - limit 1000 records  
-@router.get("/humid/history1000")
-async def get_humid_history():
+# Route to get a downsampled sensor series, bucketed aggregates or LTTB points
+@router.get("/{feed}/series")
+async def get_sensor_series(
+    feed: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    resolution: int = Query(200, ge=3, le=5000),
+    mode: Literal["aggregate", "lttb"] = "aggregate",
+    user_id: Optional[int] = Depends(get_optional_user_id),
+):
+    if feed not in SENSOR_ROLES:
+        raise HTTPException(status_code=404, detail=f"Unknown sensor feed '{feed}'")
     try:
-        aio = get_aio()
-        history = aio.data(AIO_FEED_IDS[2], max_results=1000)  # Get last 5 entries
-        return [
-            {"value": entry.value, "timestamp": entry.created_at} for entry in history
-        ]
+        feed_id = user_feed(user_id, feed)
+        store = await ensure_seeded(feed_id)
+
+        since_ms = None if since is None else to_epoch_ms(since)
+        until_ms = None if until is None else to_epoch_ms(until)
+        series = store.series(feed_id)
+        older = archive_range(series, since_ms, until_ms)
+        timestamps, values = series.query(since_ms, until_ms)
+        if older is not None:
+            # Spans of months: hourly / daily means for the compacted part, raw samples after
+            timestamps, values = join_older(
+                await run_blocking(get_history_archive().points, feed_id, *older), (timestamps, values))
+
+        if mode == "lttb":
+            timestamps, values = lttb(timestamps, values, resolution)
+            return {
+                "feed": feed,
+                "mode": mode,
+                "timestamp": format_timestamps(timestamps),
+                "value": values.tolist(),
+            }
+
+        if len(timestamps) == 0:
+            return {"feed": feed, "mode": mode, "bucket_ms": None, "timestamp": [],
+                    "min": [], "max": [], "mean": [], "last": [], "count": []}
+        start = since_ms if since_ms is not None else int(timestamps[0])
+        end = until_ms + 1 if until_ms is not None else int(timestamps[-1]) + 1
+        width, buckets = bucket_aggregate(timestamps, values, start, end, resolution)
+        return {
+            "feed": feed,
+            "mode": mode,
+            "bucket_ms": int(width),
+            "timestamp": format_timestamps(buckets["timestamp"]),
+            "min": buckets["min"].tolist(),
+            "max": buckets["max"].tolist(),
+            "mean": buckets["mean"].tolist(),
+            "last": buckets["last"].tolist(),
+            "count": buckets["count"].tolist(),
+        }
     except Exception as e:
         return {"error": str(e)}
-    
@@ -0,0 +1,256 @@
+"""
+Threshold automation rules evaluated on the incoming MQTT values.
+
+Rules come from AutomationRule.Rule_Description, a JSON object such as
+
+    {"content": "Turn on the fan when temp > 30",
+     "feed": "temp", "op": ">", "threshold": 30, "hysteresis": 1, "hold": 10,
+     "action": {"feed": "fan", "value": 100}, "release": {"feed": "fan", "value": 0}}
+
+Without the structured fields, a sentence like "Turn on the fan if temperature is above 30"
+in "content" is understood too. Compiled rules are indexed by the feed they watch, so a value
+is only checked against the rules of its own feed.
+"""
+import json
+import operator
+import re
+import threading
+import time
+from collections import defaultdict
+
+from queueLogging import get_logger
+
+log = get_logger("Rules")
+
+# Rule operator -> (test that activates the rule, side of the threshold the hysteresis band is on)
+OPERATORS = {
+    ">": (operator.gt, -1),
+    ">=": (operator.ge, -1),
+    "<": (operator.lt, 1),
+    "<=": (operator.le, 1),
+}
+# Words used in rule sentences -> feed
+FEED_WORDS = {
+    "temperature": "temp", "temp": "temp",
+    "humidity": "humid", "humid": "humid",
+    "light level": "light", "brightness": "light", "light": "light",
+}
+COMPARISON_WORDS = {
+    "drops below": "<", "falls below": "<", "below": "<", "under": "<", "less than": "<", "<=": "<=", "<": "<",
+    "rises above": ">", "exceeds": ">", "above": ">", "over": ">", "greater than": ">", ">=": ">=", ">": ">",
+}
+# "turn on the fan" -> (feed, value)
+DEVICE_ACTIONS = {
+    ("on", "fan"): ("fan", 100), ("off", "fan"): ("fan", 0),
+    ("on", "light"): ("switch", 1), ("off", "light"): ("switch", 0),
+}
+
+_CONDITION = re.compile(
+    r"(?P<feed>" + "|".join(sorted(FEED_WORDS, key=len, reverse=True)) + r")\s+(?:is\s+|goes\s+)?"
+    r"(?P<op>" + "|".join(re.escape(word) for word in sorted(COMPARISON_WORDS, key=len, reverse=True)) + r")\s*"
+    r"(?P<threshold>-?\d+(?:\.\d+)?)",
+    re.IGNORECASE,
+)
+_ACTION = re.compile(r"turn\s+(?P<state>on|off)\s+(?:the\s+)?(?P<device>fan|light)", re.IGNORECASE)
+
+
+class Rule:
+    """One compiled threshold rule with its activation state."""
+
+    __slots__ = ("rule_id", "device_id", "content", "feed", "op", "threshold", "clear_at", "hold",
+                 "action", "release", "_test", "active", "pending_since")
+
+    def __init__(self, rule_id, device_id, content, feed, op, threshold, hysteresis=0.0, hold=0.0,
+                 action=None, release=None):
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator '{op}'")
+        test, direction = OPERATORS[op]
+        self.rule_id = rule_id
+        self.device_id = device_id
+        self.content = content
+        self.feed = feed
+        self.op = op
+        self.threshold = float(threshold)
+        # Once active, the rule only clears when the value is back past the hysteresis band
+        self.clear_at = self.threshold + direction * abs(float(hysteresis))
+        self.hold = float(hold)
+        self.action = action
+        self.release = release
+        self._test = test
+        self.active = False
+        self.pending_since = None
+
+    def step(self, value: float, now: float):
+        """Feed one value. Returns the command to send ((feed, value)) or None."""
+        if not self.active:
+            if not self._test(value, self.threshold):
+                self.pending_since = None
+                return None
+            # Debounce: the condition has to hold for `hold` seconds before the rule fires
+            if self.pending_since is None:
+                self.pending_since = now
+            if now - self.pending_since < self.hold:
+                return None
+            self.active = True
+            self.pending_since = None
+            return self.action
+
+        if self._test(value, self.clear_at):
+            return None
+        self.active = False
+        return self.release
+
+    def describe(self) -> dict:
+        return {
+            "rule_id": self.rule_id,
+            "device_id": self.device_id,
+            "content": self.content,
+            "feed": self.feed,
+            "op": self.op,
+            "threshold": self.threshold,
+            "clear_at": self.clear_at,
+            "hold": self.hold,
+            "action": self.action,
+            "release": self.release,
+            "active": self.active,
+        }
+
+
+def _command(spec):
+    if spec is None:
+        return None
+    return spec["feed"], spec["value"]
+
+
+def parse_sentence(content: str) -> dict:
+    """Structured fields from a rule sentence, {} if it cannot be understood."""
+    condition = _CONDITION.search(content or "")
+    action = _ACTION.search(content or "")
+    if condition is None or action is None:
+        return {}
+    state, device = action.group("state").lower(), action.group("device").lower()
+    feed, value = DEVICE_ACTIONS[(state, device)]
+    opposite = DEVICE_ACTIONS[("off" if state == "on" else "on", device)]
+    return {
+        "feed": FEED_WORDS[condition.group("feed").lower()],
+        "op": COMPARISON_WORDS[condition.group("op").lower()],
+        "threshold": float(condition.group("threshold")),
+        "action": {"feed": feed, "value": value},
+        "release": {"feed": opposite[0], "value": opposite[1]},
+    }
+
+
+def compile_rule(row: dict, feeds) -> Rule:
+    """Rule from an AutomationRule row. Raises ValueError if it is not an executable threshold rule."""
+    description = row.get("rule_description") or "{}"
+    try:
+        spec = json.loads(description) if isinstance(description, str) else dict(description)
+    except json.JSONDecodeError:
+        spec = {"content": description}
+    if "feed" not in spec:
+        spec = {**parse_sentence(spec.get("content", "")), **spec}
+    if "feed" not in spec or "threshold" not in spec:
+        raise ValueError("No threshold condition")
+    for feed in (spec["feed"], spec["action"]["feed"], (spec.get("release") or spec["action"])["feed"]):
+        if feed not in feeds:
+            raise ValueError(f"Unknown feed '{feed}'")
+    return Rule(
+        rule_id=row["rule_id"],
+        device_id=row.get("device_id"),
+        content=spec.get("content", ""),
+        feed=spec["feed"],
+        op=spec.get("op", ">"),
+        threshold=spec["threshold"],
+        hysteresis=spec.get("hysteresis", 0),
+        hold=spec.get("hold", 0),
+        action=_command(spec["action"]),
+        release=_command(spec.get("release")),
+    )
+
+
+class RuleEngine:
+    """
+    Rules indexed by watched feed. evaluate() is called from the MQTT thread for every value;
+    matching commands go to `submit(feed, value)` and are recorded with `record(rule, feed, activity)`.
+    `route(rule, feed)` (optional) picks the feed a command is actually published to, e.g. the
+    feed of the rule's own device.
+    """
+
+    def __init__(self, submit, record, feeds, route=None):
+        self._submit = submit
+        self._record = record
+        self._route = route
+        self._feeds = frozenset(feeds)
+        self._rows = []
+        self._index = {}
+        self._lock = threading.Lock()
+        self._stats = {"loaded": 0, "skipped": 0, "evaluated": 0, "fired": 0}
+
+    def load(self, rows):
+        """Replace the rule set with the rules compiled from AutomationRule rows."""
+        rows = list(rows)
+        index = defaultdict(list)
+        skipped = 0
+        with self._lock:
+            self._rows = rows
+            feeds = self._feeds
+            previous = {rule.rule_id: rule for rules in self._index.values() for rule in rules}
+        for row in rows:
+            try:
+                rule = compile_rule(row, feeds)
+            except (ValueError, KeyError, TypeError) as e:
+                skipped += 1
+                log.info("Skipping rule %s: %s", row.get("rule_id"), e)
+                continue
+            old = previous.get(rule.rule_id)
+            if old is not None and (old.feed, old.op, old.threshold) == (rule.feed, rule.op, rule.threshold):
+                rule.active = old.active  # Unchanged condition: keep its state across reloads
+            index[rule.feed].append(rule)
+        with self._lock:
+            self._index = dict(index)
+            self._stats["loaded"] = sum(len(rules) for rules in index.values())
+            self._stats["skipped"] = skipped
+        log.info("Loaded %d rules (%d skipped)", self._stats["loaded"], skipped)
+
+    def add_feeds(self, feeds):
+        """Accept rules on these feeds too (feeds of newly registered devices): skipped rules are compiled again."""
+        with self._lock:
+            new = set(feeds) - self._feeds
+            if not new:
+                return
+            self._feeds = self._feeds | new
+            rows = self._rows if self._stats["skipped"] else None
+        if rows:
+            self.load(rows)
+
+    def evaluate(self, feed_id, payload):
+        rules = self._index.get(feed_id)
+        if not rules:
+            return
+        try:
+            value = float(payload)
+        except (TypeError, ValueError):
+            return
+        now = time.monotonic()
+        fired = []
+        with self._lock:
+            self._stats["evaluated"] += 1
+            for rule in rules:
+                command = rule.step(value, now)
+                if command is not None:
+                    fired.append((rule, command))
+            self._stats["fired"] += len(fired)
+        # Outside the lock: submitting and logging only queue work, but never hold the rules while doing it
+        for rule, (feed, target) in fired:
+            if self._route is not None:
+                feed = self._route(rule, feed)
+            self._submit(feed, target)
+            self._record(rule, feed, f"Rule {rule.rule_id} set {feed} to {target} ({feed_id} = {payload})")
+
+    def rules(self) -> list:
+        with self._lock:
+            return [rule.describe() for rules in self._index.values() for rule in rules]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "feeds": len(self._index)}
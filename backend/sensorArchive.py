@@ -0,0 +1,260 @@
+"""
+On-disk archive of every numeric MQTT sample, in SQLite.
+
+Samples are buffered in memory and written by a background thread in batches (one transaction
+per batch, WAL mode so readers never wait for it). The same thread compacts old data: raw samples
+older than SENSOR_ARCHIVE_RAW_DAYS are rolled up into hourly aggregates, hourly aggregates older
+than SENSOR_ARCHIVE_HOURLY_DAYS into daily ones. Daily aggregates are kept forever, so a feed
+costs a few hundred bytes per day once compacted.
+
+    samples(feed, ts, value)                                       raw, ts in epoch ms
+    rollups(feed, resolution, ts, min, max, sum, count, last, last_ts)   resolution in ms
+
+Raw and rolled up spans never overlap, so a range query is the union of the three.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from queueLogging import get_logger
+
+log = get_logger("Archive")
+
+# SQLite file holding the sensor history, empty to keep no history on disk
+SENSOR_ARCHIVE_PATH = os.getenv("SENSOR_ARCHIVE_PATH", "sensorarchive.sqlite3")
+# Samples per write transaction, and max seconds a sample waits before being written
+SENSOR_ARCHIVE_BATCH_SIZE = int(os.getenv("SENSOR_ARCHIVE_BATCH_SIZE", "500"))
+SENSOR_ARCHIVE_FLUSH_INTERVAL = float(os.getenv("SENSOR_ARCHIVE_FLUSH_INTERVAL", "1"))
+# Samples held in memory while the disk is slower than MQTT, the oldest are dropped past this
+SENSOR_ARCHIVE_MAX_BUFFER = int(os.getenv("SENSOR_ARCHIVE_MAX_BUFFER", "100000"))
+# Days raw samples are kept before being rolled up into hours, and hours before days
+SENSOR_ARCHIVE_RAW_DAYS = float(os.getenv("SENSOR_ARCHIVE_RAW_DAYS", "7"))
+SENSOR_ARCHIVE_HOURLY_DAYS = float(os.getenv("SENSOR_ARCHIVE_HOURLY_DAYS", "90"))
+# Seconds between two compaction passes
+SENSOR_ARCHIVE_ROLLUP_INTERVAL = float(os.getenv("SENSOR_ARCHIVE_ROLLUP_INTERVAL", "600"))
+
+HOUR_MS = 3_600_000
+DAY_MS = 86_400_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    feed TEXT NOT NULL, ts INTEGER NOT NULL, value REAL NOT NULL,
+    PRIMARY KEY (feed, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollups (
+    feed TEXT NOT NULL, resolution INTEGER NOT NULL, ts INTEGER NOT NULL,
+    min REAL NOT NULL, max REAL NOT NULL, sum REAL NOT NULL, count INTEGER NOT NULL,
+    last REAL NOT NULL, last_ts INTEGER NOT NULL,
+    PRIMARY KEY (feed, resolution, ts)
+) WITHOUT ROWID;
+"""
+
+# Aggregates `source` rows older than the cutoff into `resolution` buckets. Buckets rolled up
+# by an earlier pass (late samples) are merged instead of overwritten.
+_MERGE = """
+    ON CONFLICT (feed, resolution, ts) DO UPDATE SET
+        min = MIN(min, excluded.min), max = MAX(max, excluded.max),
+        sum = sum + excluded.sum, count = count + excluded.count,
+        last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last ELSE last END,
+        last_ts = MAX(last_ts, excluded.last_ts)
+"""
+ROLLUP_SAMPLES = """
+    INSERT INTO rollups (feed, resolution, ts, min, max, sum, count, last, last_ts)
+    SELECT g.feed, :resolution, g.bucket, g.min, g.max, g.sum, g.count,
+           (SELECT value FROM samples s WHERE s.feed = g.feed AND s.ts = g.last_ts), g.last_ts
+    FROM (SELECT feed, (ts / :resolution) * :resolution AS bucket, MIN(value) AS min, MAX(value) AS max,
+                 SUM(value) AS sum, COUNT(*) AS count, MAX(ts) AS last_ts
+          FROM samples WHERE ts < :cutoff GROUP BY feed, bucket) g
+    WHERE true
+""" + _MERGE
+ROLLUP_HOURS = """
+    INSERT INTO rollups (feed, resolution, ts, min, max, sum, count, last, last_ts)
+    SELECT g.feed, :resolution, g.bucket, g.min, g.max, g.sum, g.count,
+           (SELECT last FROM rollups r WHERE r.feed = g.feed AND r.resolution = :source AND r.last_ts = g.last_ts),
+           g.last_ts
+    FROM (SELECT feed, (ts / :resolution) * :resolution AS bucket, MIN(min) AS min, MAX(max) AS max,
+                 SUM(sum) AS sum, SUM(count) AS count, MAX(last_ts) AS last_ts
+          FROM rollups WHERE resolution = :source AND ts < :cutoff GROUP BY feed, bucket) g
+    WHERE true
+""" + _MERGE
+
+
+class SensorArchive:
+    """
+    add() only appends to a buffer, the writer thread does the disk work.
+    Reads open their own connection per thread and can run while a batch is being written.
+    """
+
+    def __init__(self, path: str = SENSOR_ARCHIVE_PATH, batch_size: int = SENSOR_ARCHIVE_BATCH_SIZE,
+                 flush_interval: float = SENSOR_ARCHIVE_FLUSH_INTERVAL, max_buffer: int = SENSOR_ARCHIVE_MAX_BUFFER,
+                 raw_days: float = SENSOR_ARCHIVE_RAW_DAYS, hourly_days: float = SENSOR_ARCHIVE_HOURLY_DAYS,
+                 rollup_interval: float = SENSOR_ARCHIVE_ROLLUP_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.raw_ms = int(raw_days * DAY_MS)
+        self.hourly_ms = int(hourly_days * DAY_MS)
+        self.rollup_interval = rollup_interval
+        self._buffer = deque(maxlen=max_buffer)
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._thread = None
+        self._running = False
+        self._reading = False
+        self._stats = {"added": 0, "written": 0, "dropped": 0, "rolled_up": 0, "failed": 0}
+
+    @property
+    def active(self) -> bool:
+        """Started with a path: range queries can be answered (and samples are written, unless read-only)."""
+        return self._running or self._reading
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    #### Lifecycle
+    def start(self, write: bool = True):
+        """`write=False` only opens the archive for reading: another process writes and compacts it."""
+        if not self.path:
+            return
+        if not write:
+            self._connection().executescript(SCHEMA)
+            self._reading = True
+            return
+        with self._cond:
+            if self._running:
+                return
+            self._connection().executescript(SCHEMA)
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="sensor-archive", daemon=True)
+            self._thread.start()
+        log.info("Archiving sensor samples to %s", self.path)
+
+    def stop(self):
+        """Write what is buffered and stop the writer thread."""
+        self._reading = False
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    #### Writes
+    def add(self, feed_id, payload, timestamp_ms: int = None):
+        if not self._running:
+            return
+        try:
+            value = float(payload)
+        except (TypeError, ValueError):
+            return  # Non numeric feeds (color, text) are not archived
+        if timestamp_ms is None:
+            timestamp_ms = int(time.time() * 1000)
+        with self._cond:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._stats["dropped"] += 1
+            self._buffer.append((feed_id, timestamp_ms, value))
+            self._stats["added"] += 1
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def _take_batch(self):
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while self._running and len(self._buffer) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._buffer), self.batch_size)
+            return [self._buffer.popleft() for _ in range(count)]
+
+    def _write(self, rows):
+        connection = self._connection()
+        try:
+            with connection:
+                # Same feed and millisecond twice (a replayed message): the newer value wins
+                connection.executemany("INSERT OR REPLACE INTO samples (feed, ts, value) VALUES (?, ?, ?)", rows)
+            self._count("written", len(rows))
+        except sqlite3.Error as e:
+            self._count("failed", len(rows))
+            log.error("Writing %d samples failed: %s", len(rows), e)
+
+    def rollup(self, now_ms: int = None):
+        """Compact raw samples into hours and hours into days, past their retention."""
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        raw_cutoff = (now_ms - self.raw_ms) // HOUR_MS * HOUR_MS
+        hourly_cutoff = (now_ms - self.hourly_ms) // DAY_MS * DAY_MS
+        connection = self._connection()
+        with connection:
+            connection.execute(ROLLUP_SAMPLES, {"resolution": HOUR_MS, "cutoff": raw_cutoff})
+            rolled = connection.execute("DELETE FROM samples WHERE ts < ?", (raw_cutoff,)).rowcount
+            connection.execute(ROLLUP_HOURS, {"resolution": DAY_MS, "source": HOUR_MS, "cutoff": hourly_cutoff})
+            connection.execute("DELETE FROM rollups WHERE resolution = ? AND ts < ?", (HOUR_MS, hourly_cutoff))
+        if rolled:
+            self._count("rolled_up", rolled)
+            log.info("Rolled %d samples up into hourly aggregates", rolled)
+
+    def _count(self, key, n):
+        with self._cond:
+            self._stats[key] += n
+
+    def _run(self):
+        next_rollup = time.monotonic()
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+            if time.monotonic() >= next_rollup:
+                next_rollup = time.monotonic() + self.rollup_interval
+                try:
+                    self.rollup()
+                except sqlite3.Error as e:
+                    log.error("Rollup failed: %s", e)
+            with self._cond:
+                if not self._running and not self._buffer:
+                    return
+
+    #### Reads
+    def samples(self, feed_id, since: int = None, until: int = None, limit: int = None):
+        """Raw (timestamps, values) arrays, oldest first, the most recent `limit` of since <= t <= until."""
+        rows = self._connection().execute(
+            "SELECT ts, value FROM samples WHERE feed = ? AND ts BETWEEN ? AND ? ORDER BY ts DESC LIMIT ?",
+            (feed_id, -1 << 62 if since is None else since, 1 << 62 if until is None else until,
+             -1 if limit is None else limit),
+        ).fetchall()
+        return _columns(rows[::-1])
+
+    def points(self, feed_id, since: int = None, until: int = None, limit: int = None):
+        """
+        (timestamps, values) over any span: daily and hourly means where the raw samples were
+        compacted already, raw samples after that. Oldest first, the most recent `limit` of them.
+        """
+        since = -1 << 62 if since is None else since
+        until = 1 << 62 if until is None else until
+        rows = self._connection().execute(
+            "SELECT ts, sum / count FROM rollups WHERE feed = ? AND ts BETWEEN ? AND ? "
+            "UNION ALL SELECT ts, value FROM samples WHERE feed = ? AND ts BETWEEN ? AND ? ORDER BY 1 DESC LIMIT ?",
+            (feed_id, since, until, feed_id, since, until, -1 if limit is None else limit),
+        ).fetchall()
+        return _columns(rows[::-1])
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "buffered": len(self._buffer)}
+
+
+def _columns(rows):
+    if not rows:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    timestamps, values = zip(*rows)
+    return np.array(timestamps, dtype=np.int64), np.array(values, dtype=np.float64)
@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# How long (in seconds) a cached value is trusted before the routers go back to the REST API
+SENSOR_CACHE_MAX_AGE = float(os.getenv("SENSOR_CACHE_MAX_AGE", "300"))
+
+
+def utc_timestamp(epoch: float = None):
+    # Same format Adafruit IO uses for "created_at", of now or of a Unix time
+    moment = datetime.now(timezone.utc) if epoch is None else datetime.fromtimestamp(epoch, timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class LatestValueCache:
+    """
+    Thread-safe store of the latest value seen on every feed.
+    Written by the MQTT callback thread, read by the API routes.
+    """
+
+    def __init__(self, feeds, max_age: float = SENSOR_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # feed -> (value, timestamp, monotonic time the value was stored)
+        self._entries = {feed: None for feed in feeds}
+
+    def update(self, feed_id, value, timestamp=None, age: float = 0.0):
+        # `age`: seconds since the value was received, when it is stored later (multi-worker mode)
+        entry = (value, timestamp or utc_timestamp(), time.monotonic() - age)
+        with self._lock:
+            self._entries[feed_id] = entry
+        return {"value": entry[0], "timestamp": entry[1]}
+
+    def refresh(self, feed_id, value, timestamp, requested_at: float):
+        """
+        Store a value fetched over REST, unless MQTT delivered a newer one
+        while the request was in flight. Returns the value that ends up cached.
+        """
+        with self._lock:
+            current = self._entries.get(feed_id)
+            if current is None or current[2] < requested_at:
+                current = (value, timestamp, time.monotonic())
+                self._entries[feed_id] = current
+        return {"value": current[0], "timestamp": current[1]}
+
+    def get(self, feed_id, max_age: float = None):
+        """Return the cached value, or None if the feed is cold or stale."""
+        if max_age is None:
+            max_age = self.max_age
+        with self._lock:
+            entry = self._entries.get(feed_id)
+        if entry is None or time.monotonic() - entry[2] > max_age:
+            return None
+        return {"value": entry[0], "timestamp": entry[1]}
+
+    def snapshot(self):
+        with self._lock:
+            entries = dict(self._entries)
+        return {
+            feed: {"value": entry[0], "timestamp": entry[1]}
+            for feed, entry in entries.items() if entry is not None
+        }
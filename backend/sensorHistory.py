@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Number of samples kept in memory for each feed
+SENSOR_HISTORY_CAPACITY = int(os.getenv("SENSOR_HISTORY_CAPACITY", "10000"))
+# Number of samples pulled from the REST API when a feed is seeded
+SENSOR_HISTORY_SEED_SIZE = int(os.getenv("SENSOR_HISTORY_SEED_SIZE", "1000"))
+
+
+def to_epoch_ms(value):
+    """Convert a datetime (naive = UTC) or an Adafruit "created_at" string to epoch milliseconds."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def format_timestamps(timestamps):
+    # Vectorized epoch ms -> "YYYY-MM-DDTHH:MM:SSZ", the format Adafruit IO returns
+    return [ts + "Z" for ts in timestamps.astype("datetime64[ms]").astype("datetime64[s]").astype(str)]
+
+
+def format_entries(timestamps, values):
+    """Samples as a list of {"value", "timestamp"}, in the order given."""
+    return [
+        {"value": f"{value:.10g}", "timestamp": ts}
+        for value, ts in zip(values.tolist(), format_timestamps(timestamps))
+    ]
+
+
+class FeedSeries:
+    """
+    Fixed-size ring buffer of (timestamp, value) samples for one feed.
+    Timestamps are int64 epoch milliseconds and values float64, stored in two numpy arrays
+    so a feed with 10k samples costs ~160KB and no per-sample Python objects.
+    """
+
+    def __init__(self, capacity: int = SENSOR_HISTORY_CAPACITY):
+        self.capacity = capacity
+        self._timestamps = np.zeros(capacity, dtype=np.int64)
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self._start = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self.seeded = False
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp_ms: int, value: float):
+        with self._lock:
+            end = (self._start + self._size) % self.capacity
+            self._timestamps[end] = timestamp_ms
+            self._values[end] = value
+            if self._size < self.capacity:
+                self._size += 1
+            else:
+                self._start = (self._start + 1) % self.capacity
+
+    def oldest(self):
+        """Timestamp (epoch ms) of the oldest sample held, None while empty."""
+        with self._lock:
+            return int(self._timestamps[self._start]) if self._size else None
+
+    def _ordered(self):
+        # Copy of the buffer contents, oldest first. Caller must hold the lock.
+        idx = (self._start + np.arange(self._size)) % self.capacity
+        return self._timestamps[idx], self._values[idx]
+
+    def seed(self, timestamps, values):
+        """
+        Merge older samples (e.g. fetched over REST at startup) in front of what is already stored.
+        Samples newer than the oldest stored one are ignored, MQTT already delivered those.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order], values[order]
+
+        with self._lock:
+            current_ts, current_values = self._ordered()
+            if self._size:
+                keep = timestamps < current_ts[0]
+                timestamps, values = timestamps[keep], values[keep]
+            merged_ts = np.concatenate([timestamps, current_ts])[-self.capacity:]
+            merged_values = np.concatenate([values, current_values])[-self.capacity:]
+
+            self._size = len(merged_ts)
+            self._start = 0
+            self._timestamps[:self._size] = merged_ts
+            self._values[:self._size] = merged_values
+            self.seeded = True
+
+    def query(self, since: int = None, until: int = None, limit: int = None):
+        """
+        Return (timestamps, values) arrays, oldest first, restricted to since <= t <= until (epoch ms).
+        With a limit, only the most recent `limit` samples of that range are returned.
+        """
+        with self._lock:
+            timestamps, values = self._ordered()
+
+        lo = 0 if since is None else np.searchsorted(timestamps, since, side="left")
+        hi = len(timestamps) if until is None else np.searchsorted(timestamps, until, side="right")
+        if limit is not None:
+            lo = max(lo, hi - limit)
+        return timestamps[lo:hi], values[lo:hi]
+
+
+class SeriesStore:
+    """Per-feed FeedSeries, shared between the MQTT thread and the API routes."""
+
+    def __init__(self, feeds, capacity: int = SENSOR_HISTORY_CAPACITY):
+        self.capacity = capacity
+        self._series = {feed: FeedSeries(capacity) for feed in feeds}
+        self._seed_lock = threading.Lock()
+
+    def track(self, feeds):
+        """Keep a series for these feeds too (feeds of devices registered after start-up)."""
+        with self._seed_lock:
+            for feed in feeds:
+                if feed not in self._series:
+                    self._series[feed] = FeedSeries(self.capacity)
+
+    def series(self, feed_id) -> FeedSeries:
+        # Only tracked feeds get a ring buffer, not every feed id a request or a message names
+        series = self._series.get(feed_id)
+        if series is None:
+            raise LookupError(f"No history is kept for feed {feed_id}")
+        return series
+
+    def add(self, feed_id, payload, timestamp_ms: int = None):
+        series = self._series.get(feed_id)
+        if series is None:
+            return
+        try:
+            value = float(payload)
+        except (TypeError, ValueError):
+            return  # Non numeric feeds (color, text) have no time series
+        if timestamp_ms is None:
+            timestamp_ms = int(time.time() * 1000)
+        series.append(timestamp_ms, value)
+
+    def is_seeded(self, feed_id) -> bool:
+        return self.series(feed_id).seeded
+
+    def seed_entries(self, feed_id, entries):
+        """Seed a feed from Adafruit `Data` entries (value, created_at), unless it was seeded already."""
+        timestamps, values = [], []
+        for entry in entries:
+            try:
+                values.append(float(entry.value))
+            except (TypeError, ValueError):
+                continue
+            timestamps.append(to_epoch_ms(entry.created_at))
+        series = self.series(feed_id)
+        with self._seed_lock:
+            if not series.seeded:
+                series.seed(timestamps, values)
+
+    def ensure_seeded(self, feed_id, aio, max_results: int = SENSOR_HISTORY_SEED_SIZE):
+        """Seed a feed with the blocking REST client, used by the startup thread."""
+        if self.is_seeded(feed_id):
+            return
+        self.seed_entries(feed_id, aio.data(feed_id, max_results=max_results))
+
+    def query(self, feed_id, since=None, until=None, limit=None):
+        """History of a feed as a list of {"value", "timestamp"}, newest first like the Adafruit REST API."""
+        since_ms = None if since is None else to_epoch_ms(since)
+        until_ms = None if until is None else to_epoch_ms(until)
+        timestamps, values = self.series(feed_id).query(since_ms, until_ms, limit)
+        return format_entries(timestamps[::-1], values[::-1])
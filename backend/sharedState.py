@@ -0,0 +1,439 @@
+"""
+State shared by the processes of a multi-worker deployment, in one SQLite file.
+
+With INGEST_MODE=worker, the API runs as several uvicorn workers next to a single ingest
+process (python ingestProcess.py):
+
+- The ingest process owns the only MQTT connections. It appends every value it receives to
+  an event log and publishes the device commands the workers queue, through one coalescing
+  queue and one Adafruit IO publish budget for all of them.
+- Every worker follows the event log into its own latest-value cache, history, response cache
+  and WebSocket clients, so the read routes work unchanged. Rate limit buckets live in the
+  same file, so a client gets the same limit whatever worker answers it.
+
+The file belongs on a memory-backed filesystem (/dev/shm): WAL mode, no fsync, nothing in it
+has to survive a reboot (the sensor history is in the archive).
+
+    events(seq, kind, feed, payload, ts)   "value": feed, payload, ts in epoch ms
+                                           "tag": response cache tag (feed) to invalidate
+    commands(seq, kind, feed, value)       "publish": device command, "publish_many": JSON [[feed, value], ...]
+                                           published as one unit, "reload": feed is "rules" or "devices"
+    buckets(key, tokens, updated, allowed) rate limit token buckets, updated in epoch seconds
+    idempotency(key, fingerprint, response, expires)
+                                           Idempotency-Key of a command request and its response (JSON),
+                                           NULL while the first request is still running
+    heartbeat(name, ts, detail)            health of the ingest process, JSON, refreshed every second
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+
+from queueLogging import get_logger
+
+log = get_logger("Shared State")
+
+# "embedded": one process does everything (MQTT, API, state in memory). "worker": API worker of a
+# multi-worker deployment, following the ingest process through SHARED_STATE_PATH. "ingest" is set
+# by ingestProcess.py itself
+INGEST_MODE = os.getenv("INGEST_MODE", "embedded")
+# SQLite file shared by the ingest process and the API workers
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "smarthome-state.sqlite3"))
+# Max seconds before a value reaches the event log, and between two reads of it by a worker
+SHARED_STATE_POLL_INTERVAL = float(os.getenv("SHARED_STATE_POLL_INTERVAL", "0.02"))
+# Events kept in the log: what a worker starting after the ingest process replays
+SHARED_EVENT_RETENTION = int(os.getenv("SHARED_EVENT_RETENTION", "20000"))
+# Seconds without a heartbeat after which the ingest process is reported down
+SHARED_HEARTBEAT_TIMEOUT = float(os.getenv("SHARED_HEARTBEAT_TIMEOUT", "5"))
+# Max seconds a rate limit check waits for a write lock on the file, the request is let through after that
+SHARED_RATE_LIMIT_TIMEOUT = float(os.getenv("SHARED_RATE_LIMIT_TIMEOUT", "0.05"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, feed TEXT NOT NULL, payload TEXT, ts INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commands (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, feed TEXT NOT NULL, value TEXT
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, allowed INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, response TEXT, expires REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS heartbeat (
+    name TEXT PRIMARY KEY, ts REAL NOT NULL, detail TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Refill the bucket for the time since its last use and take a token if there is one, in one
+# statement so workers never race between reading and writing a bucket
+TAKE_TOKEN = """
+    INSERT INTO buckets (key, tokens, updated, allowed) VALUES (:key, :burst - 1, :now, 1)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = MIN(:burst, tokens + MAX(:now - updated, 0) * :rate)
+                 - (MIN(:burst, tokens + MAX(:now - updated, 0) * :rate) >= 1),
+        allowed = MIN(:burst, tokens + MAX(:now - updated, 0) * :rate) >= 1,
+        updated = :now
+    RETURNING tokens, allowed
+"""
+
+
+class SharedStore:
+    """
+    Access to the shared file, one connection per thread and busy timeout. Nothing is opened before
+    the first call.
+    """
+
+    def __init__(self, path: str = SHARED_STATE_PATH, retention: int = SHARED_EVENT_RETENTION):
+        self.path = path
+        self.retention = retention
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connection(self, timeout: float = 5.0) -> sqlite3.Connection:
+        # `timeout`: seconds to wait for another process holding the write lock before giving up
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(timeout)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    connection.executescript(SCHEMA)
+                    self._schema_ready = True
+            connections[timeout] = connection
+        return connection
+
+    #### Event log
+    def append_events(self, rows):
+        """rows of (kind, feed, payload, ts), oldest first. Trims the log to `retention` events."""
+        connection = self._connection()
+        with connection:
+            connection.executemany("INSERT INTO events (kind, feed, payload, ts) VALUES (?, ?, ?, ?)", rows)
+            connection.execute("DELETE FROM events WHERE seq <= (SELECT MAX(seq) FROM events) - ?", (self.retention,))
+
+    def publish_tag(self, tag):
+        """Have every worker invalidate a response cache tag."""
+        self.append_events([("tag", tag, None, int(time.time() * 1000))])
+
+    def events_after(self, seq: int, limit: int = 1000) -> list:
+        return self._connection().execute(
+            "SELECT seq, kind, feed, payload, ts FROM events WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit),
+        ).fetchall()
+
+    #### Commands, from the workers to the ingest process
+    def queue(self, kind, feed, value=None):
+        connection = self._connection()
+        with connection:
+            connection.execute("INSERT INTO commands (kind, feed, value) VALUES (?, ?, ?)",
+                               (kind, feed, None if value is None else str(value)))
+
+    def take_commands(self, limit: int = 100) -> list:
+        """Remove and return up to `limit` queued (kind, feed, value), oldest first."""
+        connection = self._connection()
+        with connection:
+            rows = connection.execute(
+                "DELETE FROM commands WHERE seq IN (SELECT seq FROM commands ORDER BY seq LIMIT ?) "
+                "RETURNING seq, kind, feed, value", (limit,),
+            ).fetchall()
+        return [row[1:] for row in sorted(rows)]
+
+    def pending_commands(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM commands").fetchone()[0]
+
+    #### Rate limit buckets
+    def take_token(self, key, rate: float, burst: float, now: float = None):
+        """
+        Take one token from a shared bucket. Returns (allowed, seconds until a token is available).
+        Raises sqlite3.OperationalError if the file stays locked for SHARED_RATE_LIMIT_TIMEOUT.
+        """
+        now = time.time() if now is None else now
+        connection = self._connection(SHARED_RATE_LIMIT_TIMEOUT)
+        with connection:
+            tokens, allowed = connection.execute(
+                TAKE_TOKEN, {"key": key, "rate": rate, "burst": float(burst), "now": now}).fetchone()
+        return (True, 0.0) if allowed else (False, (1 - tokens) / rate)
+
+    def bucket_count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+    def prune_buckets(self, idle: float = 3600.0):
+        # A bucket unused for that long is full again, dropping it changes nothing
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM buckets WHERE updated < ?", (time.time() - idle,))
+
+    #### Idempotency keys
+    def claim_key(self, key, fingerprint, pending_ttl: float):
+        """
+        Claim a key for a request, or (fingerprint, response) of the request that holds it.
+        Returns None once claimed. A claim never completed expires after `pending_ttl` seconds.
+        """
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM idempotency WHERE key = ? AND expires < ?", (key, now))
+            claimed = connection.execute(
+                "INSERT INTO idempotency (key, fingerprint, response, expires) VALUES (?, ?, NULL, ?) "
+                "ON CONFLICT (key) DO NOTHING RETURNING key", (key, fingerprint, now + pending_ttl),
+            ).fetchone()
+            if claimed is not None:
+                return None
+            return connection.execute(
+                "SELECT fingerprint, response FROM idempotency WHERE key = ?", (key,)).fetchone()
+
+    def complete_key(self, key, response: str, ttl: float):
+        connection = self._connection()
+        with connection:
+            connection.execute("UPDATE idempotency SET response = ?, expires = ? WHERE key = ?",
+                               (response, time.time() + ttl, key))
+
+    def release_key(self, key):
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+
+    def key_count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM idempotency").fetchone()[0]
+
+    def prune_keys(self):
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM idempotency WHERE expires < ?", (time.time(),))
+
+    #### Ingest process health
+    def beat(self, name, detail: dict):
+        connection = self._connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO heartbeat (name, ts, detail) VALUES (?, ?, ?)",
+                               (name, time.time(), json.dumps(detail)))
+
+    def heartbeat(self, name, timeout: float = SHARED_HEARTBEAT_TIMEOUT) -> dict:
+        """Last health reported by `name`, unhealthy if it is older than `timeout` seconds."""
+        row = self._connection().execute("SELECT ts, detail FROM heartbeat WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return {"healthy": False, "heartbeat_age": None}
+        age = time.time() - row[0]
+        detail = json.loads(row[1])
+        return {**detail, "healthy": bool(detail.get("healthy")) and age < timeout, "heartbeat_age": round(age, 1)}
+
+
+class EventLogWriter:
+    """
+    Ingest process side: add() buffers values, a thread appends them to the log in batches,
+    hands the queued commands to `on_command(kind, feed, value)` and reports `health()`.
+    Nothing is buffered before start().
+    """
+
+    def __init__(self, store: SharedStore, health, interval: float = SHARED_STATE_POLL_INTERVAL,
+                 max_buffer: int = 100000):
+        self.store = store
+        self.interval = interval
+        self._on_command = None
+        self._health = health
+        self._buffer = deque(maxlen=max_buffer)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._running = False
+        self._stats = {"written": 0, "commands": 0, "failed": 0}
+
+    def start(self, on_command):
+        self._on_command = on_command
+        if self._running:
+            return
+        self._running = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="event-log-writer", daemon=True)
+        self._thread.start()
+        log.info("Sharing ingested values through %s", self.store.path)
+
+    def stop(self):
+        self._running = False
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self._flush()
+
+    def add(self, feed_id, payload, timestamp_ms: int):
+        if not self._running:
+            return
+        with self._lock:
+            self._buffer.append(("value", feed_id, str(payload), timestamp_ms))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "buffered": len(self._buffer)}
+
+    def _flush(self):
+        with self._lock:
+            rows = list(self._buffer)
+            self._buffer.clear()
+        if not rows:
+            return
+        try:
+            self.store.append_events(rows)
+            self._count("written", len(rows))
+        except sqlite3.Error as e:
+            self._count("failed", len(rows))
+            log.error("Writing %d events failed: %s", len(rows), e)
+
+    def _commands(self):
+        for kind, feed, value in self.store.take_commands():
+            self._count("commands", 1)
+            try:
+                self._on_command(kind, feed, value)
+            except Exception as e:
+                log.error("Command %s %s = %s failed: %s", kind, feed, value, e)
+
+    def _count(self, key, n):
+        with self._lock:
+            self._stats[key] += n
+
+    def _run(self):
+        next_beat = next_prune = 0.0
+        while not self._stop.wait(self.interval):
+            self._flush()
+            try:
+                self._commands()
+                now = time.monotonic()
+                if now >= next_beat:
+                    next_beat = now + 1.0
+                    self.store.beat("ingest", {**self._health(), "events": self.stats()})
+                if now >= next_prune:
+                    next_prune = now + 600.0
+                    self.store.prune_buckets()
+                    self.store.prune_keys()
+            except sqlite3.Error as e:
+                log.error("Shared state unavailable: %s", e)
+
+
+class EventLogFollower:
+    """
+    Worker side: a thread reads the events appended since the last read, every `interval`
+    seconds, and applies them with `on_value(feed, payload, timestamp_ms, live)` / `on_tag(tag)`.
+    The first read replays what the log still holds with live=False, to fill the caches of a
+    worker started after the ingest process without pushing old values to its clients again.
+    """
+
+    def __init__(self, store: SharedStore, on_value, on_tag, interval: float = SHARED_STATE_POLL_INTERVAL,
+                 batch: int = 1000):
+        self.store = store
+        self.interval = interval
+        self.batch = batch
+        self._on_value = on_value
+        self._on_tag = on_tag
+        self._seq = 0
+        self._live = False
+        self._applied = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="event-log-follower", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def poll(self) -> int:
+        """Apply every event not applied yet, returns how many there were."""
+        applied = 0
+        while True:
+            rows = self.store.events_after(self._seq, self.batch)
+            for seq, kind, feed, payload, ts in rows:
+                try:
+                    if kind == "value":
+                        self._on_value(feed, payload, ts, self._live)
+                    elif kind == "tag":
+                        self._on_tag(feed)
+                except Exception as e:
+                    log.error("Applying event %d (%s %s) failed: %s", seq, kind, feed, e)
+                self._seq = seq
+            applied += len(rows)
+            if len(rows) < self.batch:
+                break
+        self._live = True
+        self._applied += applied
+        return applied
+
+    def stats(self) -> dict:
+        return {"applied": self._applied, "seq": self._seq}
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except sqlite3.Error as e:
+                log.error("Reading the event log failed: %s", e)
+            if self._stop.wait(self.interval):
+                return
+
+
+class SharedCommandQueue:
+    """
+    CommandDispatcher stand-in for the workers: commands go to the ingest process, whose
+    dispatcher coalesces and paces them for every worker at once.
+    """
+
+    def __init__(self, store: SharedStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "coalesced": 0, "published": 0, "failed": 0}
+
+    def submit(self, feed, value) -> dict:
+        try:
+            self.store.queue("publish", feed, value)
+        except sqlite3.Error:
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+        with self._lock:
+            self._stats["submitted"] += 1
+        return {"status": "queued", "coalesced": False, "queue_depth": self.queue_depth}
+
+    def submit_many(self, commands) -> dict:
+        # One row, so the ingest process hands the whole list to its dispatcher at once
+        commands = [[feed, value] for feed, value in commands]
+        try:
+            self.store.queue("publish_many", "", json.dumps(commands))
+        except sqlite3.Error:
+            with self._lock:
+                self._stats["failed"] += len(commands)
+            raise
+        with self._lock:
+            self._stats["submitted"] += len(commands)
+        return {"status": "queued", "coalesced": 0, "queue_depth": self.queue_depth}
+
+    @property
+    def queue_depth(self) -> int:
+        return self.store.pending_commands()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "queue_depth": self.queue_depth, "tokens": None}
+
+    def stop(self, flush: bool = True):
+        pass  # Nothing is held here, queued commands wait for the ingest process
+
+
+shared_store = SharedStore()
+
+def get_shared_store():
+    return shared_store
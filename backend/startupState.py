@@ -0,0 +1,79 @@
+"""
+Start-up timings and warm-up progress, served by the /health probes.
+
+The app starts answering requests as soon as it listens: what takes time (creating the database
+client, loading the device registry and the automation rules) runs as a background warm-up.
+Liveness only tells the process is up, readiness tells the warm-up is over and no required
+step of it failed. Phases are timed from the moment this module is first imported, which
+main.py does before anything else:
+
+    imports        main.py and every module it needs are imported
+    serving        the lifespan handed over to the server, requests are accepted
+    first_request  the first request was answered
+    warmup         every warm-up step finished
+"""
+import threading
+import time
+
+from metrics import STARTUP_SECONDS
+from queueLogging import get_logger
+
+log = get_logger("Startup")
+
+PROCESS_ORIGIN = time.perf_counter()
+
+
+class StartupState:
+    def __init__(self, origin: float = PROCESS_ORIGIN):
+        self.origin = origin
+        self.finished = False
+        self._phases = {}
+        # Warm-up step -> {"status", "required", "seconds", "error"}, in start order
+        self._steps = {}
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        """Record the time of a phase, only the first time it is reached."""
+        with self._lock:
+            if phase in self._phases:
+                return
+            elapsed = self._phases[phase] = round(time.perf_counter() - self.origin, 4)
+        STARTUP_SECONDS.set(elapsed, phase)
+        log.info("Start-up phase %s reached after %.3fs", phase, elapsed)
+
+    async def step(self, name, func, required: bool = False):
+        """Await `func()` as a warm-up step. Failures are recorded and logged, never raised."""
+        with self._lock:
+            step = self._steps[name] = {"status": "running", "required": required, "seconds": None, "error": None}
+        started = time.perf_counter()
+        try:
+            await func()
+            step["status"] = "ok"
+        except Exception as e:
+            step["status"] = "failed"
+            step["error"] = str(e)
+            log.error("Warm-up step %s failed: %s", name, e)
+        finally:
+            step["seconds"] = round(time.perf_counter() - started, 4)
+
+    def finish(self):
+        self.finished = True
+        self.mark("warmup")
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return self.finished and not any(
+                step["required"] and step["status"] != "ok" for step in self._steps.values())
+
+    def report(self) -> dict:
+        with self._lock:
+            phases = dict(self._phases)
+            steps = {name: dict(step) for name, step in self._steps.items()}
+        return {"ready": self.ready, "phases": phases, "steps": steps}
+
+
+startup_state = StartupState()
+
+def get_startup_state():
+    return startup_state
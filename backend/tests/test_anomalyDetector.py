@@ -0,0 +1,124 @@
+import pytest
+
+import anomalyDetector
+from anomalyDetector import AnomalyDetector, FeedStats
+
+ROLES = {"temp": "temp", "humid": "humid", "fan": "fan"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(anomalyDetector.time, "monotonic", clock)
+    return clock
+
+
+def make_detector(**options):
+    alerts = []
+    detector = AnomalyDetector(alerts.append, ROLES.get, lambda feed_id: "Kitchen",
+                               limits={"temp": [0, 40], "humid": [20, 90]}, **options)
+    return detector, alerts
+
+
+def kinds(alerts):
+    return [alert["notification"]["type"] for alert in alerts]
+
+
+def test_rolling_statistics_follow_the_values():
+    stats = FeedStats(alpha=0.5)
+    stats.update(10.0, 0)
+    assert (stats.mean, stats.variance) == (10.0, 0.0)
+    stats.update(20.0, 30)
+    assert stats.mean == 15.0
+    assert stats.variance == pytest.approx(25.0)
+    assert stats.zscore(25.0) == pytest.approx(2.0)
+    assert stats.rate(25.0, 60) == pytest.approx(10.0)  # 5 degrees in 30 seconds
+
+
+def test_out_of_range_value_raises_one_alert_until_it_clears(clock):
+    detector, alerts = make_detector()
+    for value in ("95", "96", "97"):
+        detector.evaluate("humid", value)
+        clock.now += 10
+    assert kinds(alerts) == ["data_threshold"]
+    assert alerts[0]["notification"]["data"]["threshold"] == 90
+    assert [alert["type"] for alert in detector.active()] == ["data_threshold"]
+    detector.evaluate("humid", "50")
+    assert detector.active() == []
+
+
+def test_cleared_alert_waits_for_the_cooldown(clock):
+    detector, alerts = make_detector(cooldown=300)
+    detector.evaluate("humid", "10")
+    detector.evaluate("humid", "50")
+    clock.now += 100
+    detector.evaluate("humid", "10")
+    assert len(alerts) == 1
+    assert detector.stats()["suppressed"] == 1
+    detector.evaluate("humid", "50")
+    clock.now += 301
+    detector.evaluate("humid", "10")
+    assert kinds(alerts) == ["data_threshold", "data_threshold"]
+
+
+def test_spike_is_judged_against_the_values_before_it(clock):
+    detector, alerts = make_detector(warmup=20, z_limit=4)
+    for n in range(30):
+        detector.evaluate("humid", str(50 + (n % 2)))
+        clock.now += 60
+    assert alerts == []
+    detector.evaluate("humid", "60")
+    assert kinds(alerts) == ["anomaly"]
+    assert alerts[0]["notification"]["data"]["zscore"] > 4
+
+
+def test_no_anomaly_before_the_warmup(clock):
+    detector, alerts = make_detector(warmup=20)
+    for value in ("50", "51", "50", "75"):
+        detector.evaluate("humid", value)
+        clock.now += 60
+    assert alerts == []
+
+
+def test_hot_room_is_a_fire(clock):
+    detector, alerts = make_detector()
+    detector.evaluate("temp", "55")
+    fire = alerts[0]["notification"]
+    assert fire["type"] == "fire_alert"
+    assert fire["message"] == "Possible fire at Kitchen: temperature 55°C"
+    assert kinds(alerts) == ["fire_alert", "data_threshold"]
+
+
+def test_fast_anomalous_rise_is_a_fire(clock):
+    detector, alerts = make_detector(warmup=10)
+    for n in range(20):
+        detector.evaluate("temp", str(24 + (n % 2) * 0.2))
+        clock.now += 60
+    detector.evaluate("temp", "33")
+    # Still inside the temp limits: only the rise tells
+    assert kinds(alerts) == ["fire_alert", "anomaly"]
+    assert alerts[0]["notification"]["data"]["rate_per_minute"] >= 5
+    # The rise flattening out does not end the fire, cooling FIRE_CLEAR_DROP below 33 does
+    clock.now += 60
+    detector.evaluate("temp", "30")
+    assert "fire_alert" in [alert["type"] for alert in detector.active()]
+    clock.now += 60
+    detector.evaluate("temp", "27")
+    assert "fire_alert" not in [alert["type"] for alert in detector.active()]
+
+
+def test_other_feeds_and_payloads_are_ignored(clock):
+    detector, alerts = make_detector()
+    detector.evaluate("fan", "100")
+    detector.evaluate("unknown", "100")
+    detector.evaluate("temp", "hot")
+    assert alerts == []
+    assert detector.stats()["evaluated"] == 0
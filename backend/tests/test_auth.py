@@ -0,0 +1,136 @@
+import time
+
+import jwt
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import auth
+from auth import UserCache, hash_password, issue_token, needs_rehash, verify_password, verify_token
+from routers import login
+
+USER = {"user_id": 7, "username": "alice"}
+
+
+def test_password_hash_round_trip():
+    stored = hash_password("correct horse", n=2 ** 4)
+    assert stored.startswith("scrypt$16$8$1$")
+    assert verify_password("correct horse", stored)
+    assert not verify_password("wrong horse", stored)
+    # Salted: the same password never hashes the same twice
+    assert hash_password("correct horse", n=2 ** 4) != stored
+
+
+def test_plain_and_weaker_passwords_need_a_rehash(monkeypatch):
+    monkeypatch.setattr(auth, "PASSWORD_SCRYPT_N", 2 ** 5)
+    assert verify_password("legacy", "legacy")
+    assert not verify_password("legacy", None)
+    assert needs_rehash("legacy")
+    assert needs_rehash(hash_password("secret", n=2 ** 4))
+    assert not needs_rehash(hash_password("secret"))
+
+
+def test_malformed_hash_is_refused():
+    assert not verify_password("secret", "scrypt$16$8$1$not-base64")
+
+
+def test_token_carries_the_user():
+    claims = verify_token(issue_token(USER))
+    assert claims["sub"] == "7"
+    assert claims["username"] == "alice"
+    assert claims["exp"] - claims["iat"] == auth.AUTH_TOKEN_TTL
+
+
+def test_expired_token_is_refused():
+    now = int(time.time())
+    token = jwt.encode({"sub": "7", "iat": now - 100, "exp": now - 10}, auth.AUTH_SECRET, algorithm="HS256")
+    assert verify_token(token) is None
+
+
+def test_cached_token_still_expires(monkeypatch):
+    token = issue_token(USER)
+    assert verify_token(token) is not None
+    later = time.time() + auth.AUTH_TOKEN_TTL + 1
+    monkeypatch.setattr(auth.time, "time", lambda: later)
+    assert verify_token(token) is None
+
+
+def test_token_signed_with_another_key_is_refused():
+    token = jwt.encode({"sub": "7", "exp": int(time.time()) + 60}, "another key", algorithm="HS256")
+    assert verify_token(token) is None
+    assert verify_token("not a token") is None
+
+
+def test_user_cache_expires_and_evicts(monkeypatch):
+    cache = UserCache(ttl=60, size=2)
+    cache.put(1, {"user_id": 1})
+    cache.put(2, {"user_id": 2})
+    cache.get(1)
+    cache.put(3, {"user_id": 3})
+    assert cache.get(2) is None
+    assert cache.get(1) == {"user_id": 1}
+    later = time.monotonic() + 61
+    monkeypatch.setattr(auth.time, "monotonic", lambda: later)
+    assert cache.get(3) is None
+
+
+class UsersTable:
+    """Just the users queries the login route makes."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.changes = None
+
+    def table(self, name):
+        return self
+
+    def select(self, columns):
+        return self
+
+    def update(self, changes):
+        self.changes = changes
+        return self
+
+    def eq(self, column, value):
+        self.match = (column, value)
+        return self
+
+    def execute(self):
+        rows = [row for row in self.rows if row[self.match[0]] == self.match[1]]
+        if self.changes is not None:
+            for row in rows:
+                row.update(self.changes)
+            self.changes = None
+        return type("Result", (), {"data": [dict(row) for row in rows]})
+
+
+def login_client(rows):
+    app = FastAPI()
+    app.include_router(login.router)
+    app.state.db = UsersTable(rows)
+    return TestClient(app)
+
+
+def test_login_upgrades_a_plain_password(monkeypatch):
+    monkeypatch.setattr(auth, "PASSWORD_SCRYPT_N", 2 ** 4)
+    rows = [{"user_id": 7, "username": "alice", "pass": "1234"}]
+    client = login_client(rows)
+    body = client.post("/login/authentication", json={"username": "alice", "password": "1234"}).json()
+    assert body["message"] == "Login successful"
+    assert "pass" not in body["user"]
+    assert verify_token(body["access_token"])["sub"] == "7"
+    assert rows[0]["pass"].startswith("scrypt$16$")
+    assert verify_password("1234", rows[0]["pass"])
+    # Up to date now: the next login leaves it alone
+    upgraded = rows[0]["pass"]
+    client.post("/login/authentication", json={"username": "alice", "password": "1234"})
+    assert rows[0]["pass"] == upgraded
+
+
+def test_login_refuses_a_wrong_password_and_unknown_users(monkeypatch):
+    monkeypatch.setattr(auth, "PASSWORD_SCRYPT_N", 2 ** 4)
+    monkeypatch.setattr(login, "dummy_hash", None)
+    rows = [{"user_id": 7, "username": "alice", "pass": hash_password("1234")}]
+    client = login_client(rows)
+    for username, password in (("alice", "4321"), ("bob", "1234")):
+        body = client.post("/login/authentication", json={"username": username, "password": password}).json()
+        assert body == {"message": "Invalid username or password"}
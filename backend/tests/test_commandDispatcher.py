@@ -0,0 +1,76 @@
+import threading
+
+from commandDispatcher import CommandDispatcher
+
+
+def held_dispatcher(published):
+    # A window long enough that nothing is published before stop() flushes the queue
+    return CommandDispatcher(lambda feed, value: published.append((feed, value)), window=60,
+                             rate_per_minute=6000, burst=50)
+
+
+def test_updates_to_a_queued_feed_are_coalesced():
+    published = []
+    dispatcher = held_dispatcher(published)
+    assert dispatcher.submit("fan", 10)["coalesced"] is False
+    result = dispatcher.submit("fan", 40)
+    assert result == {"status": "queued", "coalesced": True, "queue_depth": 1}
+    dispatcher.stop()
+    assert published == [("fan", 40)]
+    assert dispatcher.stats()["published"] == 1
+
+
+def test_submit_many_keeps_the_order_given():
+    published = []
+    dispatcher = held_dispatcher(published)
+    dispatcher.submit("fan", 10)
+    result = dispatcher.submit_many([("switch", 0), ("fan", 40), ("color", "#FF0000")])
+    assert result == {"status": "queued", "coalesced": 1, "queue_depth": 3}
+    dispatcher.stop()
+    # The queued fan update moved behind the switch, as the batch asks
+    assert published == [("switch", 0), ("fan", 40), ("color", "#FF0000")]
+
+
+def test_submit_many_coalesces_within_the_batch():
+    published = []
+    dispatcher = held_dispatcher(published)
+    dispatcher.submit_many([("fan", 10), ("switch", 1), ("fan", 70)])
+    dispatcher.stop()
+    assert published == [("switch", 1), ("fan", 70)]
+    assert dispatcher.stats()["coalesced"] == 1
+
+
+def test_stop_without_flush_drops_the_queue():
+    published = []
+    dispatcher = held_dispatcher(published)
+    dispatcher.submit_many([("fan", 10), ("switch", 1)])
+    dispatcher.stop(flush=False)
+    assert published == []
+    assert dispatcher.queue_depth == 0
+
+
+def test_publisher_thread_sends_after_the_window():
+    sent = threading.Event()
+    published = []
+
+    def publish(feed, value):
+        published.append((feed, value))
+        sent.set()
+
+    dispatcher = CommandDispatcher(publish, window=0.01, rate_per_minute=6000, burst=5)
+    try:
+        dispatcher.submit("fan", 40)
+        assert sent.wait(2)
+        assert published == [("fan", 40)]
+    finally:
+        dispatcher.stop()
+
+
+def test_failed_publish_is_counted():
+    def publish(feed, value):
+        raise ConnectionError("broker gone")
+
+    dispatcher = CommandDispatcher(publish, window=60)
+    dispatcher.submit("fan", 40)
+    dispatcher.stop()
+    assert dispatcher.stats()["failed"] == 1
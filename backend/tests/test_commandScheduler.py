@@ -0,0 +1,76 @@
+import threading
+
+from commandScheduler import TimingWheel, CommandScheduler
+
+
+def test_timer_goes_into_the_slot_of_its_due_tick():
+    wheel = TimingWheel(tick=1.0, slots=4, now=0.0)
+    wheel.add("a", 2.5, None)
+    timer = wheel.get("a")
+    assert (timer.slot, timer.rounds) == (3, 0)
+
+
+def test_timer_past_one_turn_waits_for_its_rounds():
+    wheel = TimingWheel(tick=1.0, slots=4, now=0.0)
+    wheel.add("a", 9.0, None)
+    timer = wheel.get("a")
+    assert (timer.slot, timer.rounds) == (1, 2)
+    # Its slot comes around at ticks 1 and 5 first, without firing it
+    assert wheel.advance(8.99) == []
+    assert [t.timer_id for t in wheel.advance(9.0)] == ["a"]
+    assert len(wheel) == 0
+
+
+def test_timer_on_a_turn_boundary_fires_on_time():
+    wheel = TimingWheel(tick=1.0, slots=4, now=0.0)
+    wheel.add("a", 4.0, None)
+    assert wheel.get("a").rounds == 0
+    assert wheel.advance(3.5) == []
+    assert [t.timer_id for t in wheel.advance(4.0)] == ["a"]
+
+
+def test_due_timers_come_back_in_due_order():
+    wheel = TimingWheel(tick=1.0, slots=4, now=0.0)
+    for timer_id, due in (("late", 2.9), ("early", 1.2), ("middle", 2.1)):
+        wheel.add(timer_id, due, None)
+    assert [t.timer_id for t in wheel.advance(3.0)] == ["early", "middle", "late"]
+
+
+def test_timer_due_in_the_past_fires_on_the_next_tick():
+    wheel = TimingWheel(tick=1.0, slots=4, now=10.0)
+    wheel.add("a", 3.0, None)
+    assert wheel.get("a").slot == 11 % 4
+    assert [t.timer_id for t in wheel.advance(11.0)] == ["a"]
+
+
+def test_cancelled_timer_never_fires():
+    wheel = TimingWheel(tick=1.0, slots=4, now=0.0)
+    wheel.add("a", 2.0, None)
+    assert wheel.cancel("a").timer_id == "a"
+    assert wheel.cancel("a") is None
+    assert wheel.advance(10.0) == []
+
+
+def test_falling_behind_by_more_than_a_turn_refiles_the_timers():
+    wheel = TimingWheel(tick=1.0, slots=4, now=0.0)
+    wheel.add("due", 3.0, None)
+    wheel.add("later", 30.0, None)
+    assert [t.timer_id for t in wheel.advance(20.0)] == ["due"]
+    assert wheel.get("later").rounds == (30 - 20 - 1) // 4
+    assert wheel.advance(29.5) == []
+    assert [t.timer_id for t in wheel.advance(30.0)] == ["later"]
+
+
+def test_scheduler_fires_and_scopes_entries_to_their_owner():
+    fired = threading.Event()
+    scheduler = CommandScheduler(lambda entry: fired.set(), tick=0.01, slots=16)
+    try:
+        kept = scheduler.schedule(1, [("fan", 40, "User set fan speed to 40")], 60)
+        scheduler.schedule(2, [("switch", 1, "User turned on the light")], 0.02)
+        assert [entry["id"] for entry in scheduler.pending(1)] == [kept["id"]]
+        assert not scheduler.cancel(kept["id"], 2)
+        assert fired.wait(2)
+        assert scheduler.cancel(kept["id"], 1)
+        assert scheduler.stats()["pending"] == 0
+    finally:
+        scheduler.stop()
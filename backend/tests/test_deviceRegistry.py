@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import adafruitConnection
+from deviceRegistry import DeviceRegistry
+from ruleEngine import Rule
+
+DEFAULT_FEEDS = {"temp": "temp", "fan": "fan", "switch": "switch"}
+
+
+def row(device_id, user_id, feed, role=None, name="Device"):
+    properties = {"feed": feed}
+    if role is not None:
+        properties["role"] = role
+    return {"device_id": device_id, "user_id": user_id, "name": name, "serial_number": f"SN{device_id}",
+            "properties": json.dumps(properties)}
+
+
+@pytest.fixture
+def registry():
+    new_feeds = []
+    registry = DeviceRegistry(DEFAULT_FEEDS, on_new_feeds=new_feeds.extend)
+    registry.new_feeds = new_feeds
+    return registry
+
+
+def test_users_resolve_to_their_own_device_or_the_default_feed(registry):
+    registry.refresh([row(1, 10, "home-1.temp", "temp"), row(2, 20, "home-2.fan", "fan")])
+    assert registry.resolve(10, "temp") == ("home-1.temp", 1)
+    assert registry.resolve(10, "fan") == ("fan", None)
+    assert registry.resolve(None, "temp") == ("temp", None)
+    assert registry.device_for_feed("home-2.fan").user_id == 20
+    assert registry.new_feeds == ["home-1.temp", "home-2.fan"]
+
+
+def test_role_defaults_to_the_standard_feed_name(registry):
+    registry.refresh([row(1, 10, "temp")])
+    assert registry.device(1).role == "temp"
+    assert registry.resolve(10, "temp") == ("temp", 1)
+
+
+def test_refresh_only_applies_what_changed(registry):
+    rows = [row(1, 10, "home-1.temp", "temp"), row(2, 10, "home-1.fan", "fan")]
+    registry.refresh(rows)
+    registry.refresh([dict(r) for r in rows])
+    assert registry.stats()["changed"] == 2
+    registry.refresh([rows[0], row(2, 10, "home-1.fan2", "fan")])
+    assert registry.stats()["changed"] == 3
+    assert registry.resolve(10, "fan") == ("home-1.fan2", 2)
+    assert registry.device_for_feed("home-1.fan") is None
+    assert registry.new_feeds[-1] == "home-1.fan2"
+
+
+def test_removed_device_hands_its_role_to_the_next_one(registry):
+    registry.refresh([row(1, 10, "a.temp", "temp"), row(3, 10, "b.temp", "temp")])
+    assert registry.resolve(10, "temp") == ("a.temp", 1)  # The oldest device wins
+    registry.refresh([row(3, 10, "b.temp", "temp")])
+    assert registry.resolve(10, "temp") == ("b.temp", 3)
+    registry.refresh([])
+    assert registry.resolve(10, "temp") == ("temp", None)
+    assert registry.stats() == {"refreshes": 3, "changed": 4, "devices": 0, "users": 0, "feeds": 0}
+
+
+def test_ownerless_and_unconnected_devices_are_never_routed_to(registry):
+    registry.refresh([row(1, None, "shared.temp", "temp"),
+                      {"device_id": 2, "user_id": 10, "name": "Spare", "properties": "not json"}])
+    assert registry.resolve(10, "temp") == ("temp", None)
+    assert registry.device_for_feed("shared.temp").device_id == 1
+    assert [device["device_id"] for device in registry.devices_of(10)] == [2]
+    assert registry.device(2).feed is None
+
+
+def test_rule_commands_go_to_the_feeds_of_the_rule_device(monkeypatch):
+    registry = DeviceRegistry(adafruitConnection.FEED_ROLES)
+    registry.refresh([row(1, 10, "home-1.temp", "temp"), row(2, 10, "home-1.fan", "fan")])
+    monkeypatch.setattr(adafruitConnection, "device_registry", registry)
+    rule_feed = adafruitConnection.rule_feed
+    on_sensor = Rule(1, 1, "", "home-1.temp", ">", 30, action=("fan", 100))
+    on_fan = Rule(2, 2, "", "home-1.temp", ">", 30, action=("fan", 100))
+    assert rule_feed(on_sensor, "fan") == "home-1.fan"  # The fan of the sensor owner
+    assert rule_feed(on_fan, "fan") == "home-1.fan"
+    assert rule_feed(on_sensor, "switch") == "switch"  # No light registered: the default feed
+    assert rule_feed(Rule(3, None, "", "temp", ">", 30), "fan") == "fan"
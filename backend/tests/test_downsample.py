@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from downsample import bucket_aggregate, lttb
+
+
+def test_buckets_aggregate_their_samples():
+    timestamps = np.array([0, 10, 20, 35, 90])
+    values = np.array([4.0, 1.0, 7.0, 3.0, 5.0])
+    width, columns = bucket_aggregate(timestamps, values, 0, 100, 4)
+    assert width == 25
+    # The bucket [50, 75) is empty and left out
+    assert columns["timestamp"].tolist() == [0, 25, 75]
+    assert columns["min"].tolist() == [1.0, 3.0, 5.0]
+    assert columns["max"].tolist() == [7.0, 3.0, 5.0]
+    assert columns["mean"].tolist() == [4.0, 3.0, 5.0]
+    assert columns["last"].tolist() == [7.0, 3.0, 5.0]
+    assert columns["count"].tolist() == [3, 1, 1]
+
+
+def test_samples_outside_the_range_are_ignored():
+    timestamps = np.array([-5, 0, 99, 100])
+    width, columns = bucket_aggregate(timestamps, np.array([1.0, 2.0, 3.0, 4.0]), 0, 100, 3)
+    assert width == 34
+    assert columns["count"].sum() == 2
+    assert columns["last"].tolist() == [2.0, 3.0]
+
+
+def test_no_samples_gives_empty_columns():
+    width, columns = bucket_aggregate(np.array([], dtype=np.int64), np.array([]), 0, 10, 100)
+    assert width == 1
+    assert all(len(column) == 0 for column in columns.values())
+
+
+def test_lttb_keeps_the_endpoints_and_the_threshold():
+    timestamps = np.arange(1000) * 1000
+    values = np.sin(np.arange(1000) / 50.0)
+    kept_ts, kept_values = lttb(timestamps, values, 100)
+    assert len(kept_ts) == 100
+    assert (kept_ts[0], kept_ts[-1]) == (0, 999_000)
+    assert np.all(np.diff(kept_ts) > 0)
+    assert np.all(np.isin(kept_values, values))
+
+
+def test_lttb_keeps_a_spike():
+    values = np.zeros(500)
+    values[123] = 50.0
+    kept_ts, kept_values = lttb(np.arange(500), values, 20)
+    assert 123 in kept_ts.tolist()
+    assert kept_values.max() == 50.0
+
+
+@pytest.mark.parametrize("threshold", [2, 10, 50])
+def test_lttb_leaves_short_series_alone(threshold):
+    timestamps, values = np.arange(10), np.arange(10.0)
+    kept_ts, kept_values = lttb(timestamps, values, threshold)
+    assert kept_ts is timestamps and kept_values is values
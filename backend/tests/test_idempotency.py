@@ -0,0 +1,138 @@
+import asyncio
+import itertools
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+from sharedState import SharedStore
+
+
+def make_client(store, calls, release=None):
+    counter = itertools.count(1)
+
+    async def command(request: Request):
+        calls.append(await request.json())
+        if release is not None:
+            await release.wait()
+        return JSONResponse({"message": "Success", "call": next(counter)}, status_code=202)
+
+    async def failing(request: Request):
+        calls.append(await request.json())
+        return JSONResponse({"error": "Adafruit IO unreachable"}, status_code=202)
+
+    app = Starlette(routes=[Route("/commands/run", command, methods=["POST"]),
+                            Route("/commands/failing", failing, methods=["POST"]),
+                            Route("/other", command, methods=["POST"])])
+    app.add_middleware(IdempotencyMiddleware, store=store)
+    return TestClient(app)
+
+
+@pytest.fixture(params=["memory", "shared"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return IdempotencyStore(ttl=60)
+    return IdempotencyStore(ttl=60, store=SharedStore(str(tmp_path / "state.sqlite3")))
+
+
+def test_retry_gets_the_first_response_replayed(store):
+    calls = []
+    client = make_client(store, calls)
+    first = client.post("/commands/run", json={"speed": 40}, headers={"Idempotency-Key": "k1"})
+    retry = client.post("/commands/run", json={"speed": 40}, headers={"Idempotency-Key": "k1"})
+    assert len(calls) == 1
+    assert retry.status_code == first.status_code == 202
+    assert retry.json() == first.json() == {"message": "Success", "call": 1}
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    assert store.stats()["replayed"] == 1
+
+
+def test_same_key_for_another_request_is_refused(store):
+    calls = []
+    client = make_client(store, calls)
+    client.post("/commands/run", json={"speed": 40}, headers={"Idempotency-Key": "k1"})
+    other = client.post("/commands/run", json={"speed": 80}, headers={"Idempotency-Key": "k1"})
+    assert other.status_code == 422
+    assert len(calls) == 1
+    assert store.stats()["mismatches"] == 1
+
+
+def test_retry_while_the_first_request_runs_conflicts(store):
+    calls = []
+    release = asyncio.Event()
+    app = make_client(store, calls, release).app
+    headers = {"Idempotency-Key": "k1"}
+    responses = {}
+
+    async def scenario():
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            first = asyncio.create_task(client.post("/commands/run", json={"speed": 40}, headers=headers))
+            while not calls:
+                await asyncio.sleep(0.001)
+            responses["retry"] = await client.post("/commands/run", json={"speed": 40}, headers=headers)
+            release.set()
+            responses["first"] = await first
+            responses["after"] = await client.post("/commands/run", json={"speed": 40}, headers=headers)
+
+    asyncio.run(scenario())
+    assert responses["retry"].status_code == 409
+    assert responses["retry"].headers["retry-after"] == "1"
+    assert responses["first"].status_code == 202
+    assert responses["after"].headers["idempotent-replayed"] == "true"
+    assert len(calls) == 1
+    assert store.stats()["conflicts"] == 1
+
+
+def test_failed_request_can_be_retried(store):
+    calls = []
+    client = make_client(store, calls)
+    for _ in range(2):
+        response = client.post("/commands/failing", json={}, headers={"Idempotency-Key": "k1"})
+        assert "idempotent-replayed" not in response.headers
+    assert len(calls) == 2
+
+
+def test_requests_without_a_key_or_outside_the_prefixes_are_not_remembered(store):
+    calls = []
+    client = make_client(store, calls)
+    client.post("/commands/run", json={})
+    client.post("/commands/run", json={})
+    client.post("/other", json={}, headers={"Idempotency-Key": "k1"})
+    client.post("/other", json={}, headers={"Idempotency-Key": "k1"})
+    assert len(calls) == 4
+    assert store.stats()["keys"] == 0
+
+
+def test_overlong_key_is_rejected(store):
+    client = make_client(store, [])
+    assert client.post("/commands/run", json={}, headers={"Idempotency-Key": "k" * 256}).status_code == 400
+
+
+def test_cancelled_request_frees_its_key(store):
+    calls = []
+    release = asyncio.Event()
+    app = make_client(store, calls, release).app
+    headers = {"Idempotency-Key": "k1"}
+    responses = {}
+
+    async def scenario():
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            first = asyncio.create_task(client.post("/commands/run", json={"speed": 40}, headers=headers))
+            while not calls:
+                await asyncio.sleep(0.001)
+            first.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            release.set()
+            responses["retry"] = await client.post("/commands/run", json={"speed": 40}, headers=headers)
+
+    asyncio.run(scenario())
+    assert responses["retry"].status_code == 202
+    assert "idempotent-replayed" not in responses["retry"].headers
+    assert len(calls) == 2
@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from rateLimiter import RateLimiter, RateLimitMiddleware, route_class
+
+LIMITS = {"control": (1.0, 2), "default": (10.0, 5)}
+
+
+def test_bucket_refills_continuously():
+    limiter = RateLimiter(LIMITS)
+    assert limiter.hit("a", "control", now=0.0) == (True, 0.0)
+    assert limiter.hit("a", "control", now=0.0) == (True, 0.0)
+    allowed, retry_after = limiter.hit("a", "control", now=0.25)
+    assert not allowed
+    assert retry_after == pytest.approx(0.75)
+    assert limiter.hit("a", "control", now=1.0)[0]
+    assert limiter.rejected == 1
+
+
+def test_refill_is_capped_at_the_burst():
+    limiter = RateLimiter(LIMITS)
+    limiter.hit("a", "control", now=0.0)
+    assert [limiter.hit("a", "control", now=3600.0)[0] for _ in range(3)] == [True, True, False]
+
+
+def test_clients_and_route_classes_have_their_own_buckets():
+    limiter = RateLimiter(LIMITS)
+    for _ in range(2):
+        limiter.hit("a", "control", now=0.0)
+    assert not limiter.hit("a", "control", now=0.0)[0]
+    assert limiter.hit("b", "control", now=0.0)[0]
+    assert limiter.hit("a", "read", now=0.0)[0]  # Unknown classes use the default limits
+
+
+def test_least_recently_used_bucket_is_evicted():
+    limiter = RateLimiter(LIMITS, max_buckets=2)
+    for _ in range(2):
+        limiter.hit("a", "control", now=0.0)
+    limiter.hit("b", "control", now=0.0)
+    limiter.hit("a", "control", now=0.0)  # Refused, but "a" is now the most recently used
+    limiter.hit("c", "control", now=0.0)
+    assert len(limiter) == 2
+    assert not limiter.hit("a", "control", now=0.0)[0]
+
+
+def test_disabled_limiter_allows_everything():
+    limiter = RateLimiter(LIMITS, enabled=False)
+    assert all(limiter.hit("a", "control", now=0.0)[0] for _ in range(10))
+    assert len(limiter) == 0
+
+
+def test_unavailable_shared_store_fails_open():
+    class LockedStore:
+        def take_token(self, key, rate, burst):
+            raise sqlite3.OperationalError("database is locked")
+
+    limiter = RateLimiter(LIMITS, store=LockedStore())
+    assert limiter.hit("a", "control") == (True, 0.0)
+
+
+def test_route_class_from_the_first_path_segment():
+    assert route_class("/fan/fan/on") == "control"
+    assert route_class("/sensor/history/temp") == "read"
+    assert route_class("/login") == "auth"
+    assert route_class("/metrics") == "default"
+    assert route_class("") == "default"
+
+
+def test_middleware_answers_429_with_retry_after():
+    async def fan(request):
+        return JSONResponse({"message": "Success"})
+
+    app = Starlette(routes=[Route("/fan/on", fan, methods=["POST"])])
+    app.add_middleware(RateLimitMiddleware, limiter=RateLimiter({"control": (0.5, 1), "default": (0.5, 1)}))
+    client = TestClient(app)
+    assert client.post("/fan/on").status_code == 200
+    refused = client.post("/fan/on")
+    assert refused.status_code == 429
+    assert refused.headers["retry-after"] == "2"
+    # Preflight requests are never counted
+    assert client.options("/fan/on").status_code != 429
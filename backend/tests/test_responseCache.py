@@ -0,0 +1,138 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import responseCache
+from responseCache import ResponseCache, accepted_encoding, etag_matches
+
+HISTORY = [{"value": f"{20 + n % 10}.5", "timestamp": f"2026-01-01T00:{n // 60:02d}:{n % 60:02d}Z"}
+           for n in range(200)]
+
+
+@pytest.fixture
+def app():
+    cache = ResponseCache(size=8, ttl=60)
+    app = FastAPI()
+    app.state.cache = cache
+    app.state.calls = []
+
+    @app.get("/history/{feed_id}")
+    async def history(request: Request, feed_id: str, user: str = None):
+        async def compute():
+            app.state.calls.append(feed_id)
+            return {"feed": feed_id, "history": app.state.history}
+        return await cache.respond(request, ["feed:" + feed_id], compute, vary=(request.headers.get("x-user"), feed_id))
+
+    @app.get("/latest")
+    async def latest(request: Request):
+        async def compute():
+            app.state.calls.append("latest")
+            return {"error": "upstream down"} if app.state.failing else {"value": "21"}
+        return await cache.respond(request, ["feed:temp"], compute, cacheable=lambda content: "error" not in content)
+
+    app.state.history = list(HISTORY)
+    app.state.failing = False
+    return app
+
+
+def test_second_request_is_served_from_the_cache(app):
+    client = TestClient(app)
+    first = client.get("/history/temp", headers={"Accept-Encoding": "identity"})
+    second = client.get("/history/temp", headers={"Accept-Encoding": "identity"})
+    assert first.json()["history"] == HISTORY
+    assert second.content == first.content
+    assert app.state.calls == ["temp"]
+    assert first.headers["cache-control"] == "no-cache"
+    assert "Authorization" in first.headers["vary"]
+
+
+def test_matching_if_none_match_gets_304(app):
+    client = TestClient(app)
+    etag = client.get("/history/temp", headers={"Accept-Encoding": "identity"}).headers["etag"]
+    revalidated = client.get("/history/temp", headers={"If-None-Match": etag, "Accept-Encoding": "identity"})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+    assert client.get("/history/temp", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_invalidated_tag_recomputes_with_a_new_etag(app):
+    client = TestClient(app)
+    etag = client.get("/history/temp").headers["etag"]
+    app.state.cache.invalidate("feed:humid")
+    assert client.get("/history/temp", headers={"If-None-Match": etag}).status_code == 304
+    app.state.history.append({"value": "30", "timestamp": "2026-01-01T01:00:00Z"})
+    app.state.cache.invalidate("feed:temp")
+    refreshed = client.get("/history/temp", headers={"If-None-Match": etag})
+    assert refreshed.status_code == 200
+    assert refreshed.headers["etag"] != etag
+    assert app.state.calls == ["temp", "temp"]
+
+
+def test_parameters_and_vary_get_their_own_entries(app):
+    client = TestClient(app)
+    client.get("/history/temp")
+    client.get("/history/temp", params={"user": "1"})
+    client.get("/history/temp", headers={"X-User": "2"})
+    client.get("/history/humid")
+    assert app.state.calls == ["temp", "temp", "temp", "humid"]
+    assert len(app.state.cache) == 4
+
+
+def test_large_bodies_are_gzipped_once_with_their_own_etag(app, monkeypatch):
+    monkeypatch.setattr(responseCache, "brotli", None)
+    client = TestClient(app)
+    plain = client.get("/history/temp", headers={"Accept-Encoding": "identity"})
+    zipped = client.get("/history/temp", headers={"Accept-Encoding": "gzip"})
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert zipped.headers["etag"] == plain.headers["etag"][:-1] + '-gzip"'
+    assert zipped.json() == plain.json()
+    assert int(zipped.headers["content-length"]) < len(plain.content) / 3
+    # The gzip ETag only matches the gzip body
+    assert client.get("/history/temp", headers={"Accept-Encoding": "identity",
+                                                "If-None-Match": zipped.headers["etag"]}).status_code == 200
+
+
+def test_small_bodies_are_sent_uncompressed(app):
+    response = TestClient(app).get("/latest", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"value": "21"}
+
+
+def test_content_that_is_not_cacheable_is_computed_again(app):
+    client = TestClient(app)
+    app.state.failing = True
+    assert client.get("/latest").json() == {"error": "upstream down"}
+    app.state.failing = False
+    assert client.get("/latest").json() == {"value": "21"}
+    assert client.get("/latest").json() == {"value": "21"}
+    assert app.state.calls == ["latest", "latest"]
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(size=2)
+    for key in ("a", "b"):
+        cache.store(key, (), {"key": key})
+    cache.lookup("a", ())
+    cache.store("c", (), {"key": "c"})
+    assert cache.lookup("b", ()) is None
+    assert cache.lookup("a", ()) is not None
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=0, deflate", None),
+    ("*", "gzip"),
+    ("identity", None),
+])
+def test_accepted_encoding_without_brotli(monkeypatch, header, expected):
+    monkeypatch.setattr(responseCache, "brotli", None)
+    assert accepted_encoding(header) == expected
+
+
+def test_etag_matching():
+    assert etag_matches('"a", "b"', '"b"')
+    assert etag_matches("*", '"b"')
+    assert not etag_matches(None, '"b"')
+    assert not etag_matches('"a"', '"b"')
@@ -0,0 +1,138 @@
+import json
+
+import pytest
+
+from ruleEngine import Rule, RuleEngine, compile_rule, parse_sentence
+
+FEEDS = {"temp", "humid", "light", "fan", "switch"}
+
+
+def fan_rule(**options):
+    return Rule(1, None, "", "temp", ">", 30, action=("fan", 100), release=("fan", 0), **options)
+
+
+def test_rule_fires_once_and_clears_past_the_hysteresis_band():
+    rule = fan_rule(hysteresis=2)
+    assert rule.step(29.0, 0) is None
+    assert rule.step(31.0, 1) == ("fan", 100)
+    assert rule.step(35.0, 2) is None  # Already active
+    assert rule.step(29.0, 3) is None  # Below the threshold, still inside the band
+    assert rule.step(28.0, 4) == ("fan", 0)
+    assert not rule.active
+
+
+def test_below_rule_has_its_band_above_the_threshold():
+    rule = Rule(2, None, "", "humid", "<", 40, hysteresis=5, action=("fan", 0), release=("fan", 100))
+    assert rule.clear_at == 45
+    assert rule.step(39.0, 0) == ("fan", 0)
+    assert rule.step(44.0, 1) is None
+    assert rule.step(46.0, 2) == ("fan", 100)
+
+
+def test_condition_has_to_hold_before_the_rule_fires():
+    rule = fan_rule(hold=10)
+    assert rule.step(31.0, 100) is None
+    assert rule.step(32.0, 105) is None
+    assert rule.step(29.0, 106) is None  # A dip restarts the wait
+    assert rule.step(31.0, 107) is None
+    assert rule.step(31.0, 116.9) is None
+    assert rule.step(31.0, 117) == ("fan", 100)
+
+
+def test_rule_without_release_clears_silently():
+    rule = Rule(3, None, "", "temp", ">=", 30, action=("fan", 100))
+    assert rule.step(30.0, 0) == ("fan", 100)
+    assert rule.step(20.0, 1) is None
+    assert rule.step(30.0, 2) == ("fan", 100)
+
+
+def test_unknown_operator_is_refused():
+    with pytest.raises(ValueError):
+        Rule(1, None, "", "temp", "==", 30)
+
+
+@pytest.mark.parametrize("sentence, feed, op, threshold, action", [
+    ("Turn on the fan when temperature is above 30", "temp", ">", 30.0, {"feed": "fan", "value": 100}),
+    ("turn off the light if light level drops below 12.5", "light", "<", 12.5, {"feed": "switch", "value": 0}),
+    ("Turn on fan when humidity > 80", "humid", ">", 80.0, {"feed": "fan", "value": 100}),
+])
+def test_sentences_are_understood(sentence, feed, op, threshold, action):
+    spec = parse_sentence(sentence)
+    assert (spec["feed"], spec["op"], spec["threshold"], spec["action"]) == (feed, op, threshold, action)
+
+
+def test_sentence_without_a_condition_is_not_a_rule():
+    assert parse_sentence("Turn on the fan at 7pm") == {}
+    with pytest.raises(ValueError):
+        compile_rule({"rule_id": 1, "rule_description": json.dumps({"content": "Turn on the fan at 7pm"})}, FEEDS)
+
+
+def test_structured_fields_win_over_the_sentence():
+    description = {"content": "Turn on the fan when temperature is above 30", "threshold": 28, "hold": 5}
+    rule = compile_rule({"rule_id": 4, "device_id": 9, "rule_description": json.dumps(description)}, FEEDS)
+    assert (rule.feed, rule.op, rule.threshold, rule.hold, rule.device_id) == ("temp", ">", 28.0, 5.0, 9)
+    assert rule.release == ("fan", 0)
+
+
+def test_rule_on_an_unknown_feed_is_refused():
+    description = {"feed": "pressure", "threshold": 1000, "action": {"feed": "fan", "value": 100}}
+    with pytest.raises(ValueError):
+        compile_rule({"rule_id": 5, "rule_description": json.dumps(description)}, FEEDS)
+
+
+def make_engine():
+    submitted, recorded = [], []
+    engine = RuleEngine(lambda feed, value: submitted.append((feed, value)),
+                        lambda rule, feed, activity: recorded.append((rule.rule_id, feed)), FEEDS)
+    return engine, submitted, recorded
+
+
+def test_engine_only_checks_the_rules_of_the_value_feed():
+    engine, submitted, recorded = make_engine()
+    engine.load([
+        {"rule_id": 1, "rule_description": "Turn on the fan when temperature is above 30"},
+        {"rule_id": 2, "rule_description": "Turn on the light when humidity is above 70"},
+        {"rule_id": 3, "rule_description": "not a rule"},
+    ])
+    assert engine.stats()["loaded"] == 2
+    assert engine.stats()["skipped"] == 1
+    engine.evaluate("temp", "31")
+    engine.evaluate("temp", "not a number")
+    engine.evaluate("fan", "100")
+    assert submitted == [("fan", 100)]
+    assert recorded == [(1, "fan")]
+    assert engine.stats()["evaluated"] == 1
+
+
+def test_reload_keeps_the_state_of_unchanged_rules():
+    engine, submitted, _ = make_engine()
+    rows = [{"rule_id": 1, "rule_description": "Turn on the fan when temperature is above 30"}]
+    engine.load(rows)
+    engine.evaluate("temp", "31")
+    engine.load(rows)
+    engine.evaluate("temp", "32")
+    assert submitted == [("fan", 100)]
+    engine.load([{"rule_id": 1, "rule_description": "Turn on the fan when temperature is above 35"}])
+    assert not engine.rules()[0]["active"]
+
+
+def test_rules_on_feeds_registered_later_are_compiled_then():
+    engine, submitted, _ = make_engine()
+    description = {"feed": "home-1.temp", "threshold": 30, "action": {"feed": "fan", "value": 100}}
+    engine.load([{"rule_id": 1, "rule_description": json.dumps(description)}])
+    assert engine.stats()["skipped"] == 1
+    engine.add_feeds(["home-1.temp"])
+    assert engine.stats()["loaded"] == 1
+    engine.evaluate("home-1.temp", "31")
+    assert submitted == [("fan", 100)]
+
+
+def test_route_picks_the_published_feed():
+    submitted, recorded = [], []
+    engine = RuleEngine(lambda feed, value: submitted.append((feed, value)),
+                        lambda rule, feed, activity: recorded.append(feed), FEEDS,
+                        route=lambda rule, feed: "home-1." + feed)
+    engine.load([{"rule_id": 1, "rule_description": "Turn on the fan when temperature is above 30"}])
+    engine.evaluate("temp", "31")
+    assert submitted == [("home-1.fan", 100)]
+    assert recorded == ["home-1.fan"]
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from sensorArchive import DAY_MS, HOUR_MS, SensorArchive
+
+NOW = 400 * DAY_MS
+
+
+@pytest.fixture
+def archive(tmp_path):
+    # Opened for reading only: no writer thread, the tests write and compact themselves
+    archive = SensorArchive(str(tmp_path / "archive.sqlite3"), raw_days=7, hourly_days=90)
+    archive.start(write=False)
+    yield archive
+    archive.stop()
+
+
+def rollups(archive, resolution):
+    return archive._connection().execute(
+        "SELECT ts, min, max, sum, count, last, last_ts FROM rollups WHERE resolution = ? ORDER BY ts",
+        (resolution,)).fetchall()
+
+
+def test_old_samples_are_rolled_up_into_hours(archive):
+    hour = NOW - 10 * DAY_MS
+    archive._write([("temp", hour + 1_000, 20.0), ("temp", hour + 2_000, 26.0), ("temp", hour + 3_000, 23.0),
+                    ("temp", NOW - 1_000, 30.0)])
+    archive.rollup(NOW)
+    assert rollups(archive, HOUR_MS) == [(hour, 20.0, 26.0, 69.0, 3, 23.0, hour + 3_000)]
+    # Recent samples stay raw
+    assert archive.samples("temp")[0].tolist() == [NOW - 1_000]
+
+
+def test_late_samples_merge_into_a_rolled_up_hour(archive):
+    hour = NOW - 10 * DAY_MS
+    archive._write([("temp", hour + 1_000, 20.0), ("temp", hour + 3_000, 23.0)])
+    archive.rollup(NOW)
+    # Arrive after the hour was compacted: one later than its last sample, one earlier
+    archive._write([("temp", hour + 4_000, 18.0), ("temp", hour + 500, 40.0)])
+    archive.rollup(NOW)
+    assert rollups(archive, HOUR_MS) == [(hour, 18.0, 40.0, 101.0, 4, 18.0, hour + 4_000)]
+    assert len(archive.samples("temp")[0]) == 0
+
+
+def test_late_sample_older_than_the_last_keeps_the_last_value(archive):
+    hour = NOW - 10 * DAY_MS
+    archive._write([("temp", hour + 3_000, 23.0)])
+    archive.rollup(NOW)
+    archive._write([("temp", hour + 1_000, 99.0)])
+    archive.rollup(NOW)
+    (_, _, _, _, count, last, last_ts), = rollups(archive, HOUR_MS)
+    assert (count, last, last_ts) == (2, 23.0, hour + 3_000)
+
+
+def test_hours_are_rolled_up_into_days(archive):
+    day = NOW - 100 * DAY_MS
+    archive._write([("temp", day + 1 * HOUR_MS, 10.0), ("temp", day + 1 * HOUR_MS + 60_000, 14.0),
+                    ("temp", day + 5 * HOUR_MS, 30.0), ("humid", day + 2 * HOUR_MS, 60.0)])
+    archive.rollup(NOW)
+    assert rollups(archive, HOUR_MS) == []
+    days = archive._connection().execute(
+        "SELECT feed, ts, min, max, sum, count, last FROM rollups WHERE resolution = ? ORDER BY feed",
+        (DAY_MS,)).fetchall()
+    assert days == [("humid", day, 60.0, 60.0, 60.0, 1, 60.0), ("temp", day, 10.0, 30.0, 54.0, 3, 30.0)]
+
+
+def test_points_use_means_where_compacted(archive):
+    hour = NOW - 10 * DAY_MS
+    archive._write([("temp", hour + 1_000, 20.0), ("temp", hour + 2_000, 30.0), ("temp", NOW - 1_000, 21.0)])
+    archive.rollup(NOW)
+    timestamps, values = archive.points("temp")
+    assert timestamps.tolist() == [hour, NOW - 1_000]
+    assert values.tolist() == [25.0, 21.0]
+
+
+def test_points_limit_keeps_the_most_recent(archive):
+    hour = NOW - 10 * DAY_MS
+    archive._write([("temp", hour + 1_000, 20.0), ("temp", NOW - 2_000, 21.0), ("temp", NOW - 1_000, 22.0)])
+    archive.rollup(NOW)
+    timestamps, values = archive.points("temp", limit=2)
+    assert timestamps.tolist() == [NOW - 2_000, NOW - 1_000]
+    assert values.tolist() == [21.0, 22.0]
+    assert archive.points("temp", until=NOW - 1_500)[1].tolist() == [20.0, 21.0]
+
+
+def test_writer_thread_flushes_on_stop(tmp_path):
+    archive = SensorArchive(str(tmp_path / "archive.sqlite3"), batch_size=100, flush_interval=30)
+    archive.start()
+    now = int(time.time() * 1000)
+    archive.add("temp", "21.5", now)
+    archive.add("temp", "22", now)  # Same millisecond again: the newer value wins
+    archive.add("color", "#FF0000", now)
+    archive.stop()
+    assert archive.samples("temp")[1].tolist() == [22.0]
+    assert len(archive.samples("color")[0]) == 0
+    assert archive.stats()["added"] == 2
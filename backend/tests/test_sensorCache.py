@@ -0,0 +1,46 @@
+import time
+
+from sensorCache import LatestValueCache, utc_timestamp
+
+
+def test_cold_feed_has_no_value():
+    cache = LatestValueCache(["temp"])
+    assert cache.get("temp") is None
+    assert cache.get("unknown") is None
+    assert cache.snapshot() == {}
+
+
+def test_latest_update_wins():
+    cache = LatestValueCache(["temp", "humid"])
+    cache.update("temp", "21.5", "2026-01-01T00:00:00Z")
+    cache.update("temp", "22.0", "2026-01-01T00:00:10Z")
+    assert cache.get("temp") == {"value": "22.0", "timestamp": "2026-01-01T00:00:10Z"}
+    assert cache.snapshot() == {"temp": {"value": "22.0", "timestamp": "2026-01-01T00:00:10Z"}}
+
+
+def test_values_older_than_max_age_are_stale():
+    cache = LatestValueCache(["temp"], max_age=60)
+    cache.update("temp", "21.5", age=61)
+    assert cache.get("temp") is None
+    assert cache.get("temp", max_age=120)["value"] == "21.5"
+    # Stale values are still part of the snapshot
+    assert cache.snapshot()["temp"]["value"] == "21.5"
+
+
+def test_refresh_does_not_overwrite_a_newer_mqtt_value():
+    cache = LatestValueCache(["temp"])
+    requested_at = time.monotonic()
+    cache.update("temp", "23.0", "2026-01-01T00:00:20Z")
+    kept = cache.refresh("temp", "21.0", "2026-01-01T00:00:00Z", requested_at)
+    assert kept == {"value": "23.0", "timestamp": "2026-01-01T00:00:20Z"}
+
+
+def test_refresh_fills_a_cold_or_older_entry():
+    cache = LatestValueCache(["temp"])
+    assert cache.refresh("temp", "21.0", "2026-01-01T00:00:00Z", time.monotonic())["value"] == "21.0"
+    cache.update("temp", "20.0", age=10)
+    assert cache.refresh("temp", "22.0", "2026-01-01T00:00:30Z", time.monotonic())["value"] == "22.0"
+
+
+def test_utc_timestamp_matches_adafruit_format():
+    assert utc_timestamp(0) == "1970-01-01T00:00:00Z"
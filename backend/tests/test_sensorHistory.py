@@ -0,0 +1,63 @@
+from collections import namedtuple
+from datetime import datetime
+
+import pytest
+
+from sensorHistory import FeedSeries, SeriesStore, to_epoch_ms
+
+Data = namedtuple("Data", "value created_at")
+
+
+def test_ring_buffer_keeps_the_most_recent_samples():
+    series = FeedSeries(capacity=3)
+    for n in range(5):
+        series.append(n * 1000, float(n))
+    timestamps, values = series.query()
+    assert len(series) == 3
+    assert timestamps.tolist() == [2000, 3000, 4000]
+    assert values.tolist() == [2.0, 3.0, 4.0]
+    assert series.oldest() == 2000
+
+
+def test_query_range_is_inclusive_and_limit_takes_the_newest():
+    series = FeedSeries(capacity=10)
+    for n in range(6):
+        series.append(n * 1000, float(n))
+    assert series.query(since=1000, until=4000)[0].tolist() == [1000, 2000, 3000, 4000]
+    assert series.query(since=1000, until=4000, limit=2)[1].tolist() == [3.0, 4.0]
+    assert len(series.query(since=9000)[0]) == 0
+
+
+def test_seed_goes_in_front_of_live_samples():
+    series = FeedSeries(capacity=4)
+    series.append(5000, 5.0)
+    # 6000 is already covered by MQTT, the 3 oldest only fit partly
+    series.seed([3000, 1000, 2000, 6000, 4000], [3.0, 1.0, 2.0, 6.0, 4.0])
+    assert series.query()[0].tolist() == [2000, 3000, 4000, 5000]
+    assert series.seeded
+    series.append(7000, 7.0)
+    assert series.query()[0].tolist() == [3000, 4000, 5000, 7000]
+
+
+def test_store_only_keeps_numeric_values_of_tracked_feeds():
+    store = SeriesStore(["temp"], capacity=10)
+    store.add("temp", "21.5", 1000)
+    store.add("temp", "#FF0000", 2000)
+    store.add("color", "12", 3000)
+    assert store.query("temp") == [{"value": "21.5", "timestamp": "1970-01-01T00:00:01Z"}]
+    with pytest.raises(LookupError):
+        store.series("color")
+    store.track(["color"])
+    store.add("color", "12", 3000)
+    assert len(store.series("color")) == 1
+
+
+def test_store_is_seeded_once_and_answers_newest_first():
+    store = SeriesStore(["temp"], capacity=10)
+    store.seed_entries("temp", [Data("20", "2026-01-01T00:00:00Z"), Data("n/a", "2026-01-01T00:00:05Z"),
+                                Data("21", "2026-01-01T00:00:10Z")])
+    store.seed_entries("temp", [Data("99", "2025-12-31T00:00:00Z")])
+    entries = store.query("temp", since=datetime(2026, 1, 1))
+    assert [entry["value"] for entry in entries] == ["21", "20"]
+    assert entries[0]["timestamp"] == "2026-01-01T00:00:10Z"
+    assert to_epoch_ms("2026-01-01T00:00:10Z") == to_epoch_ms(datetime(2026, 1, 1, 0, 0, 10))
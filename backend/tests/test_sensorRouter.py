@@ -0,0 +1,68 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import responseCache
+from adafruitConnection import get_latest_cache
+from responseCache import ResponseCache
+from routers import sensor
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(responseCache, "response_cache", ResponseCache())
+    for feed_id, value in (("temp", "21.5"), ("humid", "40"), ("light", "300")):
+        get_latest_cache().update(feed_id, value, "2026-01-01T00:00:00Z")
+    app = FastAPI()
+    app.include_router(sensor.router)
+    return TestClient(app)
+
+
+@pytest.fixture
+def failing(monkeypatch):
+    """Feeds whose next reads fail, as an unreachable Adafruit IO would."""
+    failing = {}
+    read_latest = sensor.read_latest
+
+    async def flaky(feed_id):
+        if failing.get(feed_id):
+            failing[feed_id] -= 1
+            raise ConnectionError("Adafruit IO unreachable")
+        return await read_latest(feed_id)
+
+    monkeypatch.setattr(sensor, "read_latest", flaky)
+    return failing
+
+
+def test_snapshot_of_the_latest_values(client):
+    response = client.get("/sensor/snapshot", params={"feeds": "temp,humid", "limit": 0})
+    assert response.json() == {"temp": {"latest": {"value": "21.5", "timestamp": "2026-01-01T00:00:00Z"}},
+                               "humid": {"latest": {"value": "40", "timestamp": "2026-01-01T00:00:00Z"}}}
+    again = client.get("/sensor/snapshot", params={"feeds": "temp,humid", "limit": 0},
+                       headers={"If-None-Match": response.headers["etag"]})
+    assert again.status_code == 304
+
+
+def test_failed_sensor_does_not_fail_the_others(client, failing):
+    failing["humid"] = 1
+    body = client.get("/sensor/snapshot", params={"limit": 0}).json()
+    assert body["humid"] == {"error": "Adafruit IO unreachable"}
+    assert body["temp"]["latest"]["value"] == "21.5"
+    assert body["light"]["latest"]["value"] == "300"
+
+
+def test_snapshot_with_a_failed_sensor_is_not_cached(client, failing):
+    failing["humid"] = 1
+    failed = client.get("/sensor/snapshot", params={"limit": 0})
+    # Nothing changed on the feeds, yet the next poll reads the sensor again instead of replaying the error
+    retried = client.get("/sensor/snapshot", params={"limit": 0}, headers={"If-None-Match": failed.headers["etag"]})
+    assert retried.status_code == 200
+    assert retried.json()["humid"]["latest"]["value"] == "40"
+    assert client.get("/sensor/snapshot", params={"limit": 0},
+                      headers={"If-None-Match": retried.headers["etag"]}).status_code == 304
+
+
+def test_unknown_sensor_is_refused(client):
+    response = client.get("/sensor/snapshot", params={"feeds": "temp,pressure"})
+    assert response.status_code == 404
+    assert "pressure" in response.json()["detail"]
@@ -0,0 +1,110 @@
+import sqlite3
+
+import pytest
+
+from sharedState import EventLogFollower, SharedStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SharedStore(str(tmp_path / "state.sqlite3"))
+
+
+def test_follower_replays_the_log_once_then_applies_new_events_live(store):
+    store.append_events([("value", "temp", "21.5", 1_000), ("value", "humid", "40", 1_000)])
+    store.publish_tag("history")
+    values, tags = [], []
+    follower = EventLogFollower(store, lambda *event: values.append(event), tags.append)
+    assert follower.poll() == 3
+    assert values == [("temp", "21.5", 1_000, False), ("humid", "40", 1_000, False)]
+    assert tags == ["history"]
+    store.append_events([("value", "temp", "22", 2_000)])
+    assert follower.poll() == 1
+    assert values[-1] == ("temp", "22", 2_000, True)
+    assert follower.poll() == 0
+
+
+def test_follower_reads_in_batches_and_skips_failing_events(store):
+    store.append_events([("value", "temp", str(n), n) for n in range(5)])
+    seen = []
+
+    def on_value(feed, payload, ts, live):
+        if payload == "2":
+            raise ValueError("bad payload")
+        seen.append(payload)
+
+    follower = EventLogFollower(store, on_value, None, batch=2)
+    assert follower.poll() == 5
+    assert seen == ["0", "1", "3", "4"]
+    assert follower.stats() == {"applied": 5, "seq": 5}
+
+
+def test_log_is_trimmed_to_its_retention(tmp_path):
+    store = SharedStore(str(tmp_path / "state.sqlite3"), retention=3)
+    store.append_events([("value", "temp", str(n), n) for n in range(5)])
+    assert [row[3] for row in store.events_after(0)] == ["2", "3", "4"]
+
+
+def test_commands_are_taken_once_in_order(store):
+    store.queue("publish", "fan", 40)
+    store.queue("publish", "switch", 1)
+    store.queue("reload", "devices")
+    assert store.pending_commands() == 3
+    assert store.take_commands(limit=2) == [("publish", "fan", "40"), ("publish", "switch", "1")]
+    assert store.take_commands() == [("reload", "devices", None)]
+    assert store.take_commands() == []
+
+
+def test_new_bucket_starts_full(store):
+    assert [store.take_token("a", 1.0, 3, now=100.0) for _ in range(3)] == [(True, 0.0)] * 3
+    allowed, retry_after = store.take_token("a", 1.0, 3, now=100.0)
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+
+
+def test_bucket_refills_with_time(store):
+    store.take_token("a", 2.0, 1, now=100.0)
+    allowed, retry_after = store.take_token("a", 2.0, 1, now=100.25)
+    assert not allowed
+    assert retry_after == pytest.approx(0.25)
+    assert store.take_token("a", 2.0, 1, now=100.5) == (True, 0.0)
+
+
+def test_refill_stops_at_the_burst(store):
+    store.take_token("a", 1.0, 2, now=100.0)
+    assert [store.take_token("a", 1.0, 2, now=1000.0)[0] for _ in range(3)] == [True, True, False]
+
+
+def test_refused_request_takes_nothing(store):
+    store.take_token("a", 1.0, 1, now=100.0)
+    for _ in range(5):
+        assert not store.take_token("a", 1.0, 1, now=100.5)[0]
+    assert store.take_token("a", 1.0, 1, now=101.0)[0]
+
+
+def test_clock_going_back_does_not_refill(store):
+    store.take_token("a", 1.0, 1, now=100.0)
+    assert not store.take_token("a", 1.0, 1, now=50.0)[0]
+    # The bucket is now dated 50: a refill is measured from there
+    assert store.take_token("a", 1.0, 1, now=51.0)[0]
+
+
+def test_buckets_are_independent_and_shared_between_connections(store):
+    store.take_token("a", 1.0, 1, now=100.0)
+    assert store.take_token("b", 1.0, 1, now=100.0)[0]
+    other = SharedStore(store.path)
+    assert not other.take_token("a", 1.0, 1, now=100.0)[0]
+    assert store.bucket_count() == 2
+
+
+def test_locked_file_fails_fast(store, monkeypatch):
+    import sharedState
+    monkeypatch.setattr(sharedState, "SHARED_RATE_LIMIT_TIMEOUT", 0.01)
+    store.take_token("a", 1.0, 1, now=100.0)
+    holder = sqlite3.connect(store.path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            store.take_token("a", 1.0, 1, now=200.0)
+    finally:
+        holder.execute("ROLLBACK")
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from wireFormat import COLUMNS_MAGIC, HEADER, decode_columns, encode_columns
+
+
+def test_round_trip():
+    timestamps = np.array([1_700_000_000_000, 1_700_000_010_000, 1_700_000_019_500])
+    values = np.array([23.5, 23.6, -4.25])
+    body = encode_columns(timestamps, values)
+    assert len(body) == HEADER.size + 2 * 4 + 3 * 4
+    decoded = decode_columns(body)
+    assert decoded["timestamp"].tolist() == timestamps.tolist()
+    assert decoded["value"].tolist() == pytest.approx(values.tolist())
+    assert decoded["feed"] is None
+
+
+def test_values_are_float32():
+    decoded = decode_columns(encode_columns([0], [0.1]))
+    assert decoded["value"].dtype == np.float32
+    assert decoded["value"][0] == np.float32(0.1)
+
+
+def test_gaps_past_int32_switch_to_wide_deltas():
+    timestamps = [0, 2**31, 2**31 + 5, 2**33]
+    body = encode_columns(timestamps, [1, 2, 3, 4])
+    assert body[4] & 1
+    assert len(body) == HEADER.size + 3 * 8 + 4 * 4
+    assert decode_columns(body)["timestamp"].tolist() == timestamps
+
+
+def test_unordered_timestamps_keep_negative_deltas():
+    timestamps = [1_000, 500, 2_000]
+    assert decode_columns(encode_columns(timestamps, [1, 2, 3]))["timestamp"].tolist() == timestamps
+
+
+def test_feed_column():
+    body = encode_columns([10, 20, 30], [1, 2, 3], feeds=[1, 0, 1], names=("temp", "humid"))
+    decoded = decode_columns(body)
+    assert decoded["feed"] == ["humid", "temp", "humid"]
+    assert decoded["timestamp"].tolist() == [10, 20, 30]
+
+
+@pytest.mark.parametrize("feeds, names", [(None, ()), ([], ("temp",))])
+def test_empty(feeds, names):
+    body = encode_columns([], [], feeds=feeds, names=names)
+    decoded = decode_columns(body)
+    assert len(decoded["timestamp"]) == 0
+    assert len(decoded["value"]) == 0
+    assert decoded["feed"] == (None if feeds is None else [])
+
+
+def test_single_sample_has_no_deltas():
+    body = encode_columns([1_700_000_000_000], [21.0])
+    assert len(body) == HEADER.size + 4
+    assert decode_columns(body)["timestamp"].tolist() == [1_700_000_000_000]
+
+
+def test_other_payloads_are_refused():
+    body = encode_columns([1], [1])
+    with pytest.raises(ValueError):
+        decode_columns(b"XXXX" + body[len(COLUMNS_MAGIC):])
@@ -0,0 +1,231 @@
+"""
+Pluggable transports for the Adafruit IO clients.
+
+AIO_TRANSPORT selects where the MQTT and REST clients connect:
+- "adafruit" (default): io.adafruit.com
+- "local": an MQTT broker such as mosquitto at MQTT_HOST:MQTT_PORT (no TLS), and an
+  Adafruit IO compatible REST API at AIO_REST_URL
+- "memory": an in-process fake broker, no network at all (tests, benchmarks, CI)
+
+Adafruit_IO (with paho and requests) and httpx are only imported when the first client that
+needs them is created: together they were a third of the import time of the app.
+"""
+import os
+import queue
+import threading
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+
+from asyncClients import AsyncAdafruitClient
+
+AIO_TRANSPORT = os.getenv("AIO_TRANSPORT", "adafruit")
+MQTT_HOST = os.getenv("MQTT_HOST", "localhost")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+AIO_REST_URL = os.getenv("AIO_REST_URL", "https://io.adafruit.com")
+# Values kept per feed by the in-memory broker to answer REST queries
+MEMORY_FEED_HISTORY = int(os.getenv("MEMORY_FEED_HISTORY", "10000"))
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class InMemoryBroker:
+    """
+    Stand-in for Adafruit IO: routes publishes to subscribed clients and keeps the data
+    points of every feed so the fake REST clients can serve receive() / data().
+    Messages are delivered on a broker thread, like paho's network loop.
+    """
+
+    def __init__(self, history: int = MEMORY_FEED_HISTORY):
+        self._subscriptions = defaultdict(set)
+        self._data = defaultdict(lambda: deque(maxlen=history))
+        self._lock = threading.Lock()
+        self._inbox = queue.SimpleQueue()
+        self._thread = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._deliver_loop, name="memory-broker", daemon=True)
+                self._thread.start()
+
+    def subscribe(self, client, feed_id):
+        self._ensure_started()
+        with self._lock:
+            self._subscriptions[feed_id].add(client)
+
+    def unsubscribe(self, client, feed_id=None):
+        with self._lock:
+            feeds = [feed_id] if feed_id else list(self._subscriptions)
+            for feed in feeds:
+                self._subscriptions[feed].discard(client)
+
+    def publish(self, feed_id, value):
+        from Adafruit_IO import Data
+
+        payload = str(value)
+        with self._lock:
+            self._data[feed_id].append(Data(value=payload, created_at=_now()))
+        self._inbox.put((feed_id, payload))
+
+    def _deliver_loop(self):
+        while True:
+            feed_id, payload = self._inbox.get()
+            if feed_id == "__sync__":
+                payload.set()
+                continue
+            with self._lock:
+                clients = tuple(self._subscriptions.get(feed_id, ()))
+            for client in clients:
+                client._deliver(feed_id, payload)
+
+    def join(self, timeout: float = None):
+        """Wait until every message published so far has been delivered (best effort, for tests)."""
+        done = threading.Event()
+        self._inbox.put(("__sync__", done))
+        self._ensure_started()
+        return done.wait(timeout)
+
+    def last(self, feed_id):
+        with self._lock:
+            points = self._data.get(feed_id)
+            return points[-1] if points else None
+
+    def history(self, feed_id, max_results: int = None):
+        with self._lock:
+            points = list(self._data.get(feed_id, ()))
+        points.reverse()  # newest first, like Adafruit IO
+        return points[:max_results] if max_results else points
+
+
+class InMemoryMQTTClient:
+    """Same interface as Adafruit_IO.MQTTClient (the parts this backend uses), backed by InMemoryBroker."""
+
+    def __init__(self, broker: InMemoryBroker, username: str = "memory"):
+        self._broker = broker
+        self._username = username
+        self._connected = False
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_subscribe = None
+
+    def connect(self, **kwargs):
+        self._connected = True
+
+    def is_connected(self):
+        return self._connected
+
+    def loop_background(self, stop=None):
+        if self.on_connect is not None:
+            self.on_connect(self)
+
+    def disconnect(self):
+        if self._connected:
+            self._connected = False
+            self._broker.unsubscribe(self)
+            if self.on_disconnect is not None:
+                self.on_disconnect(self)
+
+    def subscribe(self, feed_id, feed_user=None, qos=0):
+        self._broker.subscribe(self, feed_id)
+
+    def unsubscribe(self, feed_id=None, group_id=None):
+        self._broker.unsubscribe(self, feed_id)
+
+    def publish(self, feed_id, value=None, group_id=None, feed_user=None):
+        self._broker.publish(feed_id, value)
+
+    def _deliver(self, feed_id, payload):
+        if self.on_message is not None:
+            self.on_message(self, feed_id, payload)
+
+
+class InMemoryRestClient:
+    """Blocking REST client (receive / data) reading from an InMemoryBroker."""
+
+    def __init__(self, broker: InMemoryBroker):
+        self._broker = broker
+
+    def receive(self, feed):
+        data = self._broker.last(feed)
+        if data is None:
+            raise ValueError(f"Feed '{feed}' has no data")
+        return data
+
+    def data(self, feed, data_id=None, max_results=1000):
+        return self._broker.history(feed, max_results)
+
+
+def memory_http_transport(broker: InMemoryBroker):
+    """httpx transport answering the Adafruit IO REST routes used by AsyncAdafruitClient from the broker."""
+    import httpx
+
+    def handler(request: httpx.Request):
+        # /api/v2/{username}/feeds/{feed}/data[/last]
+        parts = request.url.path.strip("/").split("/")
+        if len(parts) < 6 or parts[3] != "feeds" or parts[5] != "data":
+            return httpx.Response(404, json={"error": "not found"})
+        feed = parts[4]
+        if parts[-1] == "last":
+            data = broker.last(feed)
+            if data is None:
+                return httpx.Response(404, json={"error": "not found"})
+            return httpx.Response(200, json={"value": data.value, "created_at": data.created_at})
+        limit = int(request.url.params.get("limit", 1000))
+        return httpx.Response(200, json=[
+            {"value": data.value, "created_at": data.created_at} for data in broker.history(feed, limit)
+        ])
+
+    return httpx.MockTransport(handler)
+
+
+memory_broker = InMemoryBroker()
+
+def get_memory_broker():
+    return memory_broker
+
+
+def create_mqtt_client(username, key, transport: str = AIO_TRANSPORT):
+    """A new, unconnected MQTT client for the selected transport (a fresh one is needed per reconnect)."""
+    if transport == "memory":
+        return InMemoryMQTTClient(memory_broker, username)
+    if transport == "local":
+        from Adafruit_IO import MQTTClient
+
+        mqtt_client = MQTTClient(username, key, service_host=MQTT_HOST, secure=False)
+        mqtt_client._service_port = MQTT_PORT
+        return mqtt_client
+    if transport == "adafruit":
+        from Adafruit_IO import MQTTClient
+
+        return MQTTClient(username, key)
+    raise ValueError(f"Unknown AIO_TRANSPORT '{transport}', expected adafruit, local or memory")
+
+
+def create_rest_client(username, key, transport: str = AIO_TRANSPORT):
+    """Blocking REST client (Adafruit_IO.Client interface) for the selected transport."""
+    if transport == "memory":
+        return InMemoryRestClient(memory_broker)
+    if transport == "local":
+        from Adafruit_IO import Client
+
+        return Client(username, key, base_url=AIO_REST_URL)
+    if transport == "adafruit":
+        from Adafruit_IO import Client
+
+        return Client(username, key)
+    raise ValueError(f"Unknown AIO_TRANSPORT '{transport}', expected adafruit, local or memory")
+
+
+def create_async_rest_client(username, key, transport: str = AIO_TRANSPORT):
+    """AsyncAdafruitClient for the selected transport, no connection is opened before its first call."""
+    if transport == "memory":
+        return AsyncAdafruitClient(username, key, transport=memory_http_transport(memory_broker))
+    if transport == "local":
+        return AsyncAdafruitClient(username, key, base_url=AIO_REST_URL)
+    if transport == "adafruit":
+        return AsyncAdafruitClient(username, key)
+    raise ValueError(f"Unknown AIO_TRANSPORT '{transport}', expected adafruit, local or memory")
+
@@ -0,0 +1,95 @@
+"""
+Compact binary encoding of sensor samples, offered next to JSON by the history routes and the WebSocket.
+
+JSON history is a list of {"value": "23.5", "timestamp": "2025-05-01T10:00:00Z"} objects, about 50
+bytes per sample. In columns, with timestamps delta-encoded against the previous one, a sample
+costs 8 bytes (4 for the delta, 4 for the float32 value) and decodes with two typed-array views.
+All integers are little-endian:
+
+    magic    4s   b"SHC1"
+    flags    u8   1 = deltas are int64 (a gap of more than ~24 days), 2 = feed column present
+    names    u8   feed names in the table below, 0 without a feed column
+    reserved u16
+    count    u32  samples
+    first    i64  timestamp of the first sample, epoch ms (0 when count is 0)
+    table         `names` times: u8 length + UTF-8 feed name
+    deltas        count - 1 times i32 (i64 with flag 1): timestamp[i] - timestamp[i - 1]
+    values        count times f32
+    feeds         count times u8, index into the table (with flag 2 only)
+
+A client asks for it with `Accept: application/vnd.smarthome.columns` or `?format=columns`.
+"""
+import struct
+
+import numpy as np
+
+COLUMNS_MEDIA_TYPE = "application/vnd.smarthome.columns"
+COLUMNS_MAGIC = b"SHC1"
+
+WIDE_DELTAS = 1
+FEED_COLUMN = 2
+
+HEADER = struct.Struct("<4sBBHIq")
+INT32 = np.iinfo(np.int32)
+
+
+def wants_columns(connection) -> bool:
+    """True if a request or WebSocket asked for the columnar encoding instead of JSON."""
+    if connection.query_params.get("format") == "columns":
+        return True
+    return COLUMNS_MEDIA_TYPE in connection.headers.get("accept", "")
+
+
+def encode_columns(timestamps, values, feeds=None, names=()) -> bytes:
+    """
+    Samples as one columnar frame. `feeds` (optional) gives each sample's index into `names`,
+    for frames mixing several feeds like the WebSocket batches.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    deltas = np.diff(timestamps)
+    flags = 0
+    if len(deltas) and (deltas.min() < INT32.min or deltas.max() > INT32.max):
+        flags |= WIDE_DELTAS
+    if feeds is not None:
+        flags |= FEED_COLUMN
+
+    parts = [HEADER.pack(COLUMNS_MAGIC, flags, len(names), 0, len(timestamps),
+                         int(timestamps[0]) if len(timestamps) else 0)]
+    for name in names:
+        encoded = name.encode()
+        parts.append(bytes((len(encoded),)) + encoded)
+    parts.append(deltas.astype("<i8" if flags & WIDE_DELTAS else "<i4").tobytes())
+    parts.append(values.astype("<f4").tobytes())
+    if feeds is not None:
+        parts.append(np.asarray(feeds, dtype=np.uint8).tobytes())
+    return b"".join(parts)
+
+
+def decode_columns(body: bytes) -> dict:
+    """
+    Inverse of encode_columns: {"timestamp": int64 epoch ms, "value": float32, "feed": names or None}.
+    Reference for clients, also used by the benchmarks.
+    """
+    magic, flags, name_count, _, count, first = HEADER.unpack_from(body)
+    if magic != COLUMNS_MAGIC:
+        raise ValueError("Not a columnar frame")
+    offset = HEADER.size
+    names = []
+    for _ in range(name_count):
+        length = body[offset]
+        names.append(body[offset + 1:offset + 1 + length].decode())
+        offset += 1 + length
+
+    delta_type = np.dtype("<i8" if flags & WIDE_DELTAS else "<i4")
+    deltas = np.frombuffer(body, dtype=delta_type, count=max(count - 1, 0), offset=offset)
+    offset += deltas.nbytes
+    values = np.frombuffer(body, dtype="<f4", count=count, offset=offset)
+    offset += values.nbytes
+    timestamps = np.concatenate(([first], first + np.cumsum(deltas, dtype=np.int64)))[:count]
+
+    feeds = None
+    if flags & FEED_COLUMN:
+        indexes = np.frombuffer(body, dtype=np.uint8, count=count, offset=offset)
+        feeds = [names[index] for index in indexes.tolist()]
+    return {"timestamp": timestamps, "value": values, "feed": feeds}
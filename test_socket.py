@@ -1,100 +1,251 @@
+"""
+Fire detection client: streams camera (or video file) frames to the detection server and
+draws the boxes it returns.
+
+Capture, encode, send and receive are separate stages connected by bounded queues, and up to
+MAX_IN_FLIGHT frames wait for their detections at once, so throughput is not capped by the
+network round trip. A frame that looks like the last one sent is not sent again, the latest
+detections are drawn on it instead.
+
+    python test_socket.py                                  # camera 0
+    python test_socket.py --source fire.mp4 --no-display   # offline benchmark of the detection path
+"""
+import argparse
 import asyncio
-import time
-import hashlib
+import json
 import sys
+import time
+from collections import OrderedDict
 
 import cv2
 import websockets
-import json
 from imutils.video import VideoStream
 
 # Configuration
-oracle_ip   = "129.150.38.89"
-URI         = f"ws://{oracle_ip}:5000/ws"
-ENC_QUALITY = 75
-RESIZE      = (320, 256)
-FPS_TARGET  = 24
-SEND_EVERY  = 2  # send every 2nd captured frame
-
-async def detect_loop():
-    vs = VideoStream(src=0).start()
-    await asyncio.sleep(2.0)  # camera warm‑up
+oracle_ip      = "129.150.38.89"
+URI            = f"ws://{oracle_ip}:5000/ws"
+ENC_QUALITY    = 75
+RESIZE         = (320, 256)
+FPS_TARGET     = 24
+SEND_EVERY     = 2         # send every 2nd captured frame
+MAX_IN_FLIGHT  = 4         # frames sent and still waiting for their detections
+QUEUE_SIZE     = 4         # frames buffered between two stages
+DIFF_SIZE      = (32, 24)  # grey thumbnail compared to tell whether a frame changed
+DIFF_THRESHOLD = 3.0       # mean grey level difference (0-255) below which a frame is skipped
+
+
+class FrameSource:
+    """Camera index or video file. read() returns None once a file is exhausted."""
+
+    def __init__(self, source: str):
+        self.live = source.isdigit()
+        if self.live:
+            self._stream = VideoStream(src=int(source)).start()
+        else:
+            self._stream = cv2.VideoCapture(source)
+            if not self._stream.isOpened():
+                raise SystemExit(f"Cannot open {source}")
+
+    def read(self):
+        if self.live:
+            return self._stream.read()
+        ok, frame = self._stream.read()
+        return frame if ok else None
+
+    def stop(self):
+        if self.live:
+            self._stream.stop()
+        else:
+            self._stream.release()
+
+
+def encode(frame, last_thumb):
+    """(JPEG bytes, thumbnail) of the resized frame, (None, last_thumb) if it barely changed."""
+    small = cv2.resize(frame, RESIZE)
+    thumb = cv2.cvtColor(cv2.resize(small, DIFF_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    # Compared with the last frame *sent*, so a slow drift still gets sent at some point
+    if last_thumb is not None and cv2.absdiff(thumb, last_thumb).mean() < DIFF_THRESHOLD:
+        return None, last_thumb
+    _, jpg = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, ENC_QUALITY])
+    return jpg.tobytes(), thumb
+
+
+def draw(frame, dets):
+    # Boxes are relative to the resized frame, scale them to the full-res one
+    h0, w0 = frame.shape[:2]
+    fx = w0 / RESIZE[0]
+    fy = h0 / RESIZE[1]
+    for d in dets:
+        x1, y1, x2, y2 = d["bbox"]
+        x1 = int(x1 * fx);  x2 = int(x2 * fx)
+        y1 = int(y1 * fy);  y2 = int(y2 * fy)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
+        label = f"{d['class']} {d['confidence']:.2f}"
+        cv2.putText(
+            frame, label, (x1, y1 - 10),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2
+        )
+
+
+#### Stages
+async def capture(source, frames, stats, stop, every, realtime):
+    loop = asyncio.get_running_loop()
+    frame_time = 1 / FPS_TARGET
+    frame_id = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        frame = await loop.run_in_executor(None, source.read)
+        if frame is None:
+            if not source.live:
+                break  # end of the file
+            await asyncio.sleep(0.01)
+            continue
+        frame_id += 1
+        stats["captured"] += 1
+        if frame_id % every == 0:
+            if source.live and frames.full():
+                # Never let a live camera build a backlog: the oldest frame waiting goes
+                frames.get_nowait()
+                stats["dropped"] += 1
+            await frames.put((frame_id, frame))
+        if realtime:
+            await asyncio.sleep(max(0, frame_time - (time.perf_counter() - start)))
+    await frames.put(None)
+
+
+async def encoder(frames, encoded, results, stats):
+    loop = asyncio.get_running_loop()
+    last_thumb = None
+    while (item := await frames.get()) is not None:
+        frame_id, frame = item
+        data, last_thumb = await loop.run_in_executor(None, encode, frame, last_thumb)
+        if data is None:
+            stats["skipped"] += 1
+            await results.put((frame_id, frame, None))
+            continue
+        await encoded.put((frame_id, frame, data))
+    await encoded.put(None)
+
+
+async def sender(ws, encoded, in_flight, slots, stats):
+    while (item := await encoded.get()) is not None:
+        frame_id, frame, data = item
+        await slots.acquire()
+        in_flight[frame_id] = (frame, time.perf_counter())
+        await ws.send(data)
+        stats["sent"] += 1
+
+
+async def receiver(ws, in_flight, slots, results, stats):
+    try:
+        async for message in ws:
+            reply = json.loads(message)
+            # The server answers in send order; a {"frame_id", "detections"} reply is matched by id instead
+            if isinstance(reply, dict) and "frame_id" in reply:
+                frame_id, dets = reply["frame_id"], reply.get("detections", [])
+                entry = in_flight.pop(frame_id, None)
+            elif in_flight:
+                frame_id, entry = in_flight.popitem(last=False)
+                dets = reply
+            else:
+                continue
+            if entry is None:
+                continue
+            frame, sent_at = entry
+            stats["latencies"].append(time.perf_counter() - sent_at)
+            slots.release()
+            await results.put((frame_id, frame, dets))
+    except websockets.ConnectionClosedError as e:
+        print(f"Error: {e}", file=sys.stderr)
+    await results.put(None)
+
+
+async def stream(source, ws, in_flight, slots, results, stats, stop, args):
+    frames = asyncio.Queue(QUEUE_SIZE)
+    encoded = asyncio.Queue(QUEUE_SIZE)
+    await asyncio.gather(
+        capture(source, frames, stats, stop, args.every, source.live or args.realtime),
+        encoder(frames, encoded, results, stats),
+        sender(ws, encoded, in_flight, slots, stats),
+    )
+    # Everything is sent: wait for the detections still in flight, then end the receiver
+    deadline = time.perf_counter() + 10
+    while in_flight and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    await ws.close()
+
+
+async def display(results, stats, stop, show):
+    dets = []
+    while (item := await results.get()) is not None:
+        frame_id, frame, new_dets = item
+        if new_dets is not None:
+            dets = new_dets
+        stats["processed"] += 1
+        if not show:
+            continue
+        draw(frame, dets)
+        cv2.imshow("Fire Detection", frame)
+        if cv2.waitKey(1) & 0xFF == ord("q"):
+            print("Quitting...")
+            stop.set()
+            return
+
+
+def report(stats, elapsed):
+    latencies = sorted(stats["latencies"])
+    print(f"{stats['captured']} frames captured, {stats['sent']} sent, {stats['skipped']} skipped as unchanged, "
+          f"{stats['dropped']} dropped in {elapsed:.1f}s ({stats['processed'] / elapsed:.1f} frames/s processed)")
+    if latencies:
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+        print(f"Detection round trip: p50 {p50:.1f} ms, p95 {p95:.1f} ms")
+
+
+async def detect_loop(args):
+    source = FrameSource(args.source)
+    if source.live:
+        await asyncio.sleep(2.0)  # camera warm‑up
+
+    stats = {"captured": 0, "sent": 0, "skipped": 0, "dropped": 0, "processed": 0, "latencies": []}
+    stop = asyncio.Event()
+    # frame id -> (full-res frame, send time), in send order
+    in_flight = OrderedDict()
+    slots = asyncio.Semaphore(args.in_flight)
+    results = asyncio.Queue(QUEUE_SIZE)
+    tasks = []
+    started = time.perf_counter()
 
     try:
-        async with websockets.connect(URI, max_size=2**22) as ws:
-            frame_id   = 0
-            last_hash  = None
-            frame_time = 1 / FPS_TARGET
-
-            while True:
-                start = time.time()
-
-                # 1) grab original full‑res frame
-                frame = vs.read()
-                if frame is None:
-                    continue
-                h0, w0 = frame.shape[:2]
-
-                frame_id += 1
-                if frame_id % SEND_EVERY:
-                    await asyncio.sleep(0)
-                    continue
-
-                # 2) resize & JPEG encode to 320×256
-                small = cv2.resize(frame, RESIZE)
-                h1, w1 = small.shape[:2]
-                _, jpg = cv2.imencode(
-                    ".jpg", small,
-                    [cv2.IMWRITE_JPEG_QUALITY, ENC_QUALITY]
-                )
-                data = jpg.tobytes()
-
-                # 3) optional: skip identical frames
-                current_hash = hashlib.md5(data).hexdigest()
-                if current_hash == last_hash:
-                    await ws.send(data)
-                    await ws.recv()
-                    continue
-                last_hash = current_hash
-
-                # 4) send & await detection on small
-                await ws.send(data)
-                dets = json.loads(await ws.recv())
-
-                # 5) compute scale factors
-                fx = w0 / w1
-                fy = h0 / h1
-
-                # 6) draw scaled boxes on the full‑res frame
-                for d in dets:
-                    x1, y1, x2, y2 = d["bbox"]
-                    x1 = int(x1 * fx);  x2 = int(x2 * fx)
-                    y1 = int(y1 * fy);  y2 = int(y2 * fy)
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                    label = f"{d['class']} {d['confidence']:.2f}"
-                    cv2.putText(
-                        frame, label, (x1, y1 - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2
-                    )
-
-                # 7) display the full‑resolution frame
-                cv2.imshow("Fire Detection", frame)
-                if cv2.waitKey(1) & 0xFF == ord("q"):
-                    # Clean up and exit immediately
-                    print("Quitting...")
-                    return
-
-                # 8) throttle to target FPS
-                elapsed = time.time() - start
-                await asyncio.sleep(max(0, frame_time - elapsed))
+        async with websockets.connect(args.uri, max_size=2**22) as ws:
+            tasks = [
+                asyncio.create_task(receiver(ws, in_flight, slots, results, stats)),
+                asyncio.create_task(stream(source, ws, in_flight, slots, results, stats, stop, args)),
+            ]
+            await display(results, stats, stop, args.display)
+            for task in tasks:
+                if task.done() and task.exception() is not None:
+                    raise task.exception()
 
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
 
     finally:
         # Always invoked on exit or error
-        vs.stop()
+        for task in tasks:
+            task.cancel()
+        source.stop()
         cv2.destroyAllWindows()
 
+    report(stats, time.perf_counter() - started)
+
+
 if __name__ == "__main__":
-    asyncio.run(detect_loop())
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="0", help="Camera index or video file (default: camera 0)")
+    parser.add_argument("--uri", default=URI, help="Detection server WebSocket")
+    parser.add_argument("--every", type=int, default=SEND_EVERY, help="Send every Nth captured frame")
+    parser.add_argument("--in-flight", type=int, default=MAX_IN_FLIGHT, help="Frames awaiting detections at once")
+    parser.add_argument("--realtime", action="store_true", help="Play a video file at FPS_TARGET instead of as fast as possible")
+    parser.add_argument("--no-display", dest="display", action="store_false", help="Do not open a window (benchmarking)")
+    asyncio.run(detect_loop(parser.parse_args()))